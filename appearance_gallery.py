@@ -0,0 +1,58 @@
+import numpy as np
+
+from cost_matrix import normalize_features
+
+# appearance memory shared by all tracks.
+# every track owns one row of a preallocated array (its TrackStore slot): an exponential moving
+# average (EMA) of its feature vectors. the embeddings are stored L2-normalized, so comparing
+# tracks with new detections is a single matrix multiply.
+# memory is fixed at max_tracks x dim values whatever the length of the video.
+
+
+class AppearanceGallery:
+    def __init__(self, max_tracks=1024, dim=1024, momentum=0.9, dtype=np.float32):
+        """
+        max_tracks: number of rows, one per track slot
+        momentum: weight of the old EMA embedding when a new feature arrives
+        dtype: np.float32, or np.float16 to halve the memory
+        """
+        self.max_tracks = max_tracks
+        self.dim = dim
+        self.momentum = momentum
+        self.dtype = dtype
+
+        self.ema = np.zeros((max_tracks, dim), dtype=dtype)
+        self.counts = np.zeros(max_tracks, dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return self.ema.nbytes
+
+    def reset(self, rows):
+        """
+        Clear the rows of new (or removed) tracks.
+        """
+        self.counts[rows] = 0
+        self.ema[rows] = 0
+
+    def update(self, rows, features):
+        """
+        Move the EMA embedding of each row towards its new feature vector.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        features = normalize_features(np.asarray(features, dtype=np.float32).reshape(len(rows), self.dim))
+
+        # first feature of a track becomes its embedding, afterwards EMA and renormalize
+        first = (self.counts[rows] == 0)[:, None]
+        ema = np.where(first, features, self.momentum * self.ema[rows].astype(np.float32) + (1 - self.momentum) * features)
+        self.ema[rows] = normalize_features(ema)
+
+        self.counts[rows] += 1
+
+    def embeddings(self, rows):
+        """
+        (N,dim) float32 normalized EMA embeddings, zeros for rows that never got a feature.
+        """
+        return self.ema[rows].astype(np.float32)
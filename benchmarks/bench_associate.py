@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for the association cost matrix.
+
+Compares the per-pair total_cost loop against the broadcasted total_cost_matrix
+on random tracks/detections and checks that both give the same Hungarian assignment.
+
+usage: python benchmarks/bench_associate.py --sizes 10 40 100
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation
+from cost_matrix import total_cost_matrix
+from bench_utils import time_it, crowded_scene
+
+
+def random_scene(n, seed=0):
+    # old boxes of 40-200 px and the same boxes moved up to 8 px, as lists like the tracker had them
+    old_boxes, new_boxes, old_features, new_features = crowded_scene(n, widths=(40, 200), heights=(40, 200), motion=8, seed=seed)
+    return old_boxes.tolist(), new_boxes.tolist(), list(old_features), list(new_features)
+
+
+def loop_cost(tracker, old_boxes, new_boxes, old_features, new_features):
+    # the original associate() double loop, kept here as the reference
+    iou_matrix = np.zeros((len(old_boxes), len(new_boxes)), dtype=np.float32)
+    for i, old_box in enumerate(old_boxes):
+        for j, new_box in enumerate(new_boxes):
+            iou_matrix[i][j] = tracker.total_cost(old_box, new_box, old_features[i].reshape(1, -1), new_features[j].reshape(1, -1))
+    return iou_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loop vs vectorized association cost')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 40, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # total_cost does not touch the models, so skip __init__ and the weight loading
+    tracker = Yolo_implmentation.__new__(Yolo_implmentation)
+
+    print(f"{'pairs':>10} {'loop ms':>10} {'vector ms':>10} {'speedup':>10} {'same assignment':>16}")
+    for n in args.sizes:
+        scene = random_scene(n)
+        loop_time, loop_matrix = time_it(lambda: loop_cost(tracker, *scene), args.repeat)
+        vec_time, vec_matrix = time_it(lambda: total_cost_matrix(*scene), args.repeat)
+
+        loop_rows, loop_cols = linear_sum_assignment(-loop_matrix)
+        vec_rows, vec_cols = linear_sum_assignment(-vec_matrix)
+        same = np.array_equal(loop_rows, vec_rows) and np.array_equal(loop_cols, vec_cols) and np.allclose(loop_matrix, vec_matrix)
+
+        print(f"{n * n:>10} {loop_time * 1000:>10.2f} {vec_time * 1000:>10.2f} {loop_time / vec_time:>9.1f}x {str(same):>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark for class-partitioned association.
+
+On a mixed-class traffic scene (cars, trucks, buses, people and bikes sharing the same lanes)
+compares one association over all tracks and detections with one association per class group,
+as Yolo_implmentation.associate_partitioned does: time of the cost matrices + Hungarian solves,
+number of (track, detection) pairs scored, and matches between different class groups that the
+single solve makes and the partitioned one rules out.
+
+With --video, also runs the tracker on a video with PARTITION_BY_CLASS off and on and reports
+the FPS and the number of track ids.
+
+usage: python benchmarks/bench_class_partition.py --sizes 50 200 800
+       python benchmarks/bench_class_partition.py --video traffic.mp4
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cost_matrix import total_cost_matrix
+from bench_utils import time_it
+
+# coco class ids and how often they show up in the scene
+CLASS_MIX = {0: 0.3, 1: 0.05, 2: 0.45, 3: 0.05, 5: 0.05, 7: 0.1}
+# same groups as the tracker's default CLASS_GROUPS: (car, bus, truck) and (bicycle, motorbike)
+CLASS_GROUP = {0: 0, 1: 1, 2: 2, 3: 1, 5: 2, 7: 2}
+
+
+def traffic_scene(n, feature_dim=1024, w=1920, h=1080, seed=0):
+    """
+    n objects of mixed classes on a few horizontal lanes, so boxes of different classes overlap,
+    some people riding bikes, each moving along its lane. Some objects are occluded by one of
+    another class. Returns boxes, features and the class of every track and detection.
+    """
+    rng = np.random.default_rng(seed)
+    classes = rng.choice(list(CLASS_MIX), size=n, p=list(CLASS_MIX.values()))
+    lanes = rng.integers(0, 8, n)
+    x1 = rng.integers(0, w - 120, n)
+    y1 = 200 + lanes * 100 + rng.integers(-20, 20, n)
+    widths = np.where(classes == 0, rng.integers(20, 40, n), rng.integers(60, 120, n))
+    heights = np.where(classes == 0, rng.integers(60, 100, n), rng.integers(40, 80, n))
+    old_boxes = np.stack([x1, y1, x1 + widths, y1 + heights], axis=1)
+    # people riding a bike: a person box on top of every bicycle / motorbike
+    riders = np.flatnonzero((classes == 1) | (classes == 3))
+    people = rng.choice(np.flatnonzero(classes == 0), size=min(len(riders), np.sum(classes == 0)), replace=False)
+    riders = riders[:len(people)]
+    old_boxes[people] = old_boxes[riders] + np.array([10, -30, -10, -10])
+    new_boxes = old_boxes + np.stack([rng.integers(0, 12, n), rng.integers(-3, 4, n)] * 2, axis=1)
+    old_features = rng.random((n, feature_dim), dtype=np.float32)
+    new_features = old_features + 0.05 * rng.random((n, feature_dim), dtype=np.float32)
+    new_classes = classes.copy()
+
+    # occlusions: a tenth of the objects are missed by the detector, and about as many objects of
+    # another class show up in front of one of them (a truck passing in front of a car)
+    occluded = rng.choice(n, size=n // 10, replace=False)
+    occluders = rng.choice(occluded, size=len(occluded) // 2, replace=False)
+    occluder_classes = (classes[occluders] + 2) % 8
+    occluder_classes[~np.isin(occluder_classes, list(CLASS_MIX))] = 0
+    keep = np.setdiff1d(np.arange(n), occluded)
+    new_boxes = np.concatenate([new_boxes[keep], new_boxes[occluders]])
+    new_features = np.concatenate([new_features[keep], rng.random((len(occluders), feature_dim), dtype=np.float32)])
+    new_classes = np.concatenate([new_classes[keep], occluder_classes])
+
+    # the detections come in a different order than the tracks
+    perm = rng.permutation(len(new_boxes))
+    return old_boxes, new_boxes[perm], old_features, new_features[perm], classes, new_classes[perm]
+
+
+def solve(old_boxes, new_boxes, old_features, new_features):
+    iou_matrix = total_cost_matrix(old_boxes, new_boxes, old_features, new_features)
+    rows, cols = linear_sum_assignment(-iou_matrix)
+    keep = iou_matrix[rows, cols] >= 0.3
+    return rows[keep], cols[keep]
+
+
+def single_matches(old_boxes, new_boxes, old_features, new_features, old_groups, new_groups):
+    rows, cols = solve(old_boxes, new_boxes, old_features, new_features)
+    return set(zip(rows.tolist(), cols.tolist())), len(old_boxes) * len(new_boxes)
+
+
+def partitioned_matches(old_boxes, new_boxes, old_features, new_features, old_groups, new_groups):
+    matches, pairs = set(), 0
+    for group in np.union1d(old_groups, new_groups):
+        rows = np.flatnonzero(old_groups == group)
+        cols = np.flatnonzero(new_groups == group)
+        pairs += len(rows) * len(cols)
+        if len(rows) == 0 or len(cols) == 0:
+            continue
+        group_rows, group_cols = solve(old_boxes[rows], new_boxes[cols], old_features[rows], new_features[cols])
+        matches.update(zip(rows[group_rows].tolist(), cols[group_cols].tolist()))
+    return matches, pairs
+
+
+def compare_video(video_path, max_frames):
+    import cv2
+    from object_tracking import Yolo_implmentation
+
+    tracker = Yolo_implmentation()
+    tracker.HEADLESS = True
+    print(f"{'partitioned':>12} {'FPS':>8} {'track ids':>10}")
+    for partition in (False, True):
+        tracker.reset()
+        tracker.PARTITION_BY_CLASS = partition
+        cap = cv2.VideoCapture(video_path)
+        frames = 0
+        start = perf_counter()
+        while frames < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            tracker.process_frame(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            frames += 1
+        elapsed = perf_counter() - start
+        cap.release()
+        print(f"{str(partition):>12} {frames / elapsed:>8.1f} {tracker.idx:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark single vs class-partitioned association')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--video', type=str, default=None, help='Also compare the tracker end to end on this video')
+    parser.add_argument('--max-frames', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'single ms':>10} {'split ms':>10} {'speedup':>8} {'pairs':>9} {'split pairs':>12} {'cross-class':>12}")
+    for n in args.sizes:
+        old_boxes, new_boxes, old_features, new_features, old_classes, new_classes = traffic_scene(n)
+        old_groups = np.array([CLASS_GROUP[c] for c in old_classes])
+        new_groups = np.array([CLASS_GROUP[c] for c in new_classes])
+        scene = (old_boxes, new_boxes, old_features, new_features, old_groups, new_groups)
+
+        single_time, (single, single_pairs) = time_it(lambda: single_matches(*scene), args.repeat)
+        split_time, (split, split_pairs) = time_it(lambda: partitioned_matches(*scene), args.repeat)
+        # matches of the single solve between groups: ID swaps across classes
+        cross = sum(old_groups[row] != new_groups[col] for row, col in single)
+        print(f"{n:>8} {single_time * 1000:>10.2f} {split_time * 1000:>10.2f} {single_time / split_time:>7.1f}x "
+              f"{single_pairs:>9} {split_pairs:>12} {cross:>12}")
+
+    if args.video is not None:
+        print()
+        compare_video(args.video, args.max_frames)
+
+
+if __name__ == "__main__":
+    main()
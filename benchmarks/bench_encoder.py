@@ -0,0 +1,57 @@
+"""
+Speed and accuracy of the ReID encoder variants built by encoder_runtime.py.
+
+Times the eager model (with autograd, as get_features used to run it) and every optimized
+variant (BatchNorm folded, traced and frozen, channels_last, optionally int8) on a batch of
+crops, and reports the smallest cosine similarity of their embeddings with the eager model.
+
+usage: python benchmarks/bench_encoder.py --batch 8 32 --quantize
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from encoder_runtime import select_encoder
+
+
+def time_autograd(model, crops, repeat):
+    # the old get_features: forward_once with autograd enabled, then .detach()
+    model.forward_once(crops).detach()
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        model.forward_once(crops).detach()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the optimized ReID encoder variants')
+    parser.add_argument('--model', type=str, default='models/model640.pt')
+    parser.add_argument('--batch', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--crop-size', type=int, default=128)
+    parser.add_argument('--quantize', action='store_true', help='Also build the int8 variant')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    model = torch.load(args.model, map_location=torch.device('cpu')).eval()
+    torch.manual_seed(0)
+    for n in args.batch:
+        crops = torch.rand(n, 3, args.crop_size, args.crop_size)
+        autograd_time = time_autograd(model, crops, args.repeat)
+        name, _, report = select_encoder(model, crops, quantize=args.quantize, repeat=args.repeat)
+
+        print(f"batch of {n} crops, selected: {name}")
+        print(f"{'variant':>30} {'ms':>9} {'speedup':>8} {'min cosine':>11}")
+        print(f"{'autograd (old get_features)':>30} {autograd_time * 1000:>9.2f} {1.0:>7.1f}x {1.0:>11.5f}")
+        for variant, result in report.items():
+            print(f"{variant:>30} {result['seconds'] * 1000:>9.2f} {autograd_time / result['seconds']:>7.1f}x {result['min_cosine']:>11.5f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Memory of the frame path: copying frames vs the zero-copy path with recycled buffers.
+
+copy:      every frame is decoded into a new RGB array, the tracker draws on a deep copy
+           (COPY_FRAMES) and the encoder converts into a new BGR array (the old frame path)
+zero-copy: frames are decoded into FramePool buffers, the tracker draws on them in place and
+           the encoder converts into one reused buffer
+
+Each mode runs the full decode / track / encode pipeline in its own process, so the peak RSS
+of one mode does not hide the other; the frame path RSS is the growth above the process with
+the models loaded. The per-frame allocation is the tracemalloc peak reached while decoding,
+tracking and encoding one frame in a sequential loop, also given in frames of the clip size.
+Without --video a 1080p synthetic clip is written to a temporary file first.
+
+usage: python benchmarks/bench_frame_path.py --video sample_1080p.mp4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation, iter_frame_batches
+from video_pipeline import VideoPipeline, FramePool
+from bench_utils import peak_rss_mb, current_rss_mb
+from synthetic_video import write_video
+
+MODES = ('copy', 'zero-copy')
+
+
+def encode(writer, frame, buffer):
+    # buffer is None on the copy path: cvtColor then allocates a new BGR frame
+    writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=buffer))
+
+
+def allocations_per_frame(tracker, video_path, pool, writer, max_frames=30):
+    """
+    tracemalloc peak of every frame of a sequential decode / track / encode loop, above what
+    was allocated before the frame (numpy reports its buffers to tracemalloc).
+    """
+    cap = cv2.VideoCapture(video_path)
+    encode_buffer = None
+    per_frame = []
+    tracemalloc.start()
+    batches = iter_frame_batches(cap, 1, pool=pool)
+    for _ in range(max_frames):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        batch = next(batches, None)
+        if batch is None:
+            break
+        processed, _ = next(tracker.process_batch(batch))
+        if pool is not None and encode_buffer is None:
+            encode_buffer = np.empty_like(processed)
+        encode(writer, processed, encode_buffer)
+        if pool is not None:
+            pool.release(batch[0])
+        _, peak = tracemalloc.get_traced_memory()
+        per_frame.append(peak - start)
+        # nothing of this frame stays alive into the next measurement
+        del batch, processed
+    tracemalloc.stop()
+    cap.release()
+    # the first frames warm up the pool and the model, leave them out
+    return np.array(per_frame[len(per_frame) // 10:] or per_frame, dtype=np.float64)
+
+
+def run_mode(video_path, mode, batch_size):
+    tracker = Yolo_implmentation()
+    tracker.COPY_FRAMES = mode == 'copy'
+    pool = FramePool() if mode == 'zero-copy' else None
+
+    cap = cv2.VideoCapture(video_path)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    frame_bytes = size[0] * size[1] * 3
+    output_path = os.path.join(tempfile.gettempdir(), f'bench_frame_path_{os.getpid()}.mp4')
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, size)
+
+    # RSS sampled during the pipeline run, above the process with the models loaded
+    baseline_rss = current_rss_mb()
+    samples = []
+    pipeline = VideoPipeline(iter_frame_batches(cap, batch_size, pool=pool), tracker.process_batch,
+                             writer=writer, pool=pool, on_result=lambda frame, obstacles: samples.append(current_rss_mb()))
+    report = pipeline.run()
+    cap.release()
+
+    tracker.reset()
+    allocated = allocations_per_frame(tracker, video_path, pool, writer)
+    writer.release()
+    os.remove(output_path)
+
+    return {
+        "mode": mode,
+        "fps": report["fps"],
+        "peak_rss_mb": peak_rss_mb(),
+        "frame_path_rss_mb": max(samples, default=baseline_rss) - baseline_rss,
+        "alloc_per_frame_mb": allocated.mean() / 2 ** 20,
+        "frames_allocated_per_frame": allocated.mean() / frame_bytes,
+        "pool_buffers": pool.allocated if pool is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peak RSS and per-frame allocations of the frame path')
+    parser.add_argument('--video', type=str, default=None, help='Video to use instead of a 1080p synthetic clip')
+    parser.add_argument('--frames', type=int, default=90, help='Length of the synthetic clip')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--mode', choices=MODES, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        # child process: one mode, result as JSON on the last line
+        print(json.dumps(run_mode(args.video, args.mode, args.batch_size)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = args.video
+        if video_path is None:
+            video_path = os.path.join(tmp, 'synthetic_1080p.mp4')
+            write_video(video_path, num_frames=args.frames, width=1920, height=1080, num_objects=12)
+
+        results = []
+        for mode in MODES:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--video', video_path, '--mode', mode,
+                                     '--batch-size', str(args.batch_size)], check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':>10} {'FPS':>7} {'peak RSS MB':>12} {'frame path MB':>14} {'alloc/frame MB':>15} {'frame copies/frame':>19} {'pool buffers':>13}")
+    for r in results:
+        print(f"{r['mode']:>10} {r['fps']:>7.1f} {r['peak_rss_mb']:>12.1f} {r['frame_path_rss_mb']:>14.1f} {r['alloc_per_frame_mb']:>15.1f} "
+              f"{r['frames_allocated_per_frame']:>19.2f} {str(r['pool_buffers']):>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark for spatially gated association.
+
+Runs the dense Hungarian solve on the full total_cost_matrix and the per-component
+solve from spatial_index.gated_assignment on scenes with many small objects,
+and checks that both keep the same matches above the IoU gate, also on a scene of
+large boxes moving far (close-up footage), where the box costs depend on the frame size.
+
+On a fixed 1080p frame more objects also means more neighbours per object, so the candidate
+pairs (and the gated time) grow faster than the number of objects. --constant-density grows
+the frame with the number of objects instead (the density of 200 objects on 1080p), which
+shows how the gated path scales with the objects alone.
+
+usage: python benchmarks/bench_gating.py --sizes 50 200 800
+       python benchmarks/bench_gating.py --sizes 200 800 3200 --constant-density
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cost_matrix import total_cost_matrix
+from spatial_index import gated_assignment, SpatialGrid
+from bench_utils import time_it, crowded_scene
+
+
+def close_up_scene(n=12, feature_dim=1024, w=1920, h=1080, seed=0):
+    """
+    n large objects (up to about 1000 px) each moving up to 250 px, still above the IoU gate.
+    """
+    rng = np.random.default_rng(seed)
+    size = rng.integers(400, 1000, (n, 2))
+    size[:, 1] = np.minimum(size[:, 1], h - 20)
+    x1 = rng.integers(0, w - size[:, 0])
+    y1 = rng.integers(0, h - size[:, 1])
+    old_boxes = np.stack([x1, y1, x1 + size[:, 0], y1 + size[:, 1]], axis=1)
+    new_boxes = old_boxes + np.repeat(rng.integers(-250, 251, (n, 1)), 4, axis=1)
+    old_features = rng.random((n, feature_dim), dtype=np.float32)
+    new_features = old_features + 0.05 * rng.random((n, feature_dim), dtype=np.float32)
+    return old_boxes, new_boxes, old_features, new_features
+
+
+def dense_matches(old_boxes, new_boxes, old_features, new_features):
+    iou_matrix = total_cost_matrix(old_boxes, new_boxes, old_features, new_features)
+    rows, cols = linear_sum_assignment(-iou_matrix)
+    keep = iou_matrix[rows, cols] >= 0.3
+    return set(zip(rows[keep].tolist(), cols[keep].tolist()))
+
+
+def gated_matches(old_boxes, new_boxes, old_features, new_features):
+    rows, cols, costs = gated_assignment(old_boxes, new_boxes, old_features, new_features)
+    keep = costs >= 0.3
+    return set(zip(rows[keep].tolist(), cols[keep].tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dense vs spatially gated association')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--constant-density', action='store_true', help='Grow the frame with the number of objects')
+    args = parser.parse_args()
+
+    print(f"{'objects':>10} {'pairs':>8} {'dense ms':>10} {'gated ms':>10} {'speedup':>10} {'same matches':>14}")
+    for n in args.sizes:
+        scale = max(1.0, (n / 200) ** 0.5) if args.constant_density else 1.0
+        scene = crowded_scene(n, w=int(1920 * scale), h=int(1080 * scale))
+        pairs = len(SpatialGrid(scene[0]).query(scene[1])[0])
+        dense_time, dense = time_it(lambda: dense_matches(*scene), args.repeat)
+        gated_time, gated = time_it(lambda: gated_matches(*scene), args.repeat)
+        print(f"{n:>10} {pairs:>8} {dense_time * 1000:>10.2f} {gated_time * 1000:>10.2f} {dense_time / gated_time:>9.1f}x {str(dense == gated):>14}")
+
+    same = []
+    for seed in range(20):
+        scene = close_up_scene(seed=seed)
+        dense = dense_matches(*scene)
+        same.append(dense == gated_matches(*scene))
+    print(f"close-up scenes (large boxes, up to 250 px motion): same matches {sum(same)}/{len(same)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Throughput of the headless (tracks-only) mode against the rendered mode.
+
+Runs the same video through the full decode / track / encode pipeline twice: once drawing
+the tracks and writing an mp4, once in headless mode, which skips the frame copies, all
+drawing and the encoder and only keeps the per-frame track records.
+Without --video a synthetic clip of moving rectangles is written to a temporary file first.
+
+usage: python benchmarks/bench_headless.py --video sample.mp4 --batch-size 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import cv2
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation, iter_frame_batches, track_record
+from video_pipeline import VideoPipeline
+from synthetic_video import write_video
+
+
+def run(tracker, video_path, headless, batch_size, output_dir):
+    tracker.reset()
+    tracker.HEADLESS = headless
+    cap = cv2.VideoCapture(video_path)
+    writer = None
+    if not headless:
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        writer = cv2.VideoWriter(os.path.join(output_dir, 'rendered.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), 30, size)
+
+    records = []
+    pipeline = VideoPipeline(iter_frame_batches(cap, batch_size), tracker.process_batch, writer=writer,
+                             on_result=lambda frame, obstacles: records.append(track_record(len(records), obstacles)))
+    report = pipeline.run()
+    cap.release()
+    if writer is not None:
+        writer.release()
+    return report, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FPS of the headless (tracks-only) mode vs the rendered mode')
+    parser.add_argument('--video', type=str, default=None, help='Video to use instead of a synthetic clip')
+    parser.add_argument('--width', type=int, default=1920, help='Width of the synthetic clip')
+    parser.add_argument('--height', type=int, default=1080, help='Height of the synthetic clip')
+    parser.add_argument('--frames', type=int, default=120, help='Length of the synthetic clip')
+    parser.add_argument('--batch-size', type=int, default=1)
+    args = parser.parse_args()
+
+    tracker = Yolo_implmentation()
+    with tempfile.TemporaryDirectory() as output_dir:
+        video_path = args.video
+        if video_path is None:
+            video_path = os.path.join(output_dir, 'synthetic.mp4')
+            write_video(video_path, num_frames=args.frames, width=args.width, height=args.height, num_objects=12)
+
+        rendered, rendered_records = run(tracker, video_path, False, args.batch_size, output_dir)
+        headless, headless_records = run(tracker, video_path, True, args.batch_size, output_dir)
+
+    print(f"{'mode':>9} {'FPS':>8} {'infer s':>8} {'encode s':>9}")
+    for name, report in (('rendered', rendered), ('headless', headless)):
+        print(f"{name:>9} {report['fps']:>8.1f} {report['infer']['busy_s']:>8.2f} {report['encode']['busy_s']:>9.2f}")
+    print(f"speedup: {headless['fps'] / rendered['fps']:.2f}x, same tracks: {rendered_records == headless_records}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark for the batched Kalman motion model.
+
+Times one predict + update cycle per frame of kalman_filter.BatchKalmanFilter
+for different numbers of tracks.
+
+usage: python benchmarks/bench_kalman.py --tracks 10 100 1000
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kalman_filter import BatchKalmanFilter
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched Kalman predict/update')
+    parser.add_argument('--tracks', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'tracks':>8} {'predict us':>12} {'update us':>12} {'frame us':>12}")
+    for n in args.tracks:
+        x1 = rng.uniform(0, 1800, n)
+        y1 = rng.uniform(0, 900, n)
+        boxes = np.stack([x1, y1, x1 + 60, y1 + 120], axis=1)
+        velocity = rng.uniform(-5, 5, (n, 2))
+
+        motion = BatchKalmanFilter(capacity=n)
+        rows = np.arange(n)
+        motion.initiate(rows, boxes)
+
+        predict_time, update_time = 0.0, 0.0
+        for _ in range(args.frames):
+            boxes[:, :2] += velocity
+            boxes[:, 2:] += velocity
+
+            start = perf_counter()
+            motion.predict(rows)
+            motion.boxes(rows)
+            predict_time += perf_counter() - start
+
+            start = perf_counter()
+            motion.update(rows, boxes + rng.normal(0, 1, boxes.shape))
+            update_time += perf_counter() - start
+
+        predict_us = predict_time / args.frames * 1e6
+        update_us = update_time / args.frames * 1e6
+        print(f"{n:>8} {predict_us:>12.1f} {update_us:>12.1f} {predict_us + update_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+FPS vs tracking accuracy report for the keyframe detection mode.
+
+Runs the tracker with several detector strides on a video (or on a synthetic clip of
+moving rectangles) and compares every run with the stride 1 run, which is used as the
+reference: mean IoU of the reference boxes, recall at IoU 0.5 and the number of
+identity switches against the reference tracks.
+
+usage: python benchmarks/bench_keyframes.py --video sample.mp4 --strides 1 2 4 8
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation, PROPAGATION_MODES
+from cost_matrix import as_box_array, box_iou_matrix
+from synthetic_video import generate_frames
+
+
+def video_frames(path, max_frames):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
+def run(tracker, frames, stride, adaptive, propagation):
+    tracker.set_keyframe_mode(stride, adaptive, propagation)
+    tracker.reset()
+    tracks = []
+    start = perf_counter()
+    for frame in frames:
+        # the tracks are drawn on the input frame in place, keep the clip clean for the next run
+        _, obstacles = tracker.process_frame(frame.copy())
+        tracks.append({obs.idx: list(obs.box) for obs in obstacles})
+    return len(frames) / (perf_counter() - start), tracks
+
+
+def compare(reference, tracks):
+    """
+    Mean IoU and recall (IoU >= 0.5) of the reference boxes, and identity switches:
+    how often the id matched to a reference track changes between frames.
+    """
+    ious, last_match, switches = [], {}, 0
+    for ref_frame, frame in zip(reference, tracks):
+        if len(ref_frame) == 0:
+            continue
+        ref_ids = list(ref_frame)
+        if len(frame) == 0:
+            ious.extend([0.0] * len(ref_ids))
+            continue
+        ids = list(frame)
+        iou = box_iou_matrix(as_box_array(list(ref_frame.values())), as_box_array(list(frame.values())))
+        best = iou.argmax(axis=1)
+        for i, ref_id in enumerate(ref_ids):
+            ious.append(iou[i, best[i]])
+            if iou[i, best[i]] >= 0.5:
+                matched = ids[best[i]]
+                if ref_id in last_match and last_match[ref_id] != matched:
+                    switches += 1
+                last_match[ref_id] = matched
+    ious = np.array(ious)
+    return ious.mean() if len(ious) else 1.0, (ious >= 0.5).mean() if len(ious) else 1.0, switches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FPS vs accuracy of the keyframe detection mode')
+    parser.add_argument('--video', type=str, default=None, help='Video to use instead of a synthetic clip')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--strides', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--adaptive', action='store_true')
+    parser.add_argument('--propagation', choices=PROPAGATION_MODES, default='flow')
+    args = parser.parse_args()
+
+    frames = video_frames(args.video, args.max_frames) if args.video else list(generate_frames())
+    tracker = Yolo_implmentation()
+
+    reference_fps, reference = run(tracker, frames, 1, False, args.propagation)
+    print(f"{'stride':>7} {'FPS':>8} {'speedup':>8} {'mean IoU':>9} {'recall':>7} {'ID switches':>12} {'IDs':>5}")
+    for stride in args.strides:
+        if stride == 1:
+            fps, tracks = reference_fps, reference
+        else:
+            fps, tracks = run(tracker, frames, stride, args.adaptive, args.propagation)
+        mean_iou, recall, switches = compare(reference, tracks)
+        num_ids = len(set(i for frame in tracks for i in frame))
+        print(f"{stride:>7} {fps:>8.1f} {fps / reference_fps:>7.1f}x {mean_iou:>9.3f} {recall:>7.3f} {switches:>12} {num_ids:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+FPS and encoder work of the lazy (on-demand) appearance embedding.
+
+Runs the tracker on a video (or on a synthetic clip of moving rectangles) with every detection
+embedded, then with LAZY_EMBEDDING, and reports the fraction of crops actually encoded, the
+FPS and how close the lazy tracks are to the eager ones (mean IoU, recall, identity switches).
+
+usage: python benchmarks/bench_lazy_embedding.py --video sample.mp4 --refresh 5 10 30
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation
+from bench_keyframes import video_frames, compare
+from synthetic_video import generate_frames
+
+
+def run(tracker, frames, lazy, refresh):
+    tracker.reset()
+    tracker.LAZY_EMBEDDING = lazy
+    tracker.EMBEDDING_REFRESH = refresh
+    tracks = []
+    start = perf_counter()
+    for frame in frames:
+        # the tracks are drawn on the input frame in place, keep the clip clean for the next run
+        _, obstacles = tracker.process_frame(frame.copy())
+        tracks.append({obs.idx: list(obs.box) for obs in obstacles})
+    return len(frames) / (perf_counter() - start), tracks, tracker.embedding_report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FPS and encoded crops of the lazy appearance embedding')
+    parser.add_argument('--video', type=str, default=None, help='Video to use instead of a synthetic clip')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--refresh', type=int, nargs='+', default=[5, 10, 30], help='EMBEDDING_REFRESH values to try')
+    args = parser.parse_args()
+
+    frames = video_frames(args.video, args.max_frames) if args.video else list(generate_frames())
+    tracker = Yolo_implmentation()
+
+    eager_fps, reference, eager = run(tracker, frames, False, 1)
+    print(f"{'mode':>12} {'FPS':>8} {'speedup':>8} {'encoded':>8} {'mean IoU':>9} {'recall':>7} {'ID switches':>12}")
+    print(f"{'eager':>12} {eager_fps:>8.1f} {1.0:>7.1f}x {eager['encoded_fraction'] * 100:>7.1f}% {1.0:>9.3f} {1.0:>7.3f} {0:>12}")
+    for refresh in args.refresh:
+        fps, tracks, lazy = run(tracker, frames, True, refresh)
+        mean_iou, recall, switches = compare(reference, tracks)
+        print(f"{'lazy/' + str(refresh):>12} {fps:>8.1f} {fps / eager_fps:>7.1f}x {lazy['encoded_fraction'] * 100:>7.1f}% {mean_iou:>9.3f} {recall:>7.3f} {switches:>12}")
+
+
+if __name__ == "__main__":
+    main()
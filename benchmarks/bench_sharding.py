@@ -0,0 +1,59 @@
+"""
+Wall-clock time of time-sharded tracking against one pass over the whole video.
+
+Runs sharded_tracking.track_sharded with 1 shard (one worker, the plain sequential run) and with
+each --shards count, and checks the stitching: every id of the sequential run should map to a
+single id of the sharded run (same boxes on the same frames). Without --video a synthetic video
+is generated. The speedup is bounded by the number of cores and by the start of the workers
+(each loads the models), so it shows on videos of a few thousand frames and more.
+
+usage: python benchmarks/bench_sharding.py --video long.mp4 --shards 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sharded_tracking import track_sharded
+from synthetic_video import write_video
+
+
+def split_ids(reference, frames):
+    # ids of the reference run whose boxes carry more than one id in frames
+    mapping = defaultdict(set)
+    for expected, actual in zip(reference, frames):
+        ids = {tuple(obstacle.box): obstacle.idx for obstacle in expected}
+        for obstacle in actual:
+            if tuple(obstacle.box) in ids:
+                mapping[ids[tuple(obstacle.box)]].add(obstacle.idx)
+    return sum(len(ids) > 1 for ids in mapping.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded tracking vs one sequential pass')
+    parser.add_argument('--video', type=str, default=None, help='Video to track instead of a synthetic one')
+    parser.add_argument('--frames', type=int, default=1800, help='Length of the synthetic video')
+    parser.add_argument('--shards', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--overlap', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video
+        if video is None:
+            video = os.path.join(tmp, 'sharding.mp4')
+            write_video(video, num_frames=args.frames, width=1280, height=720, num_objects=12, sprites=True)
+
+        reference, report = track_sharded(video, shards=1, workers=1)
+        print(f"{'shards':>7} {'wall s':>8} {'FPS':>8} {'speedup':>8} {'stitched':>9} {'split ids':>10}")
+        print(f"{1:>7} {report['wall_s']:>8.2f} {report['fps']:>8.1f} {1:>7.2f}x {0:>9} {0:>10}")
+        for shards in args.shards:
+            frames, sharded = track_sharded(video, shards=shards, workers=shards, overlap=args.overlap)
+            print(f"{shards:>7} {sharded['wall_s']:>8.2f} {sharded['fps']:>8.1f} {report['wall_s'] / sharded['wall_s']:>7.2f}x "
+                  f"{sharded['stitched_tracks']:>9} {split_ids(reference, frames):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Startup time and memory of tracker sessions with the process-wide model registry.
+
+cold:     the first Yolo_implmentation of the process and its first frame (loads every model)
+own:      every session loads its own copy of the models (the registry is cleared before each,
+          as every tracker did before the registry)
+shared:   every session after the first one, models from the registry
+fork:     worker processes forked from a parent, with the models preloaded in the parent
+          (model_registry.preload) or loaded by every worker after the fork; memory of each
+          worker split into what it shares with the others and what is its own (Linux only)
+
+usage: python benchmarks/bench_startup.py --sessions 20 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation
+from model_registry import registry, preload
+from synthetic_video import generate_frames
+from bench_utils import current_rss_mb
+
+
+def memory_split_mb():
+    # (shared, private) resident memory of this process, from /proc/self/smaps_rollup
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return fields['Shared_Clean'] + fields['Shared_Dirty'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def new_session(frame):
+    # a tracker that has processed one frame, so every model it uses is loaded
+    tracker = Yolo_implmentation()
+    tracker.HEADLESS = True
+    tracker.process_frame(frame.copy())
+    return tracker
+
+
+def time_sessions(frame, count, own_models):
+    sessions = []
+    rss = current_rss_mb()
+    start = perf_counter()
+    for _ in range(count):
+        if own_models:
+            registry.clear()
+        sessions.append(new_session(frame))
+    elapsed = perf_counter() - start
+    return elapsed / count, (current_rss_mb() - rss) / count, sessions
+
+
+def worker(frame, results, load_in_worker):
+    if load_in_worker:
+        registry.clear()
+    start = perf_counter()
+    new_session(frame)
+    shared, private = memory_split_mb()
+    results.put((perf_counter() - start, shared, private))
+
+
+def run_workers(frame, count, preloaded):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(frame, results, not preloaded)) for _ in range(count)]
+    for process in workers:
+        process.start()
+    measured = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    return np.array(measured).mean(axis=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time and memory of tracker sessions')
+    parser.add_argument('--sessions', type=int, default=20, help='Sessions created with the shared models')
+    parser.add_argument('--own-sessions', type=int, default=3, help='Sessions created with their own models')
+    parser.add_argument('--workers', type=int, default=4, help='Forked worker processes')
+    args = parser.parse_args()
+
+    frame = next(generate_frames(1, 640, 360))
+
+    start = perf_counter()
+    rss = current_rss_mb()
+    cold = new_session(frame)
+    cold_time, cold_rss = perf_counter() - start, current_rss_mb() - rss
+    del cold
+    own_time, own_rss, own = time_sessions(frame, args.own_sessions, own_models=True)
+    del own
+    # load the shared models once more, outside the timed sessions
+    registry.clear()
+    new_session(frame)
+    shared_time, shared_rss, shared = time_sessions(frame, args.sessions, own_models=False)
+
+    print(f"{'session':>8} {'ms':>10} {'RSS MB':>8}")
+    print(f"{'cold':>8} {cold_time * 1000:>10.1f} {cold_rss:>8.1f}")
+    print(f"{'own':>8} {own_time * 1000:>10.1f} {own_rss:>8.1f}")
+    print(f"{'shared':>8} {shared_time * 1000:>10.1f} {shared_rss:>8.1f}")
+    print(f"loaded once: {registry.loaded()}")
+
+    if args.workers > 0 and sys.platform.startswith('linux'):
+        print()
+        print(f"{'workers':>12} {'startup ms':>11} {'shared MB':>10} {'private MB':>11}")
+        for name, preloaded in (('own models', False), ('preloaded', True)):
+            if preloaded:
+                preload()
+            startup, shared_mb, private_mb = run_workers(frame, args.workers, preloaded)
+            print(f"{name:>12} {startup * 1000:>11.1f} {shared_mb:>10.1f} {private_mb:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
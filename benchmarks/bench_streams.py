@@ -0,0 +1,86 @@
+"""
+Throughput of the multi-stream engine against one tracker per stream.
+
+separate: every stream runs on its own Yolo_implmentation (its own detector and encoder
+          copies), one stream after the other
+engine:   all streams run at the same time through one StreamEngine, sharing one detector
+          and one encoder with batches across the streams
+
+Reports the aggregate FPS, the per-stream latency of the engine and checks that every stream
+gets the same tracks as when it runs alone. Without --video a synthetic clip is used for every stream.
+
+usage: python benchmarks/bench_streams.py --streams 4 --video sample.mp4
+"""
+import argparse
+import os
+import sys
+import threading
+from time import perf_counter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_tracking import Yolo_implmentation, track_record
+from stream_engine import StreamEngine, format_stream_report
+from bench_keyframes import video_frames
+from synthetic_video import generate_frames
+
+
+def run_separate(frames, num_streams):
+    # one tracker per stream, as the API did before: a model copy per concurrent video
+    records = []
+    start = perf_counter()
+    for _ in range(num_streams):
+        tracker = Yolo_implmentation()
+        tracker.HEADLESS = True
+        records.append([track_record(i, tracker.process_frame(frame.copy())[1]) for i, frame in enumerate(frames)])
+    return len(frames) * num_streams / (perf_counter() - start), records
+
+
+def run_engine(frames, num_streams, max_batch):
+    tracker = Yolo_implmentation()
+    engine = StreamEngine(tracker, max_batch=max_batch).start()
+    records, reports = [None] * num_streams, {}
+
+    def run_stream(n):
+        stream = engine.open_stream(f"stream{n}")
+        stream.tracker.HEADLESS = True
+        records[n] = [track_record(i, stream.submit(frame.copy()).result()[1]) for i, frame in enumerate(frames)]
+        reports[stream.name] = engine.close_stream(stream)
+
+    start = perf_counter()
+    threads = [threading.Thread(target=run_stream, args=(n,)) for n in range(num_streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    fps = len(frames) * num_streams / (perf_counter() - start)
+    engine.stop()
+    return fps, records, reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-stream engine vs one tracker per stream')
+    parser.add_argument('--video', type=str, default=None, help='Video every stream plays instead of a synthetic clip')
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--max-batch', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.video is not None:
+        frames = video_frames(args.video, args.frames)
+    else:
+        frames = list(generate_frames(args.frames, 1280, 720, num_objects=12))
+
+    separate_fps, separate_records = run_separate(frames, args.streams)
+    engine_fps, engine_records, reports = run_engine(frames, args.streams, args.max_batch)
+
+    print(format_stream_report(reports))
+    print()
+    print(f"{'mode':>9} {'aggregate FPS':>14}")
+    print(f"{'separate':>9} {separate_fps:>14.1f}")
+    print(f"{'engine':>9} {engine_fps:>14.1f}")
+    print(f"speedup: {engine_fps / separate_fps:.2f}x, same tracks: {separate_records == engine_records}")
+
+
+if __name__ == "__main__":
+    main()
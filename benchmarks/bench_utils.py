@@ -0,0 +1,49 @@
+"""
+Helpers shared by the benchmarks: best-of-n timing, process memory and synthetic association scenes.
+The synthetic videos are in synthetic_video.py.
+"""
+import os
+import resource
+from time import perf_counter
+
+import numpy as np
+
+
+def time_it(fn, repeat):
+    """Best wall-clock time of repeat calls of fn, and the result of the last call."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn()
+        best = min(best, perf_counter() - start)
+    return best, result
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    # resident pages from /proc (Linux), the peak RSS elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def crowded_scene(n, feature_dim=1024, w=1920, h=1080, widths=(20, 60), heights=(40, 120), motion=4, seed=0):
+    """
+    n old boxes spread over the frame and the same n boxes after moving up to `motion` pixels per
+    coordinate, with matching features. widths / heights: (min, max) box size; the defaults are
+    many small objects (stadium / traffic footage).
+    """
+    rng = np.random.default_rng(seed)
+    x1 = rng.integers(0, w - widths[1], n)
+    y1 = rng.integers(0, h - heights[1], n)
+    old_boxes = np.stack([x1, y1, x1 + rng.integers(*widths, n), y1 + rng.integers(*heights, n)], axis=1)
+    new_boxes = old_boxes + rng.integers(-motion, motion + 1, old_boxes.shape)
+    old_features = rng.random((n, feature_dim), dtype=np.float32)
+    new_features = old_features + 0.05 * rng.random((n, feature_dim), dtype=np.float32)
+    return old_boxes, new_boxes, old_features, new_features
@@ -0,0 +1,204 @@
+"""
+Benchmark suite with a regression check.
+
+Micro-benchmarks of the tracker's building blocks and an end-to-end FPS run through
+object_tracking.main(), all on synthetic videos generated locally (see synthetic_video.py):
+
+  box_iou                1000 calls of Yolo_implmentation.box_iou
+  box_iou_matrix         cost_matrix.box_iou_matrix on 200 x 200 boxes
+  associate_50/_200      Yolo_implmentation.associate on a scene of 50 / 200 objects
+  crop_frames            crop and resize 32 boxes of a full-resolution frame
+  get_features           ReID embeddings of 32 crops
+  process_single_image   one tracked frame (detector, crops, encoder, association)
+  end_to_end             object_tracking.main() on a synthetic video, in headless mode
+
+Every result is the median time over --repeat runs after a warm up run. The results are
+written as JSON; with --baseline (a JSON file of an earlier run) every benchmark that got
+slower by more than --threshold is reported and the exit status is 1, so CI can catch it.
+
+usage: python benchmarks/run_suite.py --output results.json
+       python benchmarks/run_suite.py --baseline results.json --threshold 0.1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import object_tracking
+from object_tracking import Yolo_implmentation
+from cost_matrix import box_iou_matrix
+from synthetic_video import generate_frames, write_video
+from bench_utils import crowded_scene
+
+
+def measure(fn, repeat, warmup=1):
+    # median and best of repeat runs, after warmup runs that are not counted
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return {"seconds": float(np.median(times)), "best_seconds": min(times), "repeat": repeat}
+
+
+def bench_box_iou(tracker, args):
+    rng = np.random.default_rng(0)
+    boxes = rng.integers(0, 500, (1000, 2, 2))
+    pairs = [(np.r_[b[0], b[0] + 50].tolist(), np.r_[b[1], b[1] + 50].tolist()) for b in boxes]
+    return measure(lambda: [tracker.box_iou(a, b) for a, b in pairs], args.repeat)
+
+
+def bench_box_iou_matrix(tracker, args):
+    old_boxes, new_boxes, _, _ = crowded_scene(200, feature_dim=1)
+    return measure(lambda: box_iou_matrix(old_boxes, new_boxes), args.repeat)
+
+
+def bench_associate(n):
+    def bench(tracker, args):
+        scene = crowded_scene(n, feature_dim=tracker.EMBEDDING_DIM)
+        return measure(lambda: tracker.associate(*scene), args.repeat)
+    return bench
+
+
+def full_frame(args):
+    return next(generate_frames(1, args.width, args.height, args.objects, args.speed, sprites=True))
+
+
+def random_boxes(args, n=32):
+    rng = np.random.default_rng(0)
+    x1 = rng.integers(0, args.width - 100, n)
+    y1 = rng.integers(0, args.height - 100, n)
+    return np.stack([x1, y1, x1 + rng.integers(20, 100, n), y1 + rng.integers(20, 100, n)], axis=1).astype(np.float32)
+
+
+def bench_crop_frames(tracker, args):
+    frame, boxes = full_frame(args), random_boxes(args)
+    return measure(lambda: tracker.crop_frames(frame, boxes), args.repeat)
+
+
+def bench_get_features(tracker, args):
+    _, crops = tracker.crop_frames(full_frame(args), random_boxes(args))
+    return measure(lambda: tracker.get_features(crops), args.repeat)
+
+
+def bench_process_single_image(tracker, args):
+    frames = list(generate_frames(args.repeat + 1, args.width, args.height, args.objects, args.speed, sprites=True))
+    tracker.reset()
+    # the frames are drawn on in place, every run gets a fresh copy of the next one
+    frames = iter(frames)
+    return measure(lambda: tracker.process_single_image(next(frames).copy()), args.repeat)
+
+
+def bench_end_to_end(tracker, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, 'suite.mp4')
+        tracks_path = os.path.join(tmp, 'tracks.jsonl')
+        frames = write_video(video_path, num_frames=args.frames, width=args.width, height=args.height,
+                             num_objects=args.objects, speed=args.speed, sprites=True)
+
+        def run():
+            argv = sys.argv
+            sys.argv = ['object_tracking.py', video_path, '--headless', '--tracks-output', tracks_path]
+            try:
+                # main() reports errors by printing them, its output is kept to check the run
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+                    object_tracking.main()
+            finally:
+                sys.argv = argv
+            with open(tracks_path) as f:
+                if sum(1 for _ in f) != frames:
+                    raise RuntimeError(f"end to end run failed:\n{output.getvalue()}")
+
+        result = measure(run, max(1, args.repeat // 5))
+    result["frames"] = frames
+    result["fps"] = frames / result["seconds"]
+    return result
+
+
+BENCHMARKS = {
+    "box_iou": bench_box_iou,
+    "box_iou_matrix": bench_box_iou_matrix,
+    "associate_50": bench_associate(50),
+    "associate_200": bench_associate(200),
+    "crop_frames": bench_crop_frames,
+    "get_features": bench_get_features,
+    "process_single_image": bench_process_single_image,
+    "end_to_end": bench_end_to_end,
+}
+
+
+def compare(results, baseline, threshold):
+    """(name, baseline seconds, seconds, ratio, regressed) for every benchmark in both runs."""
+    rows = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result["seconds"] / baseline[name]["seconds"]
+            rows.append((name, baseline[name]["seconds"], result["seconds"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite, optionally against a baseline')
+    parser.add_argument('--only', type=str, nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--objects', type=int, default=12)
+    parser.add_argument('--speed', type=float, default=4.0)
+    parser.add_argument('--frames', type=int, default=90, help='Length of the end to end video')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed slowdown against the baseline (default: 0.1 = 10%%)')
+    args = parser.parse_args()
+
+    tracker = Yolo_implmentation()
+    results = {}
+    for name in args.only:
+        results[name] = BENCHMARKS[name](tracker, args)
+        extra = f"  {results[name]['fps']:.1f} FPS" if "fps" in results[name] else ""
+        print(f"{name:>22} {results[name]['seconds'] * 1000:>10.3f} ms{extra}")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "resolution": [args.width, args.height],
+            "objects": args.objects,
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    rows = compare(results, baseline, args.threshold)
+    print()
+    print(f"{'benchmark':>22} {'baseline ms':>12} {'now ms':>10} {'change':>8}")
+    for name, before, now, ratio, regressed in rows:
+        print(f"{name:>22} {before * 1000:>12.3f} {now * 1000:>10.3f} {(ratio - 1) * 100:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
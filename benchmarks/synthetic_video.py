@@ -0,0 +1,77 @@
+"""
+Synthetic test videos: colored rectangles (or striped sprites) moving and bouncing around the frame.
+
+Resolution, number of objects and their speed are configurable, and the same seed always gives
+the same video, so benchmark runs on different machines or commits see the same input.
+
+usage: python benchmarks/synthetic_video.py out.mp4 --width 1920 --height 1080 --objects 20 --speed 6 --frames 300
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+
+def generate_frames(num_frames=120, width=640, height=360, num_objects=8, speed=4.0, sprites=False, seed=0):
+    """
+    Yields num_frames RGB frames (height, width, 3 uint8). Every object moves up to `speed`
+    pixels per frame on each axis. sprites=True draws striped objects instead of flat ones,
+    so they have some texture for the ReID encoder.
+    """
+    rng = np.random.default_rng(seed)
+    scale = min(width, height) / 360
+    size = (rng.integers(30, 70, (num_objects, 2)) * scale).astype(int)
+    position = rng.uniform(0, 1, (num_objects, 2)) * ([width, height] - size)
+    velocity = rng.uniform(-speed, speed, (num_objects, 2))
+    colors = rng.integers(60, 256, (num_objects, 3))
+    stripes = rng.integers(60, 256, (num_objects, 3))
+    for _ in range(num_frames):
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        for i, ((x, y), (w, h)) in enumerate(zip(position.astype(int), size)):
+            frame[y:y + h, x:x + w] = colors[i]
+            if sprites:
+                frame[y:y + h:8, x:x + w] = stripes[i]
+        yield frame
+        velocity[(position <= 0) | (position >= [width, height] - size)] *= -1
+        position = np.clip(position + velocity, 0, [width, height] - size)
+
+
+def write_frames(path, frames, fps=30):
+    """Writes RGB frames (any iterable) to an mp4 file and returns the number of frames written."""
+    writer = None
+    count = 0
+    for frame in frames:
+        if writer is None:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame.shape[1], frame.shape[0]))
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        count += 1
+    if writer is not None:
+        writer.release()
+    return count
+
+
+def write_video(path, fps=30, **kwargs):
+    """Writes generate_frames(**kwargs) to an mp4 file and returns the number of frames written."""
+    return write_frames(path, generate_frames(**kwargs), fps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic video of moving objects')
+    parser.add_argument('output', type=str)
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--objects', type=int, default=8)
+    parser.add_argument('--speed', type=float, default=4.0, help='Largest move per frame and axis, in pixels')
+    parser.add_argument('--sprites', action='store_true', help='Striped objects instead of flat rectangles')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    count = write_video(args.output, args.fps, num_frames=args.frames, width=args.width, height=args.height,
+                        num_objects=args.objects, speed=args.speed, sprites=args.sprites, seed=args.seed)
+    print(f"wrote {count} frames of {args.width}x{args.height} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
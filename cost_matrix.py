@@ -0,0 +1,141 @@
+import numpy as np
+
+# array-native versions of the costs used by Yolo_implmentation.total_cost.
+# the *_pairs functions work element-wise on boxes (...,4) in [x1, y1, x2, y2] format and
+# broadcast, so the same code scores a list of K aligned pairs or, with old[:,None] and
+# new[None,:], the full N x M block. the *_matrix functions are that block form, which
+# replaces one python call per (track, detection) pair with a few array operations.
+
+
+def check_division_by_0(values, epsilon=0.01):
+    """
+    Array version of Yolo_implmentation.check_division_by_0: values below epsilon become epsilon.
+    """
+    return np.maximum(values, epsilon)
+
+
+def as_box_array(boxes):
+    """
+    Convert a list of boxes (or an array) to a float64 (N,4) array.
+    """
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def as_feature_array(features, dim=None):
+    """
+    Stack a list of feature vectors (or an array) into a 2D (N,dim) array.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    if dim is None:
+        dim = features.shape[-1] if features.ndim > 0 and features.size > 0 else 0
+    return features.reshape(-1, dim)
+
+
+def normalize_features(features):
+    # divides each vector by its magnitude, row by row. all-zero rows stay zero
+    return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+
+# called 1st in total_cost
+def box_iou_pairs(old, new):
+    xA = np.maximum(old[..., 0], new[..., 0])
+    yA = np.maximum(old[..., 1], new[..., 1])
+    xB = np.minimum(old[..., 2], new[..., 2])
+    yB = np.minimum(old[..., 3], new[..., 3])
+
+    # same +1 pixel convention as box_iou
+    inter_area = np.maximum(0, xB - xA + 1) * np.maximum(0, yB - yA + 1)
+    old_area = (old[..., 2] - old[..., 0] + 1) * (old[..., 3] - old[..., 1] + 1)
+    new_area = (new[..., 2] - new[..., 0] + 1) * (new[..., 3] - new[..., 1] + 1)
+    union_area = (old_area + new_area) - inter_area
+    return inter_area / union_area
+
+
+# called 2nd in total_cost
+def sanchez_matilla_pairs(old, new, w=1280, h=360):
+    Q_dist = np.sqrt(w ** 2 + h ** 2)
+    Q_shape = w * h
+    # distance between top-left corners and between bottom-right corners
+    corner_dist = np.hypot(old[..., 0] - new[..., 0], old[..., 1] - new[..., 1])
+    shape_dist = np.hypot(old[..., 2] - new[..., 2], old[..., 3] - new[..., 3])
+    distance_term = Q_dist / check_division_by_0(corner_dist)
+    shape_term = Q_shape / check_division_by_0(shape_dist)
+    return distance_term * shape_term
+
+
+# called 3rd in total_cost
+def yu_pairs(old, new, w1=0.5, w2=1.5):
+    a = (old[..., 0] - new[..., 0]) / check_division_by_0(old[..., 2])
+    b = (old[..., 1] - new[..., 1]) / check_division_by_0(old[..., 3])
+    ab = (a ** 2 + b ** 2) * w1 * (-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = np.abs(old[..., 3] - new[..., 3]) / (old[..., 3] + new[..., 3])
+        d = np.abs(old[..., 2] - new[..., 2]) / (old[..., 2] + new[..., 2])
+    cd = (c + d) * w2 * (-1)
+    return np.exp(ab) * np.exp(cd)
+
+
+def box_iou_matrix(old_boxes, new_boxes):
+    return box_iou_pairs(old_boxes[:, None, :], new_boxes[None, :, :])
+
+
+def sanchez_matilla_matrix(old_boxes, new_boxes, w=1280, h=360):
+    return sanchez_matilla_pairs(old_boxes[:, None, :], new_boxes[None, :, :], w=w, h=h)
+
+
+def yu_matrix(old_boxes, new_boxes):
+    return yu_pairs(old_boxes[:, None, :], new_boxes[None, :, :])
+
+
+# called 4th in total_cost
+def cosine_similarity_matrix(a, b, data_is_normalized=False):
+    if not data_is_normalized:
+        a = normalize_features(a)
+        b = normalize_features(b)
+    # one (N,D) x (D,M) product gives the similarity of every pair
+    return np.dot(a, b.T)
+
+
+def gate_costs(iou_cost, linear_cost, exponential_cost, feature_cost, iou_thresh=0.3, linear_thresh=10000, exp_thresh=0.5, feat_thresh=0.2):
+    """
+    A pair keeps its IoU only if it passes all four thresholds, otherwise it is 0.
+    """
+    gate = (iou_cost >= iou_thresh) & (linear_cost >= linear_thresh) & (exponential_cost >= exp_thresh) & (feature_cost >= feat_thresh)
+    return np.where(gate, iou_cost, 0).astype(np.float32)
+
+
+def total_cost_matrix(old_boxes, new_boxes, old_features, new_features, w=1920, h=1080, features_are_normalized=False, **thresholds):
+    """
+    Vectorized Yolo_implmentation.total_cost for the full N x M block.
+    With features_are_normalized the feature cost is a single matrix multiply.
+    """
+    old_boxes = as_box_array(old_boxes)
+    new_boxes = as_box_array(new_boxes)
+    old_features = as_feature_array(old_features)
+    new_features = as_feature_array(new_features, old_features.shape[1])
+
+    iou_cost = box_iou_matrix(old_boxes, new_boxes)
+    linear_cost = sanchez_matilla_matrix(old_boxes, new_boxes, w=w, h=h)
+    exponential_cost = yu_matrix(old_boxes, new_boxes)
+    feature_cost = cosine_similarity_matrix(old_features, new_features, data_is_normalized=features_are_normalized)
+    return gate_costs(iou_cost, linear_cost, exponential_cost, feature_cost, **thresholds)
+
+
+def total_cost_pairs(old_boxes, new_boxes, old_features, new_features, w=1920, h=1080, features_are_normalized=False, **thresholds):
+    """
+    total_cost for K aligned pairs: old_boxes[k] against new_boxes[k]. Returns a (K,) array.
+    """
+    old_boxes = as_box_array(old_boxes)
+    new_boxes = as_box_array(new_boxes)
+    old_features = as_feature_array(old_features)
+    new_features = as_feature_array(new_features, old_features.shape[1])
+    if not features_are_normalized:
+        old_features = normalize_features(old_features)
+        new_features = normalize_features(new_features)
+
+    iou_cost = box_iou_pairs(old_boxes, new_boxes)
+    linear_cost = sanchez_matilla_pairs(old_boxes, new_boxes, w=w, h=h)
+    exponential_cost = yu_pairs(old_boxes, new_boxes)
+    # row-wise dot product of the aligned feature vectors
+    feature_cost = np.einsum('kd,kd->k', old_features, new_features)
+    return gate_costs(iou_cost, linear_cost, exponential_cost, feature_cost, **thresholds)
@@ -0,0 +1,90 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+import torch
+
+# batched crop-and-resize for the ReID encoder.
+# every box of a frame is cut out and resized straight into one preallocated uint8 buffer
+# with cv2, and the whole batch becomes a (N,3,H,W) float tensor in a single conversion.
+# this replaces the per-crop ToPILImage -> Resize -> ToTensor round trip.
+# optionally the batch is weighted by a Gaussian mask centered on the crop: the mask / 255 is one
+# precomputed (H,W,1) float32 multiplier, and the uint8 -> float conversion, the [0,1] scaling and
+# the weighting are a single multiply, so center-weighted crops cost the same as plain ones.
+
+
+@lru_cache(maxsize=None)
+def gaussian_mask(height=128, width=128, sigma=0.22):
+    """
+    (height, width) float32 tensor, 1.0 at the center of the crop and falling off as a Gaussian
+    of standard deviation sigma (in crop sizes) towards the edges. Built once per size and cached,
+    treat it as read-only.
+    """
+    # same grid as np.mgrid[0:1.0:128j, 0:1.0:128j] for a 128x128 crop
+    ys = np.linspace(0, 1, height)
+    xs = np.linspace(0, 1, width)
+    # a 2D Gaussian with a diagonal covariance is the outer product of two 1D Gaussians,
+    # and dividing by its maximum removes the normalization constant of the pdf
+    z = np.outer(np.exp(-(ys - 0.5) ** 2 / (2 * sigma ** 2)), np.exp(-(xs - 0.5) ** 2 / (2 * sigma ** 2)))
+    z = z / z.max()
+    return torch.from_numpy(z.astype(np.float32))
+
+
+def clamp_boxes(boxes, frame_width, frame_height):
+    """
+    Clip (N,4) [x1, y1, x2, y2] boxes to the frame and make every box at least 1x1 pixel,
+    so out-of-frame or degenerate boxes still give a crop instead of an error.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    boxes = np.nan_to_num(boxes)
+    x1 = np.clip(np.floor(boxes[:, 0]), 0, frame_width - 1).astype(np.int64)
+    y1 = np.clip(np.floor(boxes[:, 1]), 0, frame_height - 1).astype(np.int64)
+    # int() truncation of the old crop_frames, but never before x1 + 1 / y1 + 1
+    x2 = np.clip(boxes[:, 2].astype(np.int64), x1 + 1, frame_width)
+    y2 = np.clip(boxes[:, 3].astype(np.int64), y1 + 1, frame_height)
+    return np.stack([x1, y1, x2, y2], axis=1)
+
+
+class BatchCropper:
+    def __init__(self, size=(128, 128)):
+        """
+        size is the (height, width) every crop is resized to.
+        """
+        self.size = size
+        self.buffer = np.empty((0, size[0], size[1], 3), dtype=np.uint8)
+        # gaussian mask / 255 as (H,W,1): scales to [0,1] and weights the NHWC crops in one multiply
+        self.mask_scale = (gaussian_mask(*size) / 255.0).unsqueeze(-1)
+
+    def get_buffer(self, n):
+        # grow the buffer only when a frame has more boxes than any frame before
+        if len(self.buffer) < n:
+            self.buffer = np.empty((n, self.size[0], self.size[1], 3), dtype=np.uint8)
+        return self.buffer[:n]
+
+    def crop(self, frame, boxes, mask=False):
+        """
+        Crop and resize every box of frame (H,W,3 uint8).
+        Returns the list of original crops (views into frame) and a (N,3,H,W) float tensor in [0,1].
+        mask=True multiplies the tensor by the Gaussian mask (see gaussian_mask).
+        """
+        frame_height, frame_width = frame.shape[:2]
+        boxes = clamp_boxes(boxes, frame_width, frame_height)
+        out_height, out_width = self.size
+
+        buffer = self.get_buffer(len(boxes))
+        crops = []
+        for i, (x1, y1, x2, y2) in enumerate(boxes):
+            crop = frame[y1:y2, x1:x2]
+            crops.append(crop)
+            # INTER_AREA when shrinking behaves like an antialiased resize, INTER_LINEAR when growing
+            shrinking = crop.shape[0] > out_height or crop.shape[1] > out_width
+            cv2.resize(crop, (out_width, out_height), dst=buffer[i], interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+        # NHWC uint8 -> float in [0,1] (masked or not) in one pass that also copies, so the buffer can
+        # be reused next frame; the NCHW tensor is a view of the result
+        crops_uint8 = torch.from_numpy(buffer)
+        if mask:
+            crops_pytorch = torch.mul(crops_uint8, self.mask_scale)
+        else:
+            crops_pytorch = torch.div(crops_uint8, 255.0)
+        return crops, crops_pytorch.permute(0, 3, 1, 2)
@@ -0,0 +1,233 @@
+import copy
+import warnings
+from time import perf_counter
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# faster CPU inference for the ReID encoder (siamese_net.SiameseNetwork).
+# the network is a stack of Conv -> ReLU -> BatchNorm blocks. in eval mode a BatchNorm is a fixed
+# per-channel affine map, and since none of the convs pad their input it can be folded exactly
+# into the next conv's weights and bias. the folded net is put in channels_last layout, traced
+# and frozen with TorchScript, and optionally quantized to int8. select_encoder times every
+# variant on real crops and keeps the fastest one whose embeddings stay within a cosine
+# tolerance of the original model. an encoder with a projection head (see projection_head.py)
+# keeps its head on top of every variant.
+#
+# export a frozen model once and load it later:
+#   python encoder_runtime.py models/model640.pt models/model640_optimized.pt
+
+
+class EncoderModule(nn.Module):
+    """
+    forward_once of SiameseNetwork as a plain module: runs the conv stack and squeezes the output.
+    With a head (a projection to a smaller embedding) the flattened output goes through it.
+    """
+    def __init__(self, net, channels_last=False, head=None):
+        super().__init__()
+        self.net = net
+        self.channels_last = channels_last
+        self.head = head
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.head is None:
+            return torch.squeeze(self.net(x))
+        return self.head(torch.flatten(self.net(x), 1))
+
+
+def run_encoder_model(encoder, crops):
+    # SiameseNetwork-like models expose forward_once, exported TorchScript encoders are called directly
+    return encoder.forward_once(crops) if hasattr(encoder, 'forward_once') else encoder(crops)
+
+
+def embedding_dim(encoder, crop_size):
+    """
+    Length of the embedding the encoder gives for (height, width) crops.
+    Raises ValueError when the encoder cannot take crops of that size.
+    """
+    example = torch.zeros(2, 3, crop_size[0], crop_size[1])
+    try:
+        with torch.inference_mode():
+            output = run_encoder_model(encoder, example)
+    except RuntimeError as e:
+        raise ValueError(f"The ReID encoder does not accept {crop_size[0]}x{crop_size[1]} crops: {e}")
+    return int(np.prod(output.shape[1:]))
+
+
+def batchnorm_affine(bn):
+    # eval-mode BatchNorm as y = scale * x + shift, per channel
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps) if bn.affine else 1 / torch.sqrt(bn.running_var + bn.eps)
+    shift = (bn.bias if bn.affine else 0) - bn.running_mean * scale
+    return scale, shift
+
+
+def can_fold(conv):
+    # zero padding happens after the BatchNorm in the original net, so folding is only exact without it
+    padding = (0,) * len(conv.kernel_size) if conv.padding == 'valid' else conv.padding
+    return isinstance(conv, nn.Conv2d) and conv.groups == 1 and all(p == 0 for p in padding)
+
+
+@torch.no_grad()
+def fold_batchnorm(net):
+    """
+    Copy of an nn.Sequential where every BatchNorm2d directly followed by a foldable Conv2d is
+    merged into that conv: conv(scale * x + shift) = conv'(x) with W' = W * scale and
+    b' = b + sum(W * shift). BatchNorms that cannot be folded are kept as they are.
+    """
+    layers = list(copy.deepcopy(net))
+    folded = []
+    i = 0
+    while i < len(layers):
+        layer = layers[i]
+        following = layers[i + 1] if i + 1 < len(layers) else None
+        if isinstance(layer, nn.BatchNorm2d) and following is not None and can_fold(following):
+            scale, shift = batchnorm_affine(layer)
+            weight = following.weight
+            bias = following.bias if following.bias is not None else torch.zeros(weight.shape[0])
+            conv = copy.deepcopy(following)
+            conv.weight = nn.Parameter(weight * scale[None, :, None, None])
+            conv.bias = nn.Parameter(bias + (weight * shift[None, :, None, None]).sum(dim=(1, 2, 3)))
+            folded.append(conv)
+            i += 2
+            continue
+        folded.append(layer)
+        i += 1
+    return nn.Sequential(*folded).eval()
+
+
+def trace_encoder(module, example):
+    """TorchScript trace of module on example, frozen for inference."""
+    with torch.inference_mode():
+        traced = torch.jit.trace(module.eval(), example, check_trace=False)
+    return torch.jit.freeze(traced)
+
+
+def quantize_encoder(net, calibration):
+    """
+    Static int8 post-training quantization of a conv stack with FX graph mode,
+    calibrated on a batch of real crops.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(net).eval(), mapping, example_inputs=(calibration,))
+    with torch.inference_mode():
+        prepared(calibration)
+    return convert_fx(prepared)
+
+
+def build_variants(model, example, quantize=False):
+    """
+    Candidate encoders for the SiameseNetwork model, by name. Variants that fail to build
+    on this machine (e.g. no int8 backend) are left out.
+    """
+    model = model.eval()
+    head = getattr(model, 'head', None)
+
+    def module(net, channels_last=False):
+        return EncoderModule(net, channels_last, copy.deepcopy(head)).eval()
+
+    variants = {"eager": module(model.net)}
+    folded = fold_batchnorm(model.net)
+    variants["folded"] = module(folded)
+    # tracing and quantization warn about their deprecation in recent torch releases
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            variants["folded_traced"] = trace_encoder(module(folded), example)
+            channels_last = copy.deepcopy(folded).to(memory_format=torch.channels_last)
+            variants["folded_traced_channels_last"] = trace_encoder(module(channels_last, channels_last=True), example)
+        except RuntimeError:
+            pass
+        if quantize:
+            try:
+                # only the conv stack is quantized, the head stays in float
+                variants["int8"] = trace_encoder(module(quantize_encoder(folded, example)), example)
+            except (RuntimeError, AssertionError, NotImplementedError):
+                pass
+    return variants
+
+
+def min_cosine(reference, output):
+    """Smallest cosine similarity between matching rows of two (N, dim) embedding batches."""
+    reference = reference.reshape(len(reference), -1).float()
+    output = output.reshape(len(reference), -1).float()
+    return nn.functional.cosine_similarity(reference, output, dim=1).min().item()
+
+
+def time_variant(encoder, example, repeat=3):
+    # best of a few runs after one warm up run
+    with torch.inference_mode():
+        encoder(example)
+        best = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            encoder(example)
+            best = min(best, perf_counter() - start)
+    return best
+
+
+def select_encoder(model, example, quantize=False, tolerance=0.999, int8_tolerance=0.98, repeat=3):
+    """
+    Builds the variants of model, checks their embeddings on example against the original
+    model and returns (name, encoder, report) for the fastest one within the cosine tolerance.
+    report maps every variant name to its time in seconds and its smallest cosine similarity.
+    """
+    variants = build_variants(model, example, quantize)
+    with torch.inference_mode():
+        reference = variants["eager"](example)
+
+    report = {}
+    best_name = "eager"
+    for name, encoder in variants.items():
+        with torch.inference_mode():
+            cosine = min_cosine(reference, encoder(example))
+        seconds = time_variant(encoder, example, repeat)
+        report[name] = {"seconds": seconds, "min_cosine": cosine}
+        accurate = cosine >= (int8_tolerance if name == "int8" else tolerance)
+        if accurate and seconds < report[best_name]["seconds"]:
+            best_name = name
+    return best_name, variants[best_name], report
+
+
+def export_encoder(model, path, example, quantize=False):
+    """Saves the fastest accurate variant as a frozen TorchScript file and returns its name and report."""
+    name, encoder, report = select_encoder(model, example, quantize)
+    if not isinstance(encoder, torch.jit.ScriptModule):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            encoder = trace_encoder(encoder, example)
+    torch.jit.save(encoder, path)
+    return name, report
+
+
+def load_encoder(path):
+    """Loads an encoder saved by export_encoder, ready to call on (N, 3, H, W) crops."""
+    return torch.jit.load(path, map_location=torch.device('cpu')).eval()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export an optimized ReID encoder')
+    parser.add_argument('model', type=str, help='SiameseNetwork checkpoint, e.g. models/model640.pt')
+    parser.add_argument('output', type=str, help='Where to save the frozen TorchScript encoder')
+    parser.add_argument('--quantize', action='store_true', help='Also try an int8 quantized variant')
+    parser.add_argument('--crop-size', type=int, default=128)
+    args = parser.parse_args()
+
+    model = torch.load(args.model, map_location=torch.device('cpu'))
+    # random crops are enough to compare the variants, the int8 calibration wants real ones
+    example = torch.rand(16, 3, args.crop_size, args.crop_size)
+    name, report = export_encoder(model, args.output, example, args.quantize)
+    for variant, result in report.items():
+        print(f"{variant:<30} {result['seconds'] * 1000:>8.2f} ms  min cosine {result['min_cosine']:.5f}")
+    print(f"saved {name} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import importlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from multiprocessing import get_context
+from time import time
+
+# job queue of the API, stored in SQLite so it needs no outside service.
+# /upload saves the file and submits a job, which returns at once; a pool of workers claims the
+# queued jobs one at a time and runs them, reporting frames processed as they go, so /jobs/{id}
+# can show the state, the progress, the FPS and the ETA of every job. the queue lives in one
+# SQLite file, shared by the API and the workers: the workers are processes (one tracker each,
+# the tracking of a job never holds the GIL of the server) or threads of the server itself.
+# every worker has a name (host:pid:thread) and a heartbeat in the workers table, and a claimed job
+# records the worker running it. a running job is queued again only once its worker is gone: its
+# heartbeat is older than the lease, or it was a process of this host that no longer exists.
+# worker processes can report stats of their own after every job (e.g. their stage timings), kept
+# per worker in the queue so the server can add them up.
+#
+#   jobs = JobQueue("uploads/jobs.db")
+#   pool = WorkerPool(jobs, "object_tracking_api:run_job", workers=2).start()
+#   jobs.submit(job_id, {"file_path": ...})
+#   jobs.get(job_id)  # {"state": "running", "frames": 120, "fps": 24.1, "eta_s": 31.2, ...}
+
+STATES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue:
+    def __init__(self, path="jobs.db", progress_interval=1.0, lease=30.0):
+        """
+        path: SQLite file of the queue (created if needed).
+        progress_interval: seconds between two progress writes of a running job.
+        lease: seconds without a heartbeat after which a worker is taken for dead and its job queued again.
+        """
+        self.path = path
+        self.progress_interval = progress_interval
+        self.lease = lease
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, state TEXT NOT NULL, params TEXT NOT NULL,
+                frames INTEGER NOT NULL DEFAULT 0, total_frames INTEGER,
+                created_at REAL NOT NULL, started_at REAL, finished_at REAL,
+                result TEXT, error TEXT, owner TEXT)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS workers (
+                name TEXT PRIMARY KEY, host TEXT NOT NULL, pid INTEGER NOT NULL, heartbeat REAL NOT NULL)""")
+            # kept after the worker is gone, so totals over the workers never go down
+            conn.execute("""CREATE TABLE IF NOT EXISTS worker_stats (
+                name TEXT PRIMARY KEY, stats TEXT NOT NULL, updated_at REAL NOT NULL)""")
+            # queues created before the owner column
+            if "owner" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    @contextmanager
+    def connection(self):
+        # a connection per call: the API handlers, the worker threads and processes all use the queue
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, job_id, params):
+        """Queues a job; params is a JSON-friendly dict handed to the worker's handler."""
+        with self.connection() as conn:
+            conn.execute("INSERT INTO jobs (id, state, params, created_at) VALUES (?, 'queued', ?, ?)",
+                         (job_id, json.dumps(params), time()))
+        return job_id
+
+    def heartbeat(self, worker):
+        """Records that the worker (a name from worker_name()) is alive."""
+        host, pid, _ = worker.split(":", 2)
+        with self.connection() as conn:
+            conn.execute("""INSERT INTO workers (name, host, pid, heartbeat) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(name) DO UPDATE SET heartbeat = excluded.heartbeat""", (worker, host, int(pid), time()))
+
+    def claim(self, worker):
+        """
+        Marks the oldest queued job as running by worker and returns (id, params), or None when the
+        queue is empty. The jobs of dead workers are queued again first.
+        """
+        with self.connection() as conn:
+            # the write lock is taken first, so two workers never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            self.requeue_abandoned(conn)
+            row = conn.execute("SELECT id, params FROM jobs WHERE state = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET state = 'running', started_at = ?, owner = ? WHERE id = ?",
+                             (time(), worker, row["id"]))
+            conn.execute("COMMIT")
+        return None if row is None else (row["id"], json.loads(row["params"]))
+
+    def progress(self, job_id, worker, frames, total_frames=None):
+        with self.connection() as conn:
+            conn.execute("UPDATE jobs SET frames = ?, total_frames = COALESCE(?, total_frames) WHERE id = ? AND owner = ?",
+                         (frames, total_frames, job_id, worker))
+
+    def reporter(self, job_id, worker):
+        """
+        progress(frames, total_frames=None) callback for the job. Writes at most every progress_interval
+        seconds, and always on the last frame once total_frames is known.
+        """
+        last = [0.0]
+        total = [None]
+
+        def report(frames, total_frames=None):
+            total[0] = total_frames or total[0]
+            now = time()
+            if now - last[0] >= self.progress_interval or (total[0] is not None and frames >= total[0]):
+                last[0] = now
+                self.progress(job_id, worker, frames, total_frames)
+        return report
+
+    def finish(self, job_id, worker, result=None, error=None):
+        # only while the worker still owns the job: once queued again, it belongs to the next worker
+        with self.connection() as conn:
+            conn.execute("UPDATE jobs SET state = ?, finished_at = ?, result = ?, error = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                         ('failed' if error is not None else 'done', time(), json.dumps(result), error, job_id, worker))
+
+    def dead_workers(self, conn):
+        """Names of the workers whose lease expired or whose process is gone from this host."""
+        host = socket.gethostname()
+        expired = time() - self.lease
+        return [row["name"] for row in conn.execute("SELECT name, host, pid, heartbeat FROM workers")
+                if row["heartbeat"] < expired or (row["host"] == host and not pid_alive(row["pid"]))]
+
+    def requeue_abandoned(self, conn=None):
+        """Queues the running jobs of dead workers (and of no known worker) again; returns how many."""
+        if conn is None:
+            with self.connection() as conn:
+                return self.requeue_abandoned(conn)
+        dead = self.dead_workers(conn)
+        conn.execute(f"DELETE FROM workers WHERE name IN ({','.join('?' * len(dead))})", dead)
+        return conn.execute("""UPDATE jobs SET state = 'queued', started_at = NULL, frames = 0, owner = NULL
+                               WHERE state = 'running' AND (owner IS NULL OR owner NOT IN (SELECT name FROM workers))""").rowcount
+
+    def report_stats(self, worker, stats):
+        """Stores the latest stats (a JSON-friendly dict, cumulative over the worker's jobs) of the worker."""
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO worker_stats (name, stats, updated_at) VALUES (?, ?, ?)",
+                         (worker, json.dumps(stats), time()))
+
+    def worker_stats(self):
+        """The latest stats of every worker that reported some, live or not."""
+        with self.connection() as conn:
+            return [json.loads(row["stats"]) for row in conn.execute("SELECT stats FROM worker_stats")]
+
+    def get(self, job_id):
+        """State, progress, FPS and ETA of the job, None when there is no such job."""
+        with self.connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            position = None
+            if row["state"] == 'queued':
+                position = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND created_at < ?",
+                                        (row["created_at"],)).fetchone()[0]
+        end = row["finished_at"] or time()
+        elapsed = end - row["started_at"] if row["started_at"] is not None else 0.0
+        fps = row["frames"] / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if row["state"] == 'running' and fps > 0 and row["total_frames"]:
+            eta = round(max(0, row["total_frames"] - row["frames"]) / fps, 1)
+        return {
+            "job_id": row["id"],
+            "state": row["state"],
+            "worker": row["owner"] if row["state"] == 'running' else None,
+            "queue_position": position,
+            "frames": row["frames"],
+            "total_frames": row["total_frames"],
+            "fps": round(fps, 2),
+            "eta_s": eta,
+            "elapsed_s": round(elapsed, 1),
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": row["error"],
+        }
+
+    def counts(self):
+        """Number of jobs in every state."""
+        with self.connection() as conn:
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, owned by another user
+        return True
+    return True
+
+
+def worker_name():
+    # unique among the live workers of every host sharing the queue
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def resolve_handler(handler):
+    # "module:function" (importable in a worker process) or the function itself
+    if not isinstance(handler, str):
+        return handler
+    module, name = handler.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def work(path, handler, stop, poll_interval=0.5, initializer=None, stats=None):
+    """
+    Worker loop: claims jobs from the queue at path and runs handler(params, progress) on them
+    until stop is set. The handler's return value is stored as the job result, an exception
+    fails the job. progress(frames, total_frames=None) reports how far the job is.
+    initializer() runs once before the first job, stats() after every job (see report_stats).
+    """
+    jobs = JobQueue(path)
+    handler = resolve_handler(handler)
+    worker = worker_name()
+    if initializer is not None:
+        resolve_handler(initializer)()
+    stats = resolve_handler(stats) if stats is not None else None
+    jobs.heartbeat(worker)
+    # heartbeats keep the lease on the claimed job while the handler runs
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(jobs.lease / 3):
+            jobs.heartbeat(worker)
+    threading.Thread(target=beat, name=f"{worker}-heartbeat", daemon=True).start()
+    try:
+        while not stop.is_set():
+            job = jobs.claim(worker)
+            if job is None:
+                stop.wait(poll_interval)
+                continue
+            job_id, params = job
+            try:
+                result = handler(params, jobs.reporter(job_id, worker))
+            except Exception as e:
+                jobs.finish(job_id, worker, error=f"{type(e).__name__}: {e}")
+            else:
+                jobs.finish(job_id, worker, result)
+            if stats is not None:
+                jobs.report_stats(worker, stats())
+    finally:
+        done.set()
+
+
+class WorkerPool:
+    def __init__(self, jobs, handler, workers=1, mode='process', initializer=None, stats=None):
+        """
+        workers running the jobs of a JobQueue.
+        handler: "module:function" taking (params, progress), imported by every worker process;
+        in 'thread' mode it can also be the function itself.
+        mode: 'process' (worker processes, started with spawn) or 'thread' (threads of this process).
+        initializer: "module:function" run by every worker before its first job (e.g. to load the models).
+        stats: "module:function" returning the worker's stats, stored after every job (see JobQueue.report_stats).
+        """
+        if mode not in ('process', 'thread'):
+            raise ValueError(f"Unknown worker mode '{mode}', use 'process' or 'thread'")
+        if mode == 'process' and not all(isinstance(f, str) for f in (handler, initializer, stats) if f is not None):
+            raise ValueError("Worker processes need the handler, initializer and stats as 'module:function' strings")
+        self.jobs = jobs
+        self.handler = handler
+        self.initializer = initializer
+        self.stats = stats
+        self.workers = workers
+        self.mode = mode
+        self.stop_event = None
+        self.runners = []
+
+    def start(self):
+        self.jobs.requeue_abandoned()
+        if self.mode == 'process':
+            context = get_context("spawn")
+            self.stop_event = context.Event()
+            # not daemons: a job may start processes of its own (sharded tracking), stop() ends them
+            self.runners = [context.Process(target=work, args=(self.jobs.path, self.handler, self.stop_event),
+                                            kwargs=self.worker_kwargs(), name=f"job-worker-{n}") for n in range(self.workers)]
+        else:
+            self.stop_event = threading.Event()
+            self.runners = [threading.Thread(target=work, args=(self.jobs.path, self.handler, self.stop_event),
+                                             kwargs=self.worker_kwargs(), name=f"job-worker-{n}", daemon=True)
+                            for n in range(self.workers)]
+        for runner in self.runners:
+            runner.start()
+        return self
+
+    def worker_kwargs(self):
+        return {"initializer": self.initializer, "stats": self.stats}
+
+    def stop(self, timeout=10):
+        """Lets the workers finish their current job for up to timeout seconds, then stops the worker processes."""
+        self.stop_event.set()
+        for runner in self.runners:
+            runner.join(timeout)
+            if self.mode == 'process' and runner.is_alive():
+                # its job stays 'running' until a worker sees the process is gone and queues it again
+                runner.terminate()
+                runner.join()
+        self.runners = []
+
+    def alive(self):
+        return sum(runner.is_alive() for runner in self.runners)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show the jobs of a queue')
+    parser.add_argument('path', type=str, nargs='?', default=os.path.join('uploads', 'jobs.db'))
+    parser.add_argument('job_ids', type=str, nargs='*')
+    args = parser.parse_args()
+
+    jobs = JobQueue(args.path)
+    print(jobs.counts())
+    for job_id in args.job_ids:
+        print(json.dumps(jobs.get(job_id), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import numpy as np
+
+# constant-velocity Kalman filter for all tracks at once.
+# the state of a track is [cx, cy, w, h, vx, vy, vw, vh] (box center, size and their velocities).
+# states and covariances of every track are stacked in (capacity, 8) and (capacity, 8, 8) arrays,
+# indexed by the TrackStore slot of the track, so predict and update are a handful of batched
+# matrix operations whatever the number of tracks.
+# noise is scaled with the box height, as in SORT / DeepSORT.
+
+
+def boxes_to_measurements(boxes):
+    # [x1, y1, x2, y2] -> [cx, cy, w, h]
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    wh = boxes[:, 2:] - boxes[:, :2]
+    return np.concatenate([boxes[:, :2] + wh / 2, wh], axis=1)
+
+
+def measurements_to_boxes(measurements):
+    # [cx, cy, w, h] -> [x1, y1, x2, y2]
+    half = measurements[:, 2:4] / 2
+    return np.concatenate([measurements[:, :2] - half, measurements[:, :2] + half], axis=1)
+
+
+class BatchKalmanFilter:
+    def __init__(self, capacity=1024, dt=1.0, std_position=1. / 20, std_velocity=1. / 160):
+        """
+        capacity: number of rows, one per track slot (see TrackStore)
+        dt: time step between two frames
+        std_position, std_velocity: noise as a fraction of the box height
+        """
+        self.std_position = std_position
+        self.std_velocity = std_velocity
+
+        # x' = F x: positions move by their velocity every step
+        self.F = np.eye(8)
+        self.F[:4, 4:] = dt * np.eye(4)
+        # z = H x: we only measure the box
+        self.H = np.eye(4, 8)
+
+        self.mean = np.zeros((capacity, 8))
+        self.covariance = np.zeros((capacity, 8, 8))
+
+    def initiate(self, rows, boxes):
+        """
+        Start new tracks at the given boxes with zero velocity and a wide velocity uncertainty.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        z = boxes_to_measurements(boxes)
+        h = np.maximum(z[:, 3:4], 1)
+        std = np.concatenate([2 * self.std_position * h] * 4 + [10 * self.std_velocity * h] * 4, axis=1)
+
+        self.mean[rows] = 0
+        self.mean[rows, :4] = z
+        self.covariance[rows] = 0
+        self.covariance[rows[:, None], np.arange(8), np.arange(8)] = std ** 2
+
+    def predict(self, rows):
+        """
+        Move the given tracks one time step forward.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        mean = self.mean[rows]
+        # heights are floored at one pixel so a collapsed box never gives a singular covariance
+        h = np.maximum(mean[:, 3:4], 1)
+        std = np.concatenate([self.std_position * h] * 4 + [self.std_velocity * h] * 4, axis=1)
+
+        # x = F x, P = F P F^T + Q for all rows in one go
+        self.mean[rows] = mean @ self.F.T
+        covariance = self.F @ self.covariance[rows] @ self.F.T
+        covariance[:, np.arange(8), np.arange(8)] += std ** 2
+        self.covariance[rows] = covariance
+
+    def update(self, rows, boxes):
+        """
+        Correct the given tracks with their measured boxes.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        z = boxes_to_measurements(boxes)
+        mean = self.mean[rows]
+        covariance = self.covariance[rows]
+
+        h = np.maximum(mean[:, 3:4], 1)
+        r = np.concatenate([self.std_position * h] * 4, axis=1) ** 2
+        # S = H P H^T + R (the projection just takes the top-left 4x4 block)
+        S = covariance[:, :4, :4].copy()
+        S[:, np.arange(4), np.arange(4)] += r
+        # K = P H^T S^-1, solved as S K^T = H P since S is symmetric
+        PHt = covariance[:, :, :4]
+        gain = np.linalg.solve(S, np.transpose(PHt, (0, 2, 1))).transpose(0, 2, 1)
+
+        innovation = z - mean[:, :4]
+        self.mean[rows] = mean + np.einsum('nij,nj->ni', gain, innovation)
+        # P = P - K S K^T
+        self.covariance[rows] = covariance - gain @ S @ np.transpose(gain, (0, 2, 1))
+
+    def boxes(self, rows):
+        """
+        Current (predicted or corrected) boxes of the tracks as [x1, y1, x2, y2].
+        """
+        return measurements_to_boxes(self.mean[np.asarray(rows, dtype=np.int64), :4])
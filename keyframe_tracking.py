@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+
+# keyframe detection mode.
+# YOLO only runs on keyframes; on the frames in between the stored obstacles are moved
+# with sparse Lucas-Kanade optical flow on a downscaled grayscale frame (or with the
+# Kalman prediction alone). keyframes come every `stride` frames, or adaptively when
+# the scene changes more than a threshold since the last keyframe.
+
+
+class KeyframeScheduler:
+    def __init__(self, stride=1, adaptive=False, motion_threshold=8.0):
+        """
+        stride: run the detector every `stride` frames (in adaptive mode, at least that often)
+        adaptive: also force a keyframe when the mean absolute gray level difference with the
+                  last keyframe goes above motion_threshold
+        """
+        self.stride = max(int(stride), 1)
+        self.adaptive = adaptive
+        self.motion_threshold = motion_threshold
+        self.reset()
+
+    def reset(self):
+        self.frames_since_keyframe = None
+        self.keyframe_gray = None
+        self.force_next = False
+
+    def is_keyframe(self, gray):
+        """
+        Decide if the detector must run on this frame. gray is the downscaled grayscale frame.
+        """
+        keyframe = (self.frames_since_keyframe is None
+                    or self.force_next
+                    or self.frames_since_keyframe + 1 >= self.stride)
+
+        if not keyframe and self.adaptive and self.keyframe_gray is not None:
+            motion = cv2.absdiff(gray, self.keyframe_gray).mean()
+            keyframe = motion > self.motion_threshold
+
+        if keyframe:
+            self.frames_since_keyframe = 0
+            self.keyframe_gray = gray
+            self.force_next = False
+        else:
+            self.frames_since_keyframe += 1
+        return keyframe
+
+    def request_keyframe(self):
+        # e.g. when optical flow lost most of the tracks
+        self.force_next = True
+
+
+class OpticalFlowPropagator:
+    def __init__(self, scale=0.5, grid=4, win_size=(15, 15), max_level=2):
+        """
+        scale: downscale factor applied to the frames before computing the flow
+        grid: a grid x grid set of points is tracked inside every box
+        """
+        self.scale = scale
+        self.grid = grid
+        self.lk_params = dict(winSize=win_size, maxLevel=max_level,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+    def prepare(self, frame):
+        """
+        Downscaled grayscale version of an RGB frame, used by both the flow and the scheduler.
+        """
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    def propagate(self, prev_gray, gray, boxes):
+        """
+        Move boxes (N,4) [x1, y1, x2, y2] from prev_gray to gray.
+        Every box is shifted by the median displacement of its tracked points.
+        Returns the new boxes (N,4) float and a (N,) mask of boxes the flow could follow.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return boxes, np.zeros(0, dtype=bool)
+
+        # grid x grid points inside each box, in downscaled coordinates
+        steps = (np.arange(self.grid) + 0.5) / self.grid
+        small = boxes * self.scale
+        xs = small[:, 0:1] + (small[:, 2:3] - small[:, 0:1]) * steps[None, :]
+        ys = small[:, 1:2] + (small[:, 3:4] - small[:, 1:2]) * steps[None, :]
+        points = np.stack([np.repeat(xs, self.grid, axis=1), np.tile(ys, (1, self.grid))], axis=2)
+        points = points.reshape(-1, 1, 2).astype(np.float32)
+
+        # one LK call for the points of all boxes
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **self.lk_params)
+
+        displacement = (new_points - points).reshape(len(boxes), -1, 2).astype(np.float64)
+        valid = status.reshape(len(boxes), -1).astype(bool)
+        displacement[~valid] = np.nan
+
+        ok = valid.sum(axis=1) >= max(self.grid * self.grid // 4, 1)
+        shift = np.zeros((len(boxes), 2))
+        if ok.any():
+            shift[ok] = np.nanmedian(displacement[ok], axis=1) / self.scale
+
+        new_boxes = boxes + np.concatenate([shift, shift], axis=1)
+        return new_boxes, ok
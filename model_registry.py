@@ -0,0 +1,106 @@
+import gc
+import threading
+from time import perf_counter
+
+# process-wide model registry.
+# every weight file (detector, ReID encoder, class names) is loaded once per process, on first
+# use, and the same object is handed to every tracker after that. the models are only ever run
+# for inference, so sharing them is safe, and a new tracker session costs no loading at all.
+# objects derived from a model (its embedding size, the optimized encoder variant) are cached
+# here as well, under their own keys.
+#
+# for pre-fork servers, call preload() in the parent before forking the workers: the weights
+# are then shared copy-on-write between all workers instead of loaded once per worker.
+# preload also moves everything loaded so far out of the garbage collector's reach (gc.freeze),
+# so the collector does not write to those objects in the children and unshare their pages.
+# this only works for forked workers: a spawned process (multiprocessing's "spawn" start method,
+# the default on macOS and Windows, and what job_queue.py and sharded_tracking.py use) starts a
+# fresh interpreter and loads its own copy, so preloading in its parent only costs the parent
+# the memory and the load time. spawned workers load their models themselves, on first use or
+# in their initializer.
+
+DETECTOR_PATH = 'models/yolov5s.pt'
+ENCODER_PATH = 'models/model640.pt'
+CLASSES_PATH = 'models/coco.names'
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.models = {}
+        # seconds spent loading each key
+        self.load_times = {}
+        # reentrant: a loader may fetch another model (e.g. the encoder for its embedding size)
+        self.lock = threading.RLock()
+
+    def get(self, key, load):
+        """The object cached under key, built with load() the first time it is asked for."""
+        model = self.models.get(key)
+        if model is not None:
+            return model
+        with self.lock:
+            # another thread may have loaded it while this one waited
+            if key not in self.models:
+                start = perf_counter()
+                self.models[key] = load()
+                self.load_times[key] = perf_counter() - start
+            return self.models[key]
+
+    def detector(self, path=DETECTOR_PATH, conf=0.5, iou=0.4):
+        def load():
+            import yolov5
+            model = yolov5.load(path)
+            model.conf = conf
+            model.iou = iou
+            return model
+        return self.get(('detector', path, conf, iou), load)
+
+    def encoder(self, path=ENCODER_PATH):
+        def load():
+            import torch
+            encoder = torch.load(path, map_location=torch.device('cpu'))
+            from projection_head import is_projected_checkpoint, load_projected_encoder
+            if is_projected_checkpoint(encoder):
+                # weights of an encoder with a projection head (see projection_head.py)
+                encoder = load_projected_encoder(encoder)
+            encoder = encoder.eval()
+            # inference only: no gradients, so nothing is ever written to the weights' pages
+            for parameter in encoder.parameters():
+                parameter.requires_grad_(False)
+            return encoder
+        return self.get(('encoder', path), load)
+
+    def class_names(self, path=CLASSES_PATH):
+        def load():
+            with open(path, 'rt') as f:
+                # a tuple, so no tracker can change the names the others see
+                return tuple(f.read().rstrip('\n').split('\n'))
+        return self.get(('classes', path), load)
+
+    def loaded(self):
+        """Keys loaded so far with their load time in seconds."""
+        with self.lock:
+            return {key: round(seconds, 3) for key, seconds in self.load_times.items()}
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+            self.load_times.clear()
+
+
+# the registry of this process
+registry = ModelRegistry()
+
+
+def preload(detector_path=DETECTOR_PATH, encoder_path=ENCODER_PATH, classes_path=CLASSES_PATH, freeze=True):
+    """
+    Loads the models now instead of on first use, e.g. in a server before it forks its workers.
+    freeze=True also freezes the garbage collector's view of everything loaded (gc.freeze),
+    so forked workers share the weights' memory pages copy-on-write (spawned ones do not).
+    """
+    registry.detector(detector_path)
+    registry.encoder(encoder_path)
+    registry.class_names(classes_path)
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return registry.loaded()
@@ -0,0 +1,251 @@
+import argparse
+import configparser
+import glob
+import json
+import os
+from collections import defaultdict
+from time import perf_counter
+
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from cost_matrix import box_iou_matrix
+from stage_timing import stage_timings, format_stage_report
+
+# offline evaluation on MOTChallenge-format sequences.
+# a sequence is a folder with seqinfo.ini, the frames in img1/ (000001.jpg, ...) and the ground
+# truth in gt/gt.txt. the tracker runs over the frames, its tracks are written in the MOT result
+# format (frame,id,x,y,w,h,conf,-1,-1,-1) and scored against the ground truth with the CLEAR MOT
+# metrics (MOTA, MOTP, ID switches, FP, FN) and IDF1, next to the FPS and the time spent in every
+# stage of the tracker, so a speed change and its accuracy cost show up in the same run.
+#
+#   python mot_eval.py data/MOT17/train --sequences MOT17-04-FRCNN --output-dir mot_results/
+#
+# simplifications against the official devkit: ground truth rows with a 0 flag (col 7) or a class
+# other than --gt-classes are dropped, and tracks matched to dropped (distractor) boxes are not
+# forgiven, so the numbers are a little pessimistic but comparable from one run to the next.
+
+
+def read_seqinfo(sequence_dir):
+    """Image folder, extension, frame rate and length of a sequence (defaults when seqinfo.ini is missing)."""
+    info = {"imDir": "img1", "imExt": ".jpg", "frameRate": "30", "seqLength": None}
+    path = os.path.join(sequence_dir, "seqinfo.ini")
+    if os.path.exists(path):
+        parser = configparser.ConfigParser()
+        parser.read(path)
+        info.update(parser["Sequence"])
+    return info
+
+
+def sequence_frames(sequence_dir):
+    """Sorted paths of the frames of a sequence."""
+    info = read_seqinfo(sequence_dir)
+    paths = sorted(glob.glob(os.path.join(sequence_dir, info["imDir"], f"*{info['imExt']}")))
+    if info["seqLength"] is not None:
+        paths = paths[:int(info["seqLength"])]
+    return paths
+
+
+def read_mot_boxes(path, classes=None):
+    """
+    {frame: (ids, (N, 4) x1,y1,x2,y2 boxes)} from a MOT gt.txt or result file.
+    classes keeps only the rows of those class ids, and drops the rows with a 0 flag (ground truth).
+    """
+    rows = np.loadtxt(path, delimiter=",", ndmin=2)
+    if classes is not None and rows.shape[1] >= 8:
+        rows = rows[(rows[:, 6] != 0) & np.isin(rows[:, 7], classes)]
+    boxes = defaultdict(lambda: (np.empty(0, dtype=np.int64), np.empty((0, 4))))
+    for frame in np.unique(rows[:, 0]).astype(int):
+        r = rows[rows[:, 0] == frame]
+        boxes[frame] = (r[:, 1].astype(np.int64), np.column_stack([r[:, 2], r[:, 3], r[:, 2] + r[:, 4], r[:, 3] + r[:, 5]]))
+    return boxes
+
+
+def write_mot_results(path, records):
+    """records: (frame, id, x1, y1, x2, y2, conf) rows, written in the MOT result format."""
+    with open(path, "w") as f:
+        for frame, idx, x1, y1, x2, y2, conf in records:
+            f.write(f"{frame},{idx},{x1:.2f},{y1:.2f},{x2 - x1:.2f},{y2 - y1:.2f},{conf:.2f},-1,-1,-1\n")
+
+
+def evaluate(gt, results, frames, iou_threshold=0.5):
+    """
+    CLEAR MOT and identity metrics of results against gt (both from read_mot_boxes) over frames 1..frames.
+    Matches need an IoU of at least iou_threshold; a ground truth object keeps its track as long as they
+    still overlap enough, the other pairs are matched with the Hungarian algorithm on the IoU.
+    """
+    num_gt = num_results = matches = false_positives = misses = switches = 0
+    iou_sum = 0.0
+    last_match = {}
+    # frames where a (gt id, track id) pair overlaps, for IDF1
+    overlaps = defaultdict(int)
+    for frame in range(1, frames + 1):
+        gt_ids, gt_boxes = gt[frame]
+        result_ids, result_boxes = results[frame]
+        num_gt += len(gt_ids)
+        num_results += len(result_ids)
+        if len(gt_ids) == 0 or len(result_ids) == 0:
+            misses += len(gt_ids)
+            false_positives += len(result_ids)
+            continue
+        iou = box_iou_matrix(gt_boxes, result_boxes)
+        for g, r in zip(*np.nonzero(iou >= iou_threshold)):
+            overlaps[gt_ids[g], result_ids[r]] += 1
+
+        # keep last frame's correspondences that still overlap, then solve the rest
+        cost = np.where(iou >= iou_threshold, iou, 0.0)
+        result_index = {idx: r for r, idx in enumerate(result_ids.tolist())}
+        for g, gt_id in enumerate(gt_ids.tolist()):
+            r = result_index.get(last_match.get(gt_id))
+            if r is not None and cost[g, r] > 0:
+                cost[g, :] = 0
+                cost[:, r] = 0
+                cost[g, r] = 2.0
+        rows, cols = linear_sum_assignment(-cost)
+        keep = cost[rows, cols] > 0
+        rows, cols = rows[keep], cols[keep]
+
+        for g, r in zip(rows.tolist(), cols.tolist()):
+            gt_id, result_id = gt_ids[g], result_ids[r]
+            if gt_id in last_match and last_match[gt_id] != result_id:
+                switches += 1
+            last_match[gt_id] = result_id
+            iou_sum += float(iou[g, r])
+        matches += len(rows)
+        misses += len(gt_ids) - len(rows)
+        false_positives += len(result_ids) - len(rows)
+
+    # IDF1: best one-to-one assignment of track ids to ground truth ids over the whole sequence
+    id_true_positives = 0
+    if overlaps:
+        gt_keys = sorted({g for g, _ in overlaps})
+        result_keys = sorted({r for _, r in overlaps})
+        counts = np.zeros((len(gt_keys), len(result_keys)))
+        gt_pos = {g: i for i, g in enumerate(gt_keys)}
+        result_pos = {r: i for i, r in enumerate(result_keys)}
+        for (g, r), count in overlaps.items():
+            counts[gt_pos[g], result_pos[r]] = count
+        rows, cols = linear_sum_assignment(-counts)
+        id_true_positives = int(counts[rows, cols].sum())
+
+    return {
+        "gt": num_gt, "results": num_results, "matches": matches, "fp": false_positives, "fn": misses,
+        "id_switches": switches, "idtp": id_true_positives, "iou_sum": iou_sum,
+    }
+
+
+def summarize(counts):
+    """MOTA, MOTP, IDF1, precision and recall from the counts of evaluate (or their sums)."""
+    gt, results = counts["gt"], counts["results"]
+    return {
+        "mota": 1 - (counts["fn"] + counts["fp"] + counts["id_switches"]) / gt if gt else 0.0,
+        "motp": counts["iou_sum"] / counts["matches"] if counts["matches"] else 0.0,
+        "idf1": 2 * counts["idtp"] / (gt + results) if gt + results else 0.0,
+        "precision": counts["matches"] / results if results else 0.0,
+        "recall": counts["matches"] / gt if gt else 0.0,
+        "id_switches": counts["id_switches"], "fp": counts["fp"], "fn": counts["fn"],
+    }
+
+
+def track_sequence(tracker, frame_paths, classes, batch_size=1):
+    """Runs the tracker over the frames, returns MOT result records and the tracking time (without image reads)."""
+    records = []
+    tracking_time = 0.0
+    for start in range(0, len(frame_paths), batch_size):
+        with stage_timings.stage("decode", count=len(frame_paths[start:start + batch_size])):
+            batch = [cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB) for path in frame_paths[start:start + batch_size]]
+        begin = perf_counter()
+        for offset, (_, obstacles) in enumerate(tracker.process_batch(batch)):
+            frame = start + offset + 1
+            for obstacle in obstacles:
+                # the tracks the tracker shows: the ones drawn on its output frames
+                if obstacle.age >= tracker.MIN_HIT_STREAK and (classes is None or obstacle.category in classes):
+                    records.append((frame, obstacle.idx + 1, *obstacle.box, 1.0))
+        tracking_time += perf_counter() - begin
+    return records, tracking_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the tracker on MOTChallenge-format sequences')
+    parser.add_argument('data_dir', type=str, help='Folder of sequences (e.g. MOT17/train) or a single sequence')
+    parser.add_argument('--sequences', type=str, nargs='+', default=None, help='Sequence names to run (default: all)')
+    parser.add_argument('--output-dir', type=str, default='mot_results', help='Where the <sequence>.txt results go')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--classes', type=str, nargs='+', default=['person'], help='Tracked coco classes kept in the results')
+    parser.add_argument('--gt-classes', type=int, nargs='+', default=[1], help='Ground truth class ids scored (MOT17: 1 = pedestrian)')
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU needed for a match (default: 0.5)')
+    parser.add_argument('--json', type=str, default=None, help='Also write the metrics to this JSON file')
+    # tracker settings under evaluation
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--detect-every', type=int, default=1)
+    parser.add_argument('--lazy-embedding', action='store_true')
+    parser.add_argument('--min-hit-streak', type=int, default=None)
+    parser.add_argument('--max-unmatched-age', type=int, default=None)
+    parser.add_argument('--iou-thresh', type=float, default=None, help='total_cost IoU threshold')
+    parser.add_argument('--linear-thresh', type=float, default=None, help='total_cost Sanchez-Matilla threshold')
+    parser.add_argument('--exp-thresh', type=float, default=None, help='total_cost Yu threshold')
+    parser.add_argument('--feat-thresh', type=float, default=None, help='total_cost appearance threshold')
+    args = parser.parse_args()
+
+    from object_tracking import Yolo_implmentation
+    tracker = Yolo_implmentation()
+    tracker.HEADLESS = True
+    tracker.LAZY_EMBEDDING = args.lazy_embedding
+    tracker.set_keyframe_mode(args.detect_every)
+    if args.min_hit_streak is not None:
+        tracker.MIN_HIT_STREAK = args.min_hit_streak
+    if args.max_unmatched_age is not None:
+        tracker.MAX_UNMATCHED_AGE = args.max_unmatched_age
+    tracker.COST_THRESHOLDS = {name: getattr(args, name) for name in ('iou_thresh', 'linear_thresh', 'exp_thresh', 'feat_thresh')
+                               if getattr(args, name) is not None}
+    classes = [tracker.classes.index(name) for name in args.classes]
+
+    if os.path.isdir(os.path.join(args.data_dir, "gt")):
+        sequence_dirs = [args.data_dir]
+    else:
+        sequence_dirs = sorted(d for d in glob.glob(os.path.join(args.data_dir, "*")) if os.path.isdir(os.path.join(d, "gt")))
+    if args.sequences is not None:
+        sequence_dirs = [d for d in sequence_dirs if os.path.basename(os.path.normpath(d)) in args.sequences]
+    if not sequence_dirs:
+        parser.error(f"no MOTChallenge sequences (folders with gt/gt.txt) found in {args.data_dir}")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    stage_timings.reset()
+    metrics = {}
+    totals = defaultdict(int)
+    total_frames = total_time = 0
+    for sequence_dir in sequence_dirs:
+        name = os.path.basename(os.path.normpath(sequence_dir))
+        frame_paths = sequence_frames(sequence_dir)[:args.max_frames]
+        tracker.reset()
+        records, tracking_time = track_sequence(tracker, frame_paths, classes, args.batch_size)
+        result_path = os.path.join(args.output_dir, f"{name}.txt")
+        write_mot_results(result_path, records)
+
+        counts = evaluate(read_mot_boxes(os.path.join(sequence_dir, "gt", "gt.txt"), args.gt_classes),
+                          read_mot_boxes(result_path) if records else defaultdict(lambda: (np.empty(0), np.empty((0, 4)))),
+                          len(frame_paths), args.iou)
+        for key, value in counts.items():
+            totals[key] += value
+        metrics[name] = {**summarize(counts), "frames": len(frame_paths), "fps": len(frame_paths) / tracking_time if tracking_time else 0.0}
+        total_frames += len(frame_paths)
+        total_time += tracking_time
+    metrics["OVERALL"] = {**summarize(totals), "frames": total_frames, "fps": total_frames / total_time if total_time else 0.0}
+
+    print(f"{'sequence':>22} {'frames':>7} {'FPS':>7} {'MOTA':>7} {'IDF1':>7} {'MOTP':>7} {'IDsw':>6} {'FP':>7} {'FN':>7}")
+    for name, m in metrics.items():
+        print(f"{name:>22} {m['frames']:>7} {m['fps']:>7.1f} {m['mota'] * 100:>6.1f}% {m['idf1'] * 100:>6.1f}% "
+              f"{m['motp']:>7.3f} {m['id_switches']:>6} {m['fp']:>7} {m['fn']:>7}")
+    print()
+    stages = stage_timings.report()
+    print(format_stage_report(stages))
+    print(f"\nResults written to {args.output_dir}/")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"metrics": metrics, "stages": stages, "settings": vars(args)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,216 @@
 # imports
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
+# only what tracking needs is imported here, cold start matters for autoscaled workers
+# (python startup_profile.py object_tracking shows where the import time goes)
 import copy
-import glob
-import pickle
 import cv2
-import re
 import numpy as np
 import torch
-import torchvision
-import torchvision.datasets as dset
-import torchvision.transforms as transforms
-import torchvision.utils
-from torch.utils.data import DataLoader,Dataset
-from torch.autograd import Variable
-import torch.nn as nn
-from torch import optim
-import torch.nn.functional as F
-import yolov5
-from scipy.stats import multivariate_normal # while cropping the obstacles
 from math import sqrt, exp
 from scipy.optimize import linear_sum_assignment # required in associate function. 
-from tqdm import tqdm
 import argparse
+import json
 import os
+from collections import namedtuple
+from contextlib import nullcontext
+from time import time, perf_counter
+from cost_matrix import total_cost_matrix, as_feature_array, normalize_features
+from spatial_index import gated_assignment, unambiguous_pairs
+from crop_engine import BatchCropper, gaussian_mask
+from encoder_runtime import select_encoder, embedding_dim, run_encoder_model
+from model_registry import registry
+from appearance_gallery import AppearanceGallery
+from kalman_filter import BatchKalmanFilter
+from track_store import Obstacle, TrackStore
+from keyframe_tracking import KeyframeScheduler, OpticalFlowPropagator
+from video_pipeline import VideoPipeline, FramePool, format_pipeline_report
+from stage_timing import stage_timings, format_stage_report, profile_job, PROFILERS
 
 # global stored_obstacles
 # global idx
 
-class Obstacle():
-    def __init__(self, idx, box, features=None,  age=1, unmatched_age=0):
-        """
-        Init function. The obstacle must have an id and a box.
-        """
-        self.idx = idx
-        self.box = box
-        self.features = features
-        self.age = age
-        self.unmatched_age = unmatched_age
+# how tracks are moved on frames where the detector does not run
+PROPAGATION_MODES = ('flow', 'kalman')
+
+# what start_frame hands to finish_frame for one frame
+FrameState = namedtuple('FrameState', ['final_image', 'out_boxes', 'categories', 'slots', 'old_features', 'predicted_boxes',
+                                       'track_groups', 'detection_groups', 'clear_tracks', 'clear_detections', 'encoded'])
 
 class Yolo_implmentation:
-    def __init__(self, idx=0):
+    def __init__(self, idx=0, encoder_path="models/model640.pt", crop_size=(128, 128), detector_path="models/yolov5s.pt"):
+        """
+        encoder_path: ReID encoder, the SiameseNetwork model or a lighter one (see projection_head.py)
+        crop_size: (height, width) the detections are resized to before the encoder
+        detector_path: yolov5 weights
 
+        The models come from the process-wide registry (see model_registry.py): each file is
+        loaded once, by the first tracker that needs it, and shared read-only by all the others.
+        The detector is only loaded on the first detection.
+        """
 
-        self.model = yolov5.load('models/yolov5s.pt')
 
-        self.model.conf = 0.5
-        self.model.iou = 0.4
+        self.DETECTOR_PATH = detector_path
 
-        self.stored_obstacles = []
         self.idx = idx
 
 
         self.classesFile = "models/coco.names"
-        with open(self.classesFile,'rt') as f:
-            self.classes = f.read().rstrip('\n').split('\n')
+        self.classes = registry.class_names(self.classesFile)
 
         # hungarian
-        self.encoder = torch.load("models/model640.pt", map_location=torch.device('cpu'))
-        self.encoder = self.encoder.eval()
+        self.ENCODER_PATH = encoder_path
+        self.encoder = registry.encoder(encoder_path)
+
+        # the embedding size comes from the model: 1024 for SiameseNetwork, less with a projection head
+        self.CROP_SIZE = tuple(crop_size)
+        self.EMBEDDING_DIM = registry.get(('embedding_dim', encoder_path, self.CROP_SIZE), lambda: embedding_dim(self.encoder, self.CROP_SIZE))
+
+        # get_features runs the fastest encoder variant whose embeddings stay within a cosine
+        # tolerance of the original model (see encoder_runtime.py). it is picked on the first crops,
+        # once per process and encoder (the registry keeps it for the next trackers).
+        # QUANTIZE_ENCODER also tries an int8 model, which is faster but a little less exact.
+        self.OPTIMIZE_ENCODER = True
+        self.QUANTIZE_ENCODER = False
+        self.fast_encoder = None
+        self.encoder_report = None
+
+        # reuses one preallocated buffer for the crops of every frame
+        self.cropper = BatchCropper(size=self.CROP_SIZE)
+        # weight every crop with the gaussian mask (see get_gaussian_mask) before the encoder,
+        # so the embedding focuses on the center of the box rather than the background at its edges
+        self.USE_GAUSSIAN_MASK = True
+
+        # tracks live in the slots of preallocated arrays (see track_store.py)
+        # the slot of a track is also its row in the appearance gallery and in the motion model
+        self.MAX_TRACKS = 1024
+        self.tracks = TrackStore(capacity=self.MAX_TRACKS)
+
+        # appearance of every track: EMA embedding (see appearance_gallery.py)
+        # memory is bounded by MAX_TRACKS feature vectors
+        self.gallery = AppearanceGallery(max_tracks=self.MAX_TRACKS, dim=self.EMBEDDING_DIM)
+
+        # constant-velocity Kalman filter over all tracks (see kalman_filter.py)
+        # when enabled, association compares new detections with the predicted boxes
+        self.USE_MOTION_MODEL = True
+        self.motion = BatchKalmanFilter(capacity=self.MAX_TRACKS)
+
+        # keyframe mode (see keyframe_tracking.py). by default the detector runs on every frame,
+        # use set_keyframe_mode to only run it every few frames and propagate the tracks in between
+        self.flow = OpticalFlowPropagator()
+        self.set_keyframe_mode()
 
         self.MIN_HIT_STREAK = 1
         self.MAX_UNMATCHED_AGE = 1
+        # overrides of the total_cost thresholds used by associate (iou_thresh, linear_thresh,
+        # exp_thresh, feat_thresh, see cost_matrix.gate_costs), e.g. {'iou_thresh': 0.2}
+        self.COST_THRESHOLDS = {}
+
+        # headless (tracks-only) mode: no frame copies and no drawing, the processed frame is None
+        # and only the obstacles are returned. used when only the track table is needed.
+        self.HEADLESS = False
+
+        # tracks are drawn in place on the frame passed in. set COPY_FRAMES to keep that frame
+        # untouched and draw on a deep copy instead (costs one full-frame copy per frame)
+        self.COPY_FRAMES = False
+
+        # spatial gating of association candidates (see spatial_index.py)
+        # GATING_RADIUS grows the stored boxes by that many pixels before looking for overlaps
+        # below GATING_MIN_PAIRS (tracks x detections) the dense matrix is cheaper than building the grid
+        # (benchmarks/bench_gating.py: the gated path wins from about 140 x 140 on a 1080p frame)
+        self.USE_SPATIAL_GATING = True
+        self.GATING_RADIUS = 0
+        self.GATING_MIN_PAIRS = 20000
+
+        # lazy embedding: a track with a single candidate detection overlapping it by at least
+        # CLEAR_IOU (and no other track competing for it) is matched on geometry alone, and the
+        # encoder only runs on the other detections. such tracks still get a fresh appearance
+        # feature every EMBEDDING_REFRESH frames
+        self.LAZY_EMBEDDING = False
+        self.CLEAR_IOU = 0.5
+        self.EMBEDDING_REFRESH = 10
+        self.embedding_stats = {"detections": 0, "encoded": 0}
+
+        # class-partitioned association: tracks keep the class of their detections and are only
+        # matched with detections of the same class group, one smaller Hungarian problem per group.
+        # classes listed together in CLASS_GROUPS (names from coco.names) can still swap, e.g. a car
+        # the detector sometimes calls a truck. every other class is a group of its own.
+        self.PARTITION_BY_CLASS = True
+        self.set_class_groups((('car', 'bus', 'truck'), ('bicycle', 'motorbike')))
+
+        # time spent in every stage (detect, crop, embed, associate, update, draw, ...), see stage_timing.py
+        # shared by all trackers of the process by default
+        self.timings = stage_timings
 
         # for testing_main_function
         # self.stored_obstacles=[]
         # self.idx=0
 
-
-    def generate_random_color(self, idxx):
+    def set_class_groups(self, groups=()):
+        """
+        groups: tuples of coco class names associated together when PARTITION_BY_CLASS is set.
+        class_group maps every class id to its group id.
         """
-        Random function to convert an id to a color
-        Do what you want here but keep numbers below 255
+        self.CLASS_GROUPS = tuple(tuple(group) for group in groups)
+        self.class_group = np.arange(len(self.classes), dtype=np.int64)
+        for group in self.CLASS_GROUPS:
+            ids = [self.classes.index(name) for name in group]
+            self.class_group[ids] = min(ids)
+
+    def groups_of(self, categories):
+        # class group of each class id, unknown classes (-1) form their own group
+        categories = np.asarray(categories, dtype=np.int64)
+        return np.where(categories >= 0, self.class_group[np.clip(categories, 0, None)], -1)
+
+    def reset(self, idx=0):
         """
-        blue = idxx*5 % 256
-        green = idxx*12 %256
-        red = idxx*23 %256
-        return (red, green, blue)
+        Forget every track, e.g. before processing a new video.
+        """
+        self.idx = idx
+        self.tracks = TrackStore(capacity=self.MAX_TRACKS)
+        self.gallery = AppearanceGallery(max_tracks=self.MAX_TRACKS, dim=self.gallery.dim)
+        self.motion = BatchKalmanFilter(capacity=self.MAX_TRACKS)
+        self.keyframes.reset()
+        self.prev_gray = None
+        self.embedding_stats = {"detections": 0, "encoded": 0}
+
+    @property
+    def model(self):
+        # the shared yolov5 detector, loaded on first use. conf and iou are set once for all trackers
+        return registry.detector(self.DETECTOR_PATH)
+
+    def new_stream(self, idx=0):
+        """
+        Tracker for another video: shares the detector, the encoder and the settings of this one,
+        but has its own tracks, ids and keyframe state. The models are not copied.
+        """
+        stream = copy.copy(self)
+        stream.keyframes = copy.deepcopy(self.keyframes)
+        # the crop buffer is reused between frames, so every stream has its own
+        stream.cropper = BatchCropper(size=self.CROP_SIZE)
+        stream.reset(idx)
+        return stream
+
+    @property
+    def stored_obstacles(self):
+        # snapshot of the live tracks as Obstacle objects, in track order
+        return self.tracks.obstacles()
+
+    def set_keyframe_mode(self, stride=1, adaptive=False, propagation='flow'):
+        """
+        Run the detector every `stride` frames (adaptive: also when the scene changes a lot).
+        propagation is how tracks move on the other frames: 'flow' (optical flow) or 'kalman'.
+        """
+        if propagation not in PROPAGATION_MODES:
+            raise ValueError(
+                f"Unsupported propagation mode: {propagation}\n"
+                f"Supported modes are: {', '.join(PROPAGATION_MODES)}"
+            )
+        self.keyframes = KeyframeScheduler(stride=stride, adaptive=adaptive)
+        self.PROPAGATION = propagation
+        self.prev_gray = None
+
+    def generate_random_color(self, idxx):
+        """Color of an id, see track_color."""
+        return track_color(idxx)
 
     def draw_boxes(self, image, boxes, categories, mot_mode=False):
         
@@ -100,41 +232,63 @@ class Yolo_implmentation:
             cv2.putText(image, str(label), (int(box[0]), int(box[1])), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,255), thickness=3)
         return image
 
-    def get_yolo_model_results(self, img):
+    def get_yolo_model_results(self, img, draw=True):
 
         # pass input image to YOLO model. gets raw detection results. results is of length 1. 
-        results = self.model(img)
+        with self.timings.stage("detect"):
+            results = self.model(img)
         
         # get all predicted objects in an image.
         # each predicted object contains 6 values. 
         # First 4 are bounding box coordinates. [x1, y1, x2, y2] top-left corner, bottom-right corner
         # 5th value is confidence score.
         # 6th value is label. this label is from coco.names
-        predictions = results.pred[0]
-
-        # get bounding box coordinates for all detections. 
-        boxes = predictions[:, :4].tolist()
-        
-        # convert floating point coordinates to integers.
-        boxes_int = [[int(v) for v in box] for box in boxes]
-
-        # get all confidence scores. 
-        scores = predictions[:,4].tolist()
-
-        # get all class IDs
-        categories = predictions[:,5].tolist()
-
-        # convert class IDs to integers.
-        categories_int = [int(c) for c in categories]
+        return self.parse_yolo_predictions(img, results.pred[0], draw=draw)
+
+    # runs the detector once on a list of images (one batch) instead of once per image.
+    # returns one get_yolo_model_results tuple per image, in order.
+    # the images are not drawn on: nothing downstream uses the drawn detector output.
+    def get_yolo_model_results_batch(self, imgs):
+        # timed per frame: the batch time is split evenly between its frames
+        with self.timings.stage("detect", count=len(imgs)):
+            results = self.model(list(imgs))
+        return [self.parse_yolo_predictions(img, predictions, draw=False) for img, predictions in zip(imgs, results.pred)]
+
+    # tuning the batch size against the available cores.
+    # times the detector on sample frames for every candidate batch size (powers of 2 up to the
+    # number of cores) and returns the one with the best frames per second.
+    # one untimed forward pass first takes the first-call costs (lazy init, allocator warm up),
+    # then every size keeps its best of `repeat` runs, so no size is charged for them.
+    def tune_batch_size(self, sample_frames, max_batch_size=16, repeat=3):
+        max_batch_size = min(max_batch_size, os.cpu_count() or 1, len(sample_frames))
+        self.model(list(sample_frames[:1]))
+        best_size, best_fps = 1, 0
+        size = 1
+        while size <= max_batch_size:
+            seconds = float('inf')
+            for _ in range(repeat):
+                start = perf_counter()
+                self.model(list(sample_frames[:size]))
+                seconds = min(seconds, perf_counter() - start)
+            fps = size / seconds
+            if fps > best_fps:
+                best_size, best_fps = size, fps
+            size *= 2
+        return best_size
+
+    def parse_yolo_predictions(self, img, predictions, draw=True):
+
+        # all detections of the image as one contiguous (N, 6) float32 array:
+        # [x1, y1, x2, y2, confidence, class id] per row, class ids from coco.names.
+        # the rows stay floats through crop, embed and associate, boxes only become ints when drawn.
+        detections = as_detection_array(predictions)
 
         # draws detection boxes and labels on image 
-        img_out = self.draw_boxes(img, boxes_int, categories_int, mot_mode=True)
+        img_out = self.draw_boxes(img, detections[:, :4], detections[:, 5], mot_mode=True) if draw else img
 
         # img_out: image with drawn boxes and labels.
-        # boxes_int: list of bounding box coordinates
-        # categories_int: list of object categories
-        # list of confidence scores. 
-        return img_out, boxes_int, categories_int, scores
+        # detections: (N, 6) array, boxes are detections[:, :4], scores detections[:, 4], categories detections[:, 5]
+        return img_out, detections
 
     def visualize_images(self, input_images):
         for i, img in enumerate(input_images):
@@ -149,31 +303,12 @@ class Yolo_implmentation:
     # cropping the obstacles
     # takes a image or frame of a video, and coordinates for cropping of objects. 
     def crop_frames(self, frame, boxes):
-        try:
-            # converts image to PIL
-            # resizes it to 128 x 128
-            # converts it back to PyTorch tensor
-            transforms = torchvision.transforms.Compose([torchvision.transforms.ToPILImage(), torchvision.transforms.Resize((128,128)), torchvision.transforms.ToTensor()])
-            
-            # stores original cropped images
-            crops = []
-
-            # stores transformed pytorch tensor versions
-            crops_pytorch = []
-
-            # for each box
-            for box in boxes:
-
-                # crops the frame using coordinates (height, width)
-                crop = frame[int(box[1]):int(box[3]), int(box[0]):int(box[2])]
-                crops.append(crop)
-
-                # transform the crop and adds it to crops_torch. 
-                crops_pytorch.append(transforms(crop))
-
-            return crops, torch.stack(crops_pytorch)
-        except:
-            return [],[]
+        # crops every box and resizes it to CROP_SIZE (128 x 128 by default) in one batch (see crop_engine.py).
+        # boxes outside the frame or with no area are clamped, so one bad box does not drop the whole frame.
+        # returns the original crops and a (N, 3, height, width) float tensor, weighted by the gaussian mask
+        # in the same multiply as the [0,1] scaling when USE_GAUSSIAN_MASK is set
+        with self.timings.stage("crop"):
+            return self.cropper.crop(frame, boxes, mask=self.USE_GAUSSIAN_MASK)
 
     # purpose of gaussian mask is to create a weight distribution that follows a bell curve shape.
     # highest in center and gradually decreasing towards edges. 
@@ -181,40 +316,11 @@ class Yolo_implmentation:
     # reduce influence of edge
     # create smooth attention or focus mechanisms
     def get_gaussian_mask(self):
-        # creates two coordinate grids ranging from 0 to 1 with 128 points each. 
-        # this a coordinate system for 128 x 128 image.
-        # each point (x,y) represents a pixel position. 
-        # values are normalized between 0 and 1. (center is 0.5, 0.5)
-        x, y = np.mgrid[0:1.0:128j, 0:1.0:128j]
-
-        # transforms coordinates into pairs. flatens the grid and then combines them. 
-        # each row becomes (x,y) coordinate pair. 
-        # result is (128*128, 2) = 16384 coordinate pairs. 
-        xy = np.column_stack([x.flat, y.flat])
-
-        # defines gaussian distribution params
-        # centers the peak of bell curve in middle of image
-        mu = np.array([0.5,0.5])
-        # controls how quickly values fall off from center.
+        # built once per crop size and cached by crop_engine.gaussian_mask:
+        # f(x,y) = exp(-((x-μx)² + (y-μy)²)/(2σ²)) on a grid from 0 to 1, centered on μ = (0.5, 0.5)
+        # with σ = 0.22, i.e. the 2D gaussian pdf with a diagonal covariance divided by its maximum.
         # smaller sigma = steeper fall = more focused center
         # larger sigma = gentle fall = more spread out weights
-        sigma = np.array([0.22,0.22])
-        # creates a diagonal matrix of variances (sigma 2) 
-        # using diagonal matrix means x and y directions are independent. 
-        # vale of sigma**2 = 0.0484 means ~95% of weights are within 2*0.022 = 0.44 units from center. 
-        covariance = np.diag(sigma**2)
-
-        # f(x,y) = (1/2πσ²) * exp(-((x-μx)² + (y-μy)²)/(2σ²))
-        # (y-μy)²)/(2σ²)): measures squared distance from center.
-        # exp(-((x-μx)²: creates characteristic bell shape curve. 
-        # result is highest (1.0) at center and decreases exponentially with distance.
-        z = multivariate_normal.pdf(xy, mean=mu, cov=covariance)
-        z = z.reshape(x.shape)
-
-        z = z / z.max()
-        z  = z.astype(np.float32)
-
-        mask = torch.from_numpy(z)
 
         # resulting mask will look like. 
         # 1. center pixel = 1.0 (white)
@@ -225,7 +331,8 @@ class Yolo_implmentation:
         # center pixels retain most of original values. 
         # edge pixels are dampened. 
         # creates circular effect. 
-        return mask
+        # with USE_GAUSSIAN_MASK, crop_frames applies it to every crop before the encoder.
+        return gaussian_mask(*self.cropper.size)
     
     # called 4th in total_cost
     # calculates cosine similarity between two sets of vectors. 
@@ -264,12 +371,25 @@ class Yolo_implmentation:
     def get_features(self, processed_crops):
         features = []
         if len(processed_crops)>0:
-            features = self.encoder.forward_once(processed_crops)
-            features = features.detach().cpu().numpy()
-            if len(features.shape)==1:
-                features = np.expand_dims(features,0)
+            # no autograd bookkeeping at all, the features are never backpropagated
+            with torch.inference_mode(), self.timings.stage("embed"):
+                features = self.run_encoder(processed_crops)
+            # (N, EMBEDDING_DIM) whatever the encoder squeezes
+            features = features.cpu().numpy().reshape(len(processed_crops), -1)
         return features  
 
+    def run_encoder(self, processed_crops):
+        # encoder.forward_once, or the optimized variant of it
+        if not self.OPTIMIZE_ENCODER or not hasattr(self.encoder, 'net'):
+            return run_encoder_model(self.encoder, processed_crops)
+        if self.fast_encoder is None:
+            # time the variants on at least 8 real crops
+            sample = processed_crops.repeat(-(-8 // len(processed_crops)), 1, 1, 1)
+            key = ('fast_encoder', self.ENCODER_PATH, self.CROP_SIZE, self.QUANTIZE_ENCODER)
+            name, self.fast_encoder, report = registry.get(key, lambda: select_encoder(self.encoder, sample, quantize=self.QUANTIZE_ENCODER))
+            self.encoder_report = {"variant": name, "variants": report}
+        return self.fast_encoder(processed_crops)
+
     # called 1st in total_cost
     def box_iou(self, box1, box2, w = 1280, h=360):
         xA = max(box1[0], box2[0])
@@ -322,17 +442,16 @@ class Yolo_implmentation:
         exponential_cost = self.yu(old_box, new_box)
         feature_cost = self.cosine_similarity(old_features, new_features)[0][0]
 
-        print(iou_cost)
-        
         if (iou_cost >= iou_thresh and linear_cost >= linear_thresh and exponential_cost>=exp_thresh and feature_cost >= feat_thresh):
             return iou_cost
         else:
             return 0
 
-    def associate(self, old_boxes, new_boxes, old_features, new_features):
+    def associate(self, old_boxes, new_boxes, old_features, new_features, features_are_normalized=False):
         """
         old_boxes will represent the former bounding boxes (at time 0)
         new_boxes will represent the new bounding boxes (at time 1)
+        features_are_normalized skips the L2 normalization when both feature sets are already unit length
         Function goal: Define a Hungarian Matrix with IOU as a metric and return, for each box, an id
         """
         if len(old_boxes)==0 and len(new_boxes)==0:
@@ -342,42 +461,39 @@ class Yolo_implmentation:
         elif(len(new_boxes)==0):
             return [], [], [i for i in range(len(old_boxes))]# Weird trick 
             
-        # Define a new IOU Matrix nxm with old and new boxes
-        iou_matrix = np.zeros((len(old_boxes),len(new_boxes)),dtype=np.float32)
-        
-        # Go through boxes and store the IOU value for each box 
-        # You can also use the more challenging cost but still use IOU as a reference for convenience (use as a filter only)
-        for i,old_box in enumerate(old_boxes):
-            for j,new_box in enumerate(new_boxes):
-                iou_matrix[i][j] = self.total_cost(old_box, new_box, old_features[i].reshape(1,1024), new_features[j].reshape(1,1024))
+        if self.USE_SPATIAL_GATING and len(old_boxes)*len(new_boxes) >= self.GATING_MIN_PAIRS:
+            # only score pairs whose boxes overlap (or are within GATING_RADIUS pixels)
+            # and run the Hungarian algorithm on each connected group of candidates
+            hungarian_row, hungarian_col, hungarian_cost = gated_assignment(old_boxes, new_boxes, old_features, new_features, radius=self.GATING_RADIUS, features_are_normalized=features_are_normalized, **self.COST_THRESHOLDS)
+        else:
+            # Define a new IOU Matrix nxm with old and new boxes
+            # total_cost_matrix applies the same thresholds as total_cost, but for the whole nxm block at once
+            # You can also use the more challenging cost but still use IOU as a reference for convenience (use as a filter only)
+            iou_matrix = total_cost_matrix(old_boxes, new_boxes, old_features, new_features, features_are_normalized=features_are_normalized, **self.COST_THRESHOLDS)
 
-        #print(iou_matrix)
-        # Call for the Hungarian Algorithm
-        hungarian_row, hungarian_col = linear_sum_assignment(-iou_matrix)
-        hungarian_matrix = np.array(list(zip(hungarian_row, hungarian_col)))
+            # Call for the Hungarian Algorithm
+            hungarian_row, hungarian_col = linear_sum_assignment(-iou_matrix)
+            hungarian_cost = iou_matrix[hungarian_row, hungarian_col]
 
         # Create new unmatched lists for old and new boxes
-        matches, unmatched_detections, unmatched_trackers = [], [], []
+        matches = []
 
-        #print(hungarian_matrix)
-        
         # Go through old boxes, if no matched detection, add it to the unmatched_old_boxes
-        for t,trk in enumerate(old_boxes):
-            if(t not in hungarian_matrix[:,0]):
-                unmatched_trackers.append(t)
-        
+        assigned_rows = set(hungarian_row.tolist())
+        unmatched_trackers = [t for t in range(len(old_boxes)) if t not in assigned_rows]
+
         # Go through new boxes, if no matched tracking, add it to the unmatched_new_boxes
-        for d, det in enumerate(new_boxes):
-            if(d not in hungarian_matrix[:,1]):
-                    unmatched_detections.append(d)
-        
+        assigned_cols = set(hungarian_col.tolist())
+        unmatched_detections = [d for d in range(len(new_boxes)) if d not in assigned_cols]
+
         # Go through the Hungarian Matrix, if matched element has IOU < threshold (0.3), add it to the unmatched 
-        for h in hungarian_matrix:
-            if(iou_matrix[h[0],h[1]]<0.3):
-                unmatched_trackers.append(h[0]) # Return INDICES directly
-                unmatched_detections.append(h[1]) # Return INDICES directly
+        iou_thresh = self.COST_THRESHOLDS.get('iou_thresh', 0.3)
+        for row, col, cost in zip(hungarian_row, hungarian_col, hungarian_cost):
+            if(cost<iou_thresh):
+                unmatched_trackers.append(row) # Return INDICES directly
+                unmatched_detections.append(col) # Return INDICES directly
             else:
-                matches.append(h.reshape(1,2))
+                matches.append(np.array([[row, col]]))
         
         if(len(matches)==0):
             matches = np.empty((0,2),dtype=int)
@@ -388,62 +504,253 @@ class Yolo_implmentation:
         return matches, unmatched_detections,unmatched_trackers
 
     # imitates main function running for single image at a time. 
-    def process_single_image(self, input_image):
+    # detections can be passed in when they were computed ahead, e.g. by get_yolo_model_results_batch
+    def process_single_image(self, input_image, detections=None):
         # global stored_obstacles
         # global idx
-        # 1 — Run Obstacle Detection & Convert the Boxes
-        final_image = copy.deepcopy(input_image)
-        h, w, _ = final_image.shape
-
-        _, out_boxes, _, _ = self.get_yolo_model_results(input_image)
-        crops, crops_pytorch = self.crop_frames(final_image, out_boxes)
-        features = self.get_features(crops_pytorch)
-        
-        # print("----> New Detections: ", out_boxes)
-        # Define the list we'll return:
-        new_obstacles = []
+        frame_state, crops_pytorch = self.start_frame(input_image, detections)
+        return self.finish_frame(frame_state, self.get_features(crops_pytorch))
 
-        old_obstacles = [obs.box for obs in self.stored_obstacles] # Simply get the boxes
-        old_features = [obs.features for obs in self.stored_obstacles]
-        
-        matches, unmatched_detections, unmatched_tracks = self.associate(old_obstacles, out_boxes, old_features, features)
-
-        # Matching
-        for match in matches:
-            obs = Obstacle(self.stored_obstacles[match[0]].idx, out_boxes[match[1]], features[match[1]], self.stored_obstacles[match[0]].age +1)
-            new_obstacles.append(obs)
-            # print("Obstacle ", obs.idx, " with box: ", obs.box, "has been matched with obstacle ", stored_obstacles[match[0]].box, "and now has age: ", obs.age)
-        
-        # New (Unmatched) Detections
-        for d in unmatched_detections:
-            obs = Obstacle(self.idx, out_boxes[d], features[d])
-            new_obstacles.append(obs)
-            self.idx+=1
-            # print("Obstacle ", obs.idx, " has been detected for the first time: ", obs.box)
-
-        # Unmatched Tracks
-        for t in unmatched_tracks:
-            i = old_obstacles.index(self.stored_obstacles[t].box)
-            # print("Old Obstacles tracked: ", stored_obstacles[i].box)
-            if i is not None:
-                obs = self.stored_obstacles[i]
-                obs.unmatched_age +=1
-                new_obstacles.append(obs)
-                # print("Obstacle ", obs.idx, "is a long term obstacle unmatched ", obs.unmatched_age, "times.")
+    # first half of process_single_image: detection, motion prediction and the crops to encode.
+    # returns the state finish_frame needs and the (N, 3, H, W) crops. the two halves are split so
+    # the crops of several trackers can go through the encoder as one batch (see stream_engine.py)
+    def start_frame(self, input_image, detections=None):
+        # 1 — Run Obstacle Detection & Convert the Boxes
+        # the tracks are drawn in place on the input frame, COPY_FRAMES draws on a copy instead.
+        # headless mode never draws, so it never copies
+        final_image = self.output_frame(input_image)
+        h, w, _ = input_image.shape
+
+        # the detector's own drawing is not used, the crops are taken from the clean frame
+        if detections is None:
+            detections = self.get_yolo_model_results(input_image, draw=False)
+        _, detections = detections
+        out_boxes = detections[:, :4]
+        categories = detections[:, 5].astype(np.int64)
+
+        tracks = self.tracks
+        slots = tracks.order
+        old_features = self.gallery.embeddings(slots)
+
+        # move every track one frame forward and associate against where it should be now
+        start = perf_counter()
+        if self.USE_MOTION_MODEL:
+            self.motion.predict(slots)
+            predicted_boxes = self.motion.boxes(slots)
+        else:
+            predicted_boxes = tracks.boxes[slots]
+
+        # lazy embedding: pairs that geometry alone settles are matched first, and only the other
+        # detections (plus the clear ones whose track is due for an appearance refresh) are encoded
+        track_groups = self.groups_of(tracks.classes[slots])
+        detection_groups = self.groups_of(categories)
+        clear_tracks, clear_detections = self.clear_matches(predicted_boxes, out_boxes, slots, track_groups, detection_groups)
+        self.timings.observe("predict", perf_counter() - start)
+        encoded = np.ones(len(out_boxes), dtype=bool)
+        refresh = tracks.feature_ages[slots[clear_tracks]] + 1 >= self.EMBEDDING_REFRESH
+        encoded[clear_detections[~refresh]] = False
+        encoded = np.flatnonzero(encoded)
+        self.embedding_stats["detections"] += len(out_boxes)
+        self.embedding_stats["encoded"] += len(encoded)
+
+        crops, crops_pytorch = self.crop_frames(input_image, out_boxes[encoded])
+        frame_state = FrameState(final_image, out_boxes, categories, slots, old_features, predicted_boxes,
+                                 track_groups, detection_groups, clear_tracks, clear_detections, encoded)
+        return frame_state, crops_pytorch
+
+    # second half of process_single_image: association with the features of the crops and track updates
+    def finish_frame(self, frame_state, features):
+        (final_image, out_boxes, categories, slots, old_features, predicted_boxes,
+         track_groups, detection_groups, clear_tracks, clear_detections, encoded) = frame_state
+        tracks = self.tracks
+
+        # normalize the new features once, the gallery embeddings are already unit length
+        features = normalize_features(as_feature_array(features, self.gallery.dim))
+        # row of each detection in features, -1 when it was not encoded
+        feature_rows = np.full(len(out_boxes), -1, dtype=np.int64)
+        feature_rows[encoded] = np.arange(len(encoded))
+
+        # second stage: the usual association for everything that was not settled
+        start = perf_counter()
+        rest_tracks = np.setdiff1d(np.arange(len(slots)), clear_tracks)
+        rest_detections = np.setdiff1d(np.arange(len(out_boxes)), clear_detections)
+        matches, unmatched_detections, unmatched_tracks = self.associate_partitioned(
+            predicted_boxes[rest_tracks], out_boxes[rest_detections], old_features[rest_tracks], features[feature_rows[rest_detections]],
+            track_groups[rest_tracks], detection_groups[rest_detections])
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        matches = np.concatenate([np.stack([clear_tracks, clear_detections], axis=1), np.stack([rest_tracks[matches[:, 0]], rest_detections[matches[:, 1]]], axis=1)])
+        unmatched_detections = rest_detections[np.asarray(unmatched_detections, dtype=np.int64)]
+        unmatched_tracks = rest_tracks[np.asarray(unmatched_tracks, dtype=np.int64)]
+        detection_boxes = out_boxes
+        self.timings.observe("associate", perf_counter() - start)
+        start = perf_counter()
+
+        # Matching: the matched slots take their detection box
+        matched_slots = slots[matches[:, 0]]
+        tracks.boxes[matched_slots] = detection_boxes[matches[:, 1]]
+        tracks.classes[matched_slots] = categories[matches[:, 1]]
+        tracks.ages[matched_slots] += 1
+        tracks.unmatched_ages[matched_slots] = 0
+
+        # New (Unmatched) Detections get the next ids and free slots
+        # (when the store is full of matched tracks, the extra detections are not tracked)
+        unmatched_detections = unmatched_detections[:tracks.capacity - len(matched_slots)]
+        new_ids = np.arange(self.idx, self.idx + len(unmatched_detections))
+        self.idx += len(unmatched_detections)
+        new_slots, evicted = tracks.add(new_ids, detection_boxes[unmatched_detections], categories[unmatched_detections], protected=matched_slots)
+        self.gallery.reset(new_slots)
+
+        # Unmatched Tracks get older
+        unmatched_slots = slots[unmatched_tracks]
+        unmatched_slots = unmatched_slots[~np.isin(unmatched_slots, evicted)]
+        tracks.unmatched_ages[unmatched_slots] += 1
+
+        # new appearance features for matched and new tracks (the ones that were encoded)
+        tracks.feature_ages[slots] += 1
+        updated_slots = np.concatenate([matched_slots, new_slots])
+        updated_rows = feature_rows[np.concatenate([matches[:, 1], unmatched_detections])]
+        self.gallery.update(updated_slots[updated_rows >= 0], features[updated_rows[updated_rows >= 0]])
+        tracks.feature_ages[updated_slots[updated_rows >= 0]] = 0
+
+        if self.USE_MOTION_MODEL:
+            # correct the matched tracks with their detections and start the new ones
+            self.motion.update(matched_slots, detection_boxes[matches[:, 1]])
+            self.motion.initiate(new_slots, detection_boxes[unmatched_detections])
+
+        # drop the tracks unmatched for too long and free their slots
+        order = np.concatenate([matched_slots, new_slots, unmatched_slots])
+        dropped = order[tracks.unmatched_ages[order] > self.MAX_UNMATCHED_AGE]
+        tracks.order = order[tracks.unmatched_ages[order] <= self.MAX_UNMATCHED_AGE]
+        tracks.remove(dropped)
+        self.gallery.reset(dropped)
+        self.timings.observe("update", perf_counter() - start)
 
         # Draw the Boxes
-        for i, obs in enumerate(new_obstacles):
-            if obs.unmatched_age > self.MAX_UNMATCHED_AGE:
-                new_obstacles.remove(obs)
+        if not self.HEADLESS:
+            with self.timings.stage("draw"):
+                for slot in tracks.order[tracks.ages[tracks.order] >= self.MIN_HIT_STREAK].tolist():
+                    self.draw_obstacle(final_image, tracks.ids[slot], tracks.boxes[slot])
+
+        return final_image, tracks.obstacles()
 
-            if obs.age >= self.MIN_HIT_STREAK:
-                left, top, right, bottom = obs.box
-                cv2.rectangle(final_image, (left, top), (right, bottom), self.generate_random_color(obs.idx*10), thickness=7)
-                final_image = cv2.putText(final_image, str(obs.idx),(left - 10,top - 10),cv2.FONT_HERSHEY_SIMPLEX, 1, self.generate_random_color(obs.idx*10),thickness=4)
+    def associate_partitioned(self, old_boxes, new_boxes, old_features, new_features, old_groups, new_groups):
+        """
+        associate run on every class group on its own (see PARTITION_BY_CLASS), same outputs as
+        associate with the indices mapped back to the full old_boxes / new_boxes.
+        The features are expected to be L2 normalized already.
+        """
+        if not self.PARTITION_BY_CLASS:
+            return self.associate(old_boxes, new_boxes, old_features, new_features, features_are_normalized=True)
+
+        matches, unmatched_detections, unmatched_tracks = [np.empty((0, 2), dtype=np.int64)], [], []
+        for group in np.union1d(old_groups, new_groups):
+            rows = np.flatnonzero(old_groups == group)
+            cols = np.flatnonzero(new_groups == group)
+            group_matches, group_detections, group_tracks = self.associate(old_boxes[rows], new_boxes[cols], old_features[rows], new_features[cols], features_are_normalized=True)
+            group_matches = np.asarray(group_matches, dtype=np.int64).reshape(-1, 2)
+            matches.append(np.stack([rows[group_matches[:, 0]], cols[group_matches[:, 1]]], axis=1))
+            unmatched_detections.extend(cols[np.asarray(group_detections, dtype=np.int64)].tolist())
+            unmatched_tracks.extend(rows[np.asarray(group_tracks, dtype=np.int64)].tolist())
+        return np.concatenate(matches), unmatched_detections, unmatched_tracks
+
+    def clear_matches(self, predicted_boxes, new_boxes, slots, track_groups=None, detection_groups=None):
+        """
+        First, geometry-only stage of the lazy association: (track, detection) index pairs that
+        are matched without looking at appearance. Empty unless LAZY_EMBEDDING is set.
+        With PARTITION_BY_CLASS only pairs of the same class group are considered.
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if not self.LAZY_EMBEDDING:
+            return empty
+        if not self.PARTITION_BY_CLASS:
+            track_groups = detection_groups = None
+        rows, cols = unambiguous_pairs(predicted_boxes, new_boxes, clear_iou=self.CLEAR_IOU, radius=self.GATING_RADIUS,
+                                       old_groups=track_groups, new_groups=detection_groups, **self.COST_THRESHOLDS)
+        # tracks coming back after a miss are re-identified with their appearance
+        settled = self.tracks.unmatched_ages[slots[rows]] == 0
+        return rows[settled], cols[settled]
+
+    def embedding_report(self):
+        """Detections seen and crops actually given to the encoder since the last reset."""
+        detections, encoded = self.embedding_stats["detections"], self.embedding_stats["encoded"]
+        return {"detections": detections, "encoded": encoded, "encoded_fraction": round(encoded / detections, 3) if detections else 1.0}
+
+    def output_frame(self, input_image):
+        # frame the tracks are drawn on: None in headless mode, a copy with COPY_FRAMES, else the input itself
+        if self.HEADLESS:
+            return None
+        return copy.deepcopy(input_image) if self.COPY_FRAMES else input_image
+
+    def draw_obstacle(self, image, idx, box):
+        # draws the track box and its id in the track color, in place
+        draw_track(image, idx, box)
+
+    # runs the detector on keyframes and propagates the tracks on the other frames.
+    # with the default stride of 1 this is exactly process_single_image.
+    def process_frame(self, input_image):
+        if self.keyframes.stride == 1 and not self.keyframes.adaptive:
+            return self.process_single_image(input_image)
+
+        gray = self.flow.prepare(input_image)
+        if self.keyframes.is_keyframe(gray):
+            result = self.process_single_image(input_image)
+        else:
+            with self.timings.stage("propagate"):
+                result = self.propagate_tracks(input_image, gray)
+        self.prev_gray = gray
+        return result
+
+    # processes several consecutive frames: the detector runs on all of them as one batch,
+    # then tracking consumes the detections frame by frame, so the results are the same as
+    # calling process_frame on each frame. keyframe mode decides per frame, so it stays sequential.
+    # this is a generator: obstacles are updated in place, so read each frame's result before the next one.
+    def process_batch(self, input_images):
+        if self.keyframes.stride != 1 or self.keyframes.adaptive:
+            for img in input_images:
+                yield self.process_frame(img)
+            return
+        detections = self.get_yolo_model_results_batch(input_images)
+        for img, det in zip(input_images, detections):
+            yield self.process_single_image(img, det)
+
+    # moves the stored obstacles to the current frame without running the detector.
+    # ids, ages and appearance are kept, so tracks continue on the next keyframe.
+    def propagate_tracks(self, input_image, gray):
+        final_image = self.output_frame(input_image)
+        h, w, _ = input_image.shape
+
+        tracks = self.tracks
+        slots = tracks.order
+        boxes = tracks.boxes[slots].astype(np.float64)
+
+        if self.USE_MOTION_MODEL:
+            self.motion.predict(slots)
+
+        if self.PROPAGATION == 'flow' and self.prev_gray is not None:
+            new_boxes, followed = self.flow.propagate(self.prev_gray, gray, boxes)
+
+            # when the flow loses most tracks, run the detector on the next frame
+            if len(followed) > 0 and followed.mean() < 0.5:
+                self.keyframes.request_keyframe()
+
+            if self.USE_MOTION_MODEL:
+                # lost boxes fall back to the Kalman prediction, followed ones correct it
+                lost = ~followed
+                if lost.any():
+                    new_boxes[lost] = self.motion.boxes(slots[lost])
+                self.motion.update(slots[followed], new_boxes[followed])
+        elif self.USE_MOTION_MODEL:
+            new_boxes = self.motion.boxes(slots)
+        else:
+            new_boxes = boxes
 
-        self.stored_obstacles = new_obstacles
+        # keep the boxes inside the frame
+        tracks.boxes[slots] = np.clip(new_boxes, 0, [w - 1, h - 1, w - 1, h - 1])
+        if not self.HEADLESS:
+            for slot in slots[tracks.ages[slots] >= self.MIN_HIT_STREAK].tolist():
+                self.draw_obstacle(final_image, tracks.ids[slot], tracks.boxes[slot])
 
-        return final_image, self.stored_obstacles
+        return final_image, tracks.obstacles()
 
     def validate_video_format(self, file_path):
         """Validate if the video file has an acceptable format."""
@@ -457,13 +764,142 @@ class Yolo_implmentation:
             )
         return True
 
+def track_color(idxx):
+    """
+    Random function to convert an id to a color
+    Do what you want here but keep numbers below 255
+    """
+    blue = idxx*5 % 256
+    green = idxx*12 %256
+    red = idxx*23 %256
+    return (red, green, blue)
+
+
+def draw_track(image, idx, box):
+    """Draws a track box and its id in the track color, in place (needs no tracker, e.g. to draw stitched tracks)."""
+    idx = int(idx)
+    left, top, right, bottom = (int(v) for v in box)
+    cv2.rectangle(image, (left, top), (right, bottom), track_color(idx*10), thickness=7)
+    cv2.putText(image, str(idx),(left - 10,top - 10),cv2.FONT_HERSHEY_SIMPLEX, 1, track_color(idx*10),thickness=4)
+
+
+def as_detection_array(predictions):
+    """
+    Detector output (a torch tensor or array of [x1, y1, x2, y2, conf, cls] rows) as an (N, 6) float32 array.
+    CPU float32 tensors are shared, not copied.
+    """
+    if torch.is_tensor(predictions):
+        predictions = predictions.detach().cpu().numpy()
+    return np.asarray(predictions, dtype=np.float32).reshape(-1, 6)
+
+
+def parse_batch_size(value):
+    """Batch size argument: a positive integer or 'auto'."""
+    if str(value) == 'auto':
+        return 'auto'
+    batch_size = int(value)
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1 or 'auto'")
+    return batch_size
+
+
+def iter_frame_batches(cap, batch_size, first_frames=(), pool=None):
+    """
+    Decode frames ahead and yield them as lists of up to batch_size RGB frames.
+    first_frames are frames that were already decoded (e.g. to tune the batch size).
+    With a FramePool (see video_pipeline.py) the frames are converted into recycled buffers
+    and decoding reuses one BGR buffer, so no frame is allocated once the pool is warm.
+    """
+    frames = list(first_frames)
+    bgr = None
+    while True:
+        while len(frames) < batch_size:
+            ret, bgr = cap.read(bgr)
+            if not ret:
+                break
+            rgb = pool.acquire(bgr.shape) if pool is not None else None
+            frames.append(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=rgb))
+        if len(frames) == 0:
+            return
+        yield frames[:batch_size]
+        frames = frames[batch_size:]
+
+
+def resolve_batch_size(yolo_obj, cap, batch_size):
+    """
+    Returns the batch size to use and the frames decoded to pick it.
+    'auto' times the detector on the first frames of the video (see tune_batch_size).
+    """
+    if batch_size != 'auto':
+        return batch_size, []
+    sample = list(next(iter_frame_batches(cap, min(os.cpu_count() or 1, 16)), []))
+    if len(sample) == 0:
+        return 1, sample
+    return yolo_obj.tune_batch_size(sample), sample
+
+
+def track_record(frame_index, obstacles):
+    """One JSON-friendly line of the track table: the frame number and its tracks."""
+    return {
+        "frame": frame_index,
+        "tracks": [{"id": obs.idx, "bbox": obs.box, "class": obs.category, "age": obs.age, "unmatched_age": obs.unmatched_age} for obs in obstacles],
+    }
+
+
+def profile_startup(encoder_path, crop_size):
+    # import-time breakdown (in a fresh interpreter), then the model loading of a first tracker
+    from startup_profile import startup_report, format_startup_report
+    print(format_startup_report(startup_report('object_tracking')))
+    start = time()
+    tracker = Yolo_implmentation(encoder_path=encoder_path, crop_size=crop_size)
+    tracker.model
+    print(f"first tracker ready in {time() - start:.2f} s, models loaded: {registry.loaded()}")
+
+
 def main():
     parser = argparse.ArgumentParser(description='Process video with YOLO object detection')
-    parser.add_argument('video_path', type=str, 
+    parser.add_argument('video_path', type=str, nargs='?',
                         help='Path to the input video file (supported formats: .mp4, .avi, .mov)')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='Run the detector every N frames and propagate the tracks in between (default: 1)')
+    parser.add_argument('--adaptive-keyframes', action='store_true',
+                        help='Also run the detector when the scene changes a lot between keyframes')
+    parser.add_argument('--propagation', choices=PROPAGATION_MODES, default='flow',
+                        help='How tracks move between keyframes (default: flow)')
+    parser.add_argument('--batch-size', type=parse_batch_size, default=1,
+                        help="Run the detector on this many frames at once, or 'auto' to tune it to the available cores (default: 1)")
+    parser.add_argument('--headless', action='store_true',
+                        help='Tracks only: skip drawing and video writing, write one JSON line of tracks per frame')
+    parser.add_argument('--tracks-output', type=str, default='output_tracks.jsonl',
+                        help='Where --headless writes the track records (default: output_tracks.jsonl)')
+    parser.add_argument('--lazy-embedding', action='store_true',
+                        help='Only run the ReID encoder on detections that geometry alone cannot match')
+    parser.add_argument('--encoder', type=str, default='models/model640.pt',
+                        help='ReID encoder model, e.g. a lighter one from projection_head.py (default: models/model640.pt)')
+    parser.add_argument('--crop-size', type=int, default=128,
+                        help='Side of the square crops given to the ReID encoder (default: 128)')
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help='Profile the tracking of the video with cProfile or pyinstrument')
+    parser.add_argument('--profile-output', type=str, default=None,
+                        help='Where --profile saves the profile (default: output_profile.prof or .html)')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print where the import time goes and how long the first tracker takes to load, then exit')
     args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup(args.encoder, (args.crop_size, args.crop_size))
+        return
+    if args.video_path is None:
+        parser.error("the following arguments are required: video_path")
+    from tqdm import tqdm
     # Create instance of YOLO implementation class
-    yolo_obj = Yolo_implmentation()
+    try:
+        yolo_obj = Yolo_implmentation(encoder_path=args.encoder, crop_size=(args.crop_size, args.crop_size))
+    except ValueError as e:
+        print(f"\nError: {str(e)}")
+        return
+    yolo_obj.set_keyframe_mode(args.detect_every, args.adaptive_keyframes, args.propagation)
+    yolo_obj.HEADLESS = args.headless
+    yolo_obj.LAZY_EMBEDDING = args.lazy_embedding
     try:
         # Validate input file exists
         if not os.path.exists(args.video_path):
@@ -478,8 +914,7 @@ def main():
         # Initialize global variables
         # global stored_obstacles
         # global idx
-        yolo_obj.stored_obstacles = []
-        yolo_obj.idx = 0
+        yolo_obj.reset()
 
         
 
@@ -498,40 +933,58 @@ def main():
         print(f"Resolution: {frame_width}x{frame_height}")
         print(f"FPS: {fps}")
         print(f"Total frames: {total_frames}")
-        print(f"Output will be saved as: output_video.mp4\n")
+        if args.headless:
+            output_path = args.tracks_output
+        print(f"Output will be saved as: {output_path}\n")
 
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+        # Create video writer (headless mode writes the track records instead)
+        out = None
+        if not args.headless:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+
+        batch_size, sample_frames = resolve_batch_size(yolo_obj, cap, args.batch_size)
+        if args.batch_size == 'auto':
+            print(f"Auto-tuned batch size: {batch_size}\n")
 
         # Process video frames with progress bar
-        with tqdm(total=total_frames, desc="Processing frames") as pbar:
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-
-                # Convert frame from BGR to RGB for processing
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                # Process frame
-                processed_frame, stored_obstacles = yolo_obj.process_single_image(frame_rgb)
-                
-                # Convert back to BGR for writing
-                processed_frame_bgr = cv2.cvtColor(processed_frame, cv2.COLOR_RGB2BGR)
-                
-                # Write frame
-                out.write(processed_frame_bgr)
-                
+        # decoding (BGR->RGB), detection/tracking and encoding (RGB->BGR + write) run as
+        # separate pipeline stages, frames are decoded batch_size at a time (see video_pipeline.py)
+        # decoded frames are recycled once written, the tracker draws on them in place
+        pool = FramePool()
+        # the tracks file is closed (and flushed) even when the tracking fails part way
+        with open(output_path, 'w') if args.headless else nullcontext() as tracks_file, \
+                tqdm(total=total_frames, desc="Processing frames") as pbar:
+            def on_result(processed_frame, obstacles):
+                if args.headless:
+                    # obstacles are snapshots of this frame, write them before the next one
+                    tracks_file.write(json.dumps(track_record(pbar.n, obstacles)) + "\n")
                 pbar.update(1)
 
+            pipeline = VideoPipeline(iter_frame_batches(cap, batch_size, sample_frames, pool), yolo_obj.process_batch,
+                                     writer=out, on_result=on_result, pool=pool, timings=yolo_obj.timings)
+            # the profile covers the tracking thread, decoding and encoding run in their own threads
+            profile_path = args.profile_output or ('output_profile.html' if args.profile == 'pyinstrument' else 'output_profile.prof')
+            with profile_job(args.profile, profile_path):
+                report = pipeline.run()
+
+        print()
+        print(format_pipeline_report(report))
+        print()
+        print(format_stage_report(yolo_obj.timings.report()))
+        if args.profile is not None:
+            print(f"Profile saved as: {profile_path}")
+        embedding = yolo_obj.embedding_report()
+        print(f"ReID crops encoded: {embedding['encoded']} of {embedding['detections']} detections ({embedding['encoded_fraction'] * 100:.1f}%)")
+
         # Release resources
         cap.release()
-        out.release()
+        if out is not None:
+            out.release()
         cv2.destroyAllWindows()
 
         print(f"\nProcessing complete!")
-        print(f"Output saved as: output_video.mp4")
+        print(f"Output saved as: {output_path}")
 
     except Exception as e:
         print(f"\nError: {str(e)}")
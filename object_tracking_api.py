@@ -1,24 +1,23 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from fastapi.responses import PlainTextResponse
 import shutil
 import os
 import cv2
-import torch
-import numpy as np
+from functools import lru_cache
 from uuid import uuid4
 import sys
+import threading
 sys.path.append("/Users/chinmay/Documents/multi_object_tracking")
-from object_tracking import Yolo_implmentation 
-from time import time
-from pymongo import MongoClient
-import os 
-import boto3
+from object_tracking import Yolo_implmentation, PROPAGATION_MODES, parse_batch_size, iter_frame_batches, resolve_batch_size
+from video_pipeline import VideoPipeline, FramePool, format_pipeline_report
+from stream_engine import StreamEngine
+from sharded_tracking import track_sharded, render_tracks, format_shard_report
+from model_registry import preload
+from job_queue import JobQueue, WorkerPool
+from stage_timing import StageTimings, stage_timings, profile_job, PROFILERS
 from dotenv import load_dotenv
-import uuid
-import mimetypes
-import io
-import tempfile
 from tqdm import tqdm
 
 load_dotenv()
@@ -32,19 +31,25 @@ S3_REGION = os.getenv("AWS_S3_REGION")
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY,
-    region_name=S3_REGION
-)
-res = s3_client.list_buckets()
-print("Buckets available:", [bucket["Name"] for bucket in res["Buckets"]])
-
-
-client = MongoClient(MONGO_URI)
-db = client["object_tracking_db"]
-collection = db["tracking_results"]
+# the S3 and Mongo clients are created on first use, not at import: importing the API makes no
+# network call, and boto3 / pymongo are only imported when a request needs them
+@lru_cache(maxsize=None)
+def get_s3_client():
+    import boto3
+    return boto3.client(
+        "s3",
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+        region_name=S3_REGION
+    )
+
+
+@lru_cache(maxsize=None)
+def get_collection():
+    from pymongo import MongoClient
+    client = MongoClient(MONGO_URI)
+    db = client["object_tracking_db"]
+    return db["tracking_results"]
 
 # fastAPI connections
 app = FastAPI()
@@ -58,12 +63,81 @@ app.add_middleware(
 )
 
 # Initialize YOLO tracking model
-yolo_tracker = Yolo_implmentation()
+# REID_ENCODER / REID_CROP_SIZE pick a lighter ReID encoder per deployment (see projection_head.py)
+REID_ENCODER = os.getenv("REID_ENCODER", "models/model640.pt")
+REID_CROP_SIZE = int(os.getenv("REID_CROP_SIZE", "128"))
+
+# every upload is a stream of one engine: its own tracks, with the detector and encoder shared
+# and batched across the uploads being processed at the same time (see stream_engine.py)
+STREAM_MAX_BATCH = int(os.getenv("STREAM_MAX_BATCH", "8"))
+# worker processes of a sharded upload (see sharded_tracking.py), 0 = one per core
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
 
 # Storage for tracking results
 tracking_results = {}
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# /upload only queues the video, JOB_WORKERS workers process the queue (see job_queue.py).
+# JOB_MODE=process runs every job in a worker process with its own tracker, JOB_MODE=thread
+# runs them on threads of this server, through the shared engine below
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_MODE = os.getenv("JOB_MODE", "process")
+
+# models are loaded once per process (see model_registry.py), by the first tracker.
+# PRELOAD_MODELS=1 loads them at import instead, before any fork, so pre-fork servers
+# (e.g. gunicorn --preload) share them copy-on-write between their workers. that only pays off
+# when the jobs run in this process (JOB_MODE=thread): the job worker processes are spawned,
+# not forked, and load their own models, so the server would hold a copy nobody uses
+if os.getenv("PRELOAD_MODELS", "0") == "1" and JOB_MODE == "thread":
+    preload(encoder_path=REID_ENCODER)
+
+# the engine, the job queue and the workers are built on first use, not at import: importing the
+# API (as every worker process does) loads no model, starts no thread and creates no file
+engine = None
+engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The stream engine of this process, with its tracker, started on first use."""
+    global engine
+    with engine_lock:
+        if engine is None:
+            tracker = Yolo_implmentation(encoder_path=REID_ENCODER, crop_size=(REID_CROP_SIZE, REID_CROP_SIZE))
+            engine = StreamEngine(tracker, max_batch=STREAM_MAX_BATCH).start()
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_job_queue():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return JobQueue(os.path.join(UPLOAD_DIR, "jobs.db"))
+
+
+@lru_cache(maxsize=None)
+def get_worker_pool():
+    # worker processes build their engine before the first job and report their stage timings
+    # after every job, /metrics adds them up; worker threads record into this server's timings
+    stats = "object_tracking_api:worker_timings" if JOB_MODE == "process" else None
+    return WorkerPool(get_job_queue(), "object_tracking_api:run_job", workers=JOB_WORKERS, mode=JOB_MODE,
+                      initializer="object_tracking_api:init_worker", stats=stats)
+
+
+def init_worker():
+    get_engine()
+
+
+def worker_timings():
+    return stage_timings.snapshot()
+
+
+@app.on_event("startup")
+def start_workers():
+    get_worker_pool().start()
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    get_worker_pool().stop()
 
 
 def upload_to_s3(file_path):
@@ -72,7 +146,7 @@ def upload_to_s3(file_path):
     content_type = "video/mp4"
     
     with open(file_path, "rb") as file_data:
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=S3_BUCKET,
             Key=file_name,
             Body=file_data,
@@ -81,10 +155,55 @@ def upload_to_s3(file_path):
     
     return f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{file_name}"
 
-def process_file(file_path, file_id, file_name):
-    """Process the uploaded image/video and return tracking results using object tracking."""
+def process_file(file_path, file_id, file_name, detect_every=1, adaptive_keyframes=False, propagation="flow", batch_size=1, headless=False, lazy_embedding=False, profile=None, shards=1, progress=None):
+    """Process the uploaded image/video and return tracking results using object tracking.
+    detect_every > 1 runs the detector only on keyframes and propagates the tracks in between.
+    batch_size frames (or 'auto') go through the detector at once.
+    headless only stores the track records: no drawing, no video and no S3 upload (returns None).
+    lazy_embedding only runs the ReID encoder on detections that geometry alone cannot match.
+    profile ('cprofile' or 'pyinstrument') saves a profile of the tracking to uploads/{file_id}_profile.prof / .html;
+    a profiled job runs on its own thread instead of the shared engine, so the profile only holds this job.
+    shards > 1 tracks the video in that many time segments on worker processes and stitches the track ids.
+    progress(frames, total_frames) is called as the frames are tracked."""
     results = []
+    if shards > 1:
+        settings = {"encoder_path": REID_ENCODER, "crop_size": (REID_CROP_SIZE, REID_CROP_SIZE), "detect_every": detect_every,
+                    "adaptive_keyframes": adaptive_keyframes, "propagation": propagation, "lazy_embedding": lazy_embedding,
+                    "batch_size": batch_size}
+        process_video_sharded(file_path, file_id, results, settings, shards, headless, progress)
+    else:
+        engine = get_engine()
+        stream = engine.open_stream(file_id)
+        tracker = stream.tracker
+        tracker.set_keyframe_mode(detect_every, adaptive_keyframes, propagation)
+        tracker.HEADLESS = headless
+        tracker.LAZY_EMBEDDING = lazy_embedding
+        try:
+            process_video(stream, file_path, file_id, results, batch_size, headless, profile, progress)
+        finally:
+            print(f"stream {file_id}: {engine.close_stream(stream)}")
+
+    output_path = os.path.join(UPLOAD_DIR, f"{file_id}_processed.mp4")
+    with stage_timings.stage("s3_upload"):
+        s3_url = None if headless else upload_to_s3(output_path)
+
+    with stage_timings.stage("mongo_write"):
+        get_collection().insert_one({
+            "file_id": file_id,
+            "file_name": file_name,
+            "s3_url": s3_url,
+            "results": results
+        })
+    
+    return s3_url
+
 
+def profile_path(file_id, profile):
+    return os.path.join(UPLOAD_DIR, f"{file_id}_profile.{'html' if profile == 'pyinstrument' else 'prof'}")
+
+
+def process_video(stream, file_path, file_id, results, batch_size, headless, profile=None, progress=None):
+    """Runs the video through the stream, appends the formatted results of every frame to results."""
     if file_path.endswith((".mp4", ".avi")):
         cap = cv2.VideoCapture(file_path)
         if not cap.isOpened():
@@ -97,64 +216,142 @@ def process_file(file_path, file_id, file_name):
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
         output_path = os.path.join(UPLOAD_DIR, f"{file_id}_processed.mp4")
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+        out = None
+        if not headless:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
         
+        batch_size, sample_frames = resolve_batch_size(stream.tracker, cap, batch_size)
+
+        # decoded frames are recycled once written, the tracker draws on them in place
+        pool = FramePool()
         with tqdm(total=total_frames, desc="Processing frames") as pbar:
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                processed_frame, frame_results = yolo_tracker.process_single_image(frame_rgb)
+            def on_result(processed_frame, frame_results):
+                # obstacles are updated in place, format them before the next frame
                 results.append(format_results(frame_results))
-                
-                processed_frame_bgr = cv2.cvtColor(processed_frame, cv2.COLOR_RGB2BGR)
-                out.write(processed_frame_bgr)
-                
                 pbar.update(1)
+                if progress is not None:
+                    progress(len(results), total_frames)
+
+            # decode, track and encode run as separate stages with bounded queues
+            # a profiled job tracks its frames in this thread, where the profiler can see them
+            process_batch = stream.tracker.process_batch if profile is not None else stream.process_batch
+            pipeline = VideoPipeline(iter_frame_batches(cap, batch_size, sample_frames, pool), process_batch,
+                                     writer=out, on_result=on_result, pool=pool, timings=stage_timings)
+            with profile_job(profile, profile_path(file_id, profile)):
+                report = pipeline.run()
+        print(format_pipeline_report(report))
         
         cap.release()
-        out.release()
+        if out is not None:
+            out.release()
         cv2.destroyAllWindows()
 
-    s3_url = upload_to_s3(output_path)
 
-    collection.insert_one({
-        "file_id": file_id,
-        "file_name": file_name,
-        "s3_url": s3_url,
-        "results": results
-    })
-    
-    return s3_url
+def process_video_sharded(file_path, file_id, results, settings, shards, headless, progress=None):
+    """Tracks the video in time segments on worker processes (see sharded_tracking.py), then draws the stitched tracks."""
+    cap = cv2.VideoCapture(file_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    done = [0]
+
+    def on_shard(index, frames):
+        # progress moves a segment at a time
+        done[0] += frames
+        if progress is not None:
+            progress(done[0], total_frames)
+
+    frames, report = track_sharded(file_path, shards, workers=SHARD_WORKERS or None, settings=settings, on_shard=on_shard)
+    print(format_shard_report(report))
+    results.extend(format_results(obstacles) for obstacles in frames)
+    if not headless:
+        with stage_timings.stage("render"):
+            render_tracks(file_path, os.path.join(UPLOAD_DIR, f"{file_id}_processed.mp4"), frames)
 
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), detect_every: int = 1, adaptive_keyframes: bool = False, propagation: str = "flow", batch_size: str = "1", headless: bool = False, lazy_embedding: bool = False, profile: str = None, shards: int = 1):
     file_extension = file.filename.split(".")[-1]
     if file_extension not in [ "mp4", "avi"]:
         return {"error": "Unsupported file format"}
+    if detect_every < 1:
+        return {"error": "detect_every must be at least 1"}
+    if propagation not in PROPAGATION_MODES:
+        return {"error": f"Unsupported propagation mode, use one of: {', '.join(PROPAGATION_MODES)}"}
+    try:
+        batch_size = parse_batch_size(batch_size)
+    except ValueError:
+        return {"error": "batch_size must be a positive integer or 'auto'"}
+    if profile is not None and profile not in PROFILERS:
+        return {"error": f"Unsupported profiler, use one of: {', '.join(PROFILERS)}"}
+    if shards < 1:
+        return {"error": "shards must be at least 1"}
+    if shards > 1 and profile is not None:
+        return {"error": "profile is not supported for sharded jobs, the tracking runs in worker processes"}
     
     # Save the file
+    jobs = get_job_queue()
     file_id = str(uuid4())
     file_name = file.filename
     file_path = os.path.join(UPLOAD_DIR, f"{file_id}.{file_extension}")
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Process file using object tracking
-    result = process_file(file_path, file_id, file_name)
-    
-    return {"file_id": file_id, "s3_url": result, "message": "File uploaded and processed successfully"}
+        # copying a large upload is blocking file IO, keep it off the event loop
+        await run_in_threadpool(shutil.copyfileobj, file.file, buffer)
+
+    # Queue the file for object tracking, the workers pick it up; follow it with /jobs/{file_id}
+    jobs.submit(file_id, {"file_path": file_path, "file_id": file_id, "file_name": file_name, "detect_every": detect_every,
+                          "adaptive_keyframes": adaptive_keyframes, "propagation": propagation, "batch_size": batch_size,
+                          "headless": headless, "lazy_embedding": lazy_embedding, "profile": profile, "shards": shards})
+    return {"file_id": file_id, "job_id": file_id, "state": "queued", "status_url": f"/jobs/{file_id}",
+            "message": "File uploaded, processing queued"}
+
+
+def run_job(params, progress):
+    """Job handler of the workers: processes the uploaded file, the result is what /jobs/{id} reports when done."""
+    s3_url = process_file(**params, progress=progress)
+    result = {"file_id": params["file_id"], "s3_url": s3_url, "message": "File processed successfully"}
+    if params["headless"]:
+        # only the track records were stored, fetch them with /results/{file_id}
+        result["message"] = "File tracked successfully (tracks only, no video)"
+    if params["profile"] is not None:
+        result["profile"] = profile_path(params["file_id"], params["profile"])
+    return result
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """State (queued, running, done, failed), frames processed, FPS and ETA of an upload's job."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job ID not found")
+    return job
+
+
+@app.get("/jobs")
+def get_jobs():
+    """Number of jobs in every state and the workers running them."""
+    return {"jobs": get_job_queue().counts(), "workers": JOB_WORKERS, "workers_alive": get_worker_pool().alive(), "mode": JOB_MODE}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Per-stage duration histograms (decode, detect, embed, ..., s3_upload) in the Prometheus text format,
+    of this server and of every job worker process.
+    """
+    timings = StageTimings()
+    timings.merge(stage_timings.snapshot())
+    if JOB_MODE == "process":
+        for snapshot in get_job_queue().worker_stats():
+            timings.merge(snapshot)
+    return timings.prometheus()
 
     
 
 
 @app.get("/results/{file_id}")
 def get_results(file_id: str):
-    result = collection.find_one({"file_id": file_id}, {"_id":0}) # Exclude mongodb's _id field 
+    result = get_collection().find_one({"file_id": file_id}, {"_id":0}) # Exclude mongodb's _id field 
 
     if not result:
         raise HTTPException(status_code=404,  detail = "File ID not found")
@@ -175,7 +372,7 @@ def get_results(file_id: str):
 @app.get("/files")
 def get_all_files():
     """Return a list of all stored file names and their corresponding file IDs."""
-    files = collection.find({}, {"_id": 0, "file_id": 1, "file_name": 1})  # Get only file_id and file_name
+    files = get_collection().find({}, {"_id": 0, "file_id": 1, "file_name": 1})  # Get only file_id and file_name
     file_list = list(files)
     
     if not file_list:
@@ -187,7 +384,7 @@ def get_all_files():
 @app.get("/get-video/{file_id}")
 def get_video(file_id: str):
     """Retrieve the S3 URL of a processed video using file_id."""
-    file_entry = collection.find_one({"file_id": file_id})
+    file_entry = get_collection().find_one({"file_id": file_id})
     if not file_entry:
         raise HTTPException(status_code=404, detail="File not found")
     return {"s3_url": file_entry["s3_url"]}
@@ -195,13 +392,13 @@ def get_video(file_id: str):
 @app.delete("/delete/{file_id}")
 async def delete_file(file_id: str):
     """Delete a file entry from the database based on file_id."""
-    # result = collection.delete_one({"file_id": file_id})
+    # result = get_collection().delete_one({"file_id": file_id})
 
     # if result.deleted_count == 0:
     #     raise HTTPException(status_code=404, detail="File ID not found")
 
     # return {"message": "File successfully deleted"}
-    file_entry = collection.find_one({"file_id": file_id})
+    file_entry = get_collection().find_one({"file_id": file_id})
     
     if not file_entry:
         raise HTTPException(status_code=404, detail="File ID not found")
@@ -210,11 +407,11 @@ async def delete_file(file_id: str):
     if s3_url:
         s3_object_key = s3_url.split("/")[-1]  # Extract object key from S3 URL
         try:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_object_key)
+            get_s3_client().delete_object(Bucket=S3_BUCKET, Key=s3_object_key)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to delete from S3: {str(e)}")
     
-    result = collection.delete_one({"file_id": file_id})
+    result = get_collection().delete_one({"file_id": file_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="File ID not found")
     
@@ -240,10 +437,16 @@ def format_obstacle(obstacle):
     return {
         "id": obstacle.idx,
         "bbox": obstacle.box,
+        "class": obstacle.category,
         "age": obstacle.age,
         "unmatched_age": obstacle.unmatched_age
     }
 if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        from startup_profile import startup_report, format_startup_report
+        print(format_startup_report(startup_report("object_tracking_api")))
+        sys.exit(0)
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
 
@@ -254,6 +457,10 @@ curl -X 'POST' \
   -F 'file=@sample_video.mp4'
 
 
+curl -X 'GET' \
+  'http://localhost:8000/jobs/123e4567-e89b-12d3-a456-426614174000'
+
+
 curl -X 'GET' \
   'http://localhost:8000/results/123e4567-e89b-12d3-a456-426614174000'
 
@@ -0,0 +1,152 @@
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# lighter ReID embeddings.
+# a linear projection head maps the 1024-dim SiameseNetwork embedding to 128 or 256 dims.
+# the head is fitted with PCA on embeddings the encoder already produced, so no training is
+# needed, and the tracker stores and compares 4-8x smaller features per track.
+#
+#   python projection_head.py models/model640.pt --video sample.mp4 --dim 256 --output models/model640_pca256.pt
+#
+# the saved file holds the weights of the conv stack and of the head (state dicts, no pickled
+# classes) and is loaded like models/model640.pt (Yolo_implmentation(encoder_path=...)): the model
+# registry rebuilds the encoder from it with load_projected_encoder.
+
+
+class ProjectedEncoder(nn.Module):
+    """
+    SiameseNetwork conv stack followed by a linear head. Same forward_once as SiameseNetwork,
+    always returns (N, dim) embeddings.
+    """
+    def __init__(self, net, head):
+        super().__init__()
+        self.net = net
+        self.head = head
+
+    def forward_once(self, x):
+        return self.head(torch.flatten(self.net(x), 1))
+
+    def forward(self, x):
+        return self.forward_once(x)
+
+
+def save_projected_encoder(net, head, path):
+    """Saves the SiameseNetwork conv stack and the head as state dicts, with the head's dimensions."""
+    torch.save({"projection_head": {"in_dim": head.in_features, "dim": head.out_features},
+                "net": net.state_dict(), "head": head.state_dict()}, path)
+
+
+def is_projected_checkpoint(checkpoint):
+    return isinstance(checkpoint, dict) and "projection_head" in checkpoint
+
+
+def load_projected_encoder(checkpoint):
+    """ProjectedEncoder rebuilt from a checkpoint of save_projected_encoder (already loaded with torch.load)."""
+    from siamese_net import SiameseNetwork
+
+    net = SiameseNetwork().net
+    net.load_state_dict(checkpoint["net"])
+    dims = checkpoint["projection_head"]
+    head = nn.Linear(dims["in_dim"], dims["dim"])
+    head.load_state_dict(checkpoint["head"])
+    return ProjectedEncoder(net, head).eval()
+
+
+def check_round_trip(encoder, path, crop_size=(128, 128), atol=1e-5):
+    """
+    Loads the saved encoder back through a fresh model registry, as the tracker does, and checks
+    it gives the same embeddings as encoder on random crops. Returns the largest difference.
+    """
+    from model_registry import ModelRegistry
+
+    crops = torch.rand(4, 3, *crop_size)
+    with torch.inference_mode():
+        expected = encoder.forward_once(crops)
+        actual = ModelRegistry().encoder(path).forward_once(crops)
+    if expected.shape != actual.shape:
+        raise RuntimeError(f"{path} loads as an encoder of {tuple(actual.shape)} embeddings, expected {tuple(expected.shape)}")
+    difference = float((expected - actual).abs().max())
+    if difference > atol:
+        raise RuntimeError(f"{path} does not load back to the same encoder (max difference {difference:.2e})")
+    return difference
+
+
+def fit_pca_head(embeddings, dim):
+    """
+    Linear layer projecting (N, D) embeddings on their first dim principal components:
+    head(x) = components @ (x - mean).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64).reshape(len(embeddings), -1)
+    if dim > min(embeddings.shape):
+        raise ValueError(f"Need at least {dim} embeddings of at least {dim} values to fit a {dim}-dim head")
+    mean = embeddings.mean(axis=0)
+    # rows of vt are the principal directions, by decreasing variance
+    _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+    components = vt[:dim]
+
+    head = nn.Linear(embeddings.shape[1], dim)
+    with torch.no_grad():
+        head.weight.copy_(torch.from_numpy(components))
+        head.bias.copy_(torch.from_numpy(-components @ mean))
+    return head
+
+
+def collect_embeddings(tracker, video_path, max_frames=300, every=5):
+    """
+    Raw encoder embeddings of the detections of every `every`-th frame of a video,
+    cropped the same way the tracker crops them.
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    embeddings = []
+    frame_index = 0
+    while frame_index < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_index % every == 0:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            _, detections = tracker.get_yolo_model_results(frame, draw=False)
+            _, crops = tracker.crop_frames(frame, detections[:, :4])
+            if len(crops) > 0:
+                with torch.inference_mode():
+                    output = tracker.encoder.forward_once(crops)
+                embeddings.append(output.reshape(len(crops), -1).numpy())
+        frame_index += 1
+    cap.release()
+    return np.concatenate(embeddings) if embeddings else np.empty((0, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit a PCA projection head on top of a ReID encoder')
+    parser.add_argument('model', type=str, help='SiameseNetwork checkpoint, e.g. models/model640.pt')
+    parser.add_argument('--dim', type=int, default=256, help='Embedding size after the head (default: 256)')
+    parser.add_argument('--embeddings', type=str, default=None, help='.npy file of (N, D) embeddings of the model')
+    parser.add_argument('--video', type=str, default=None, help='Video to collect the embeddings from instead')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--output', type=str, required=True, help='Where to save the model with its head')
+    args = parser.parse_args()
+
+    model = torch.load(args.model, map_location=torch.device('cpu')).eval()
+    if args.embeddings is not None:
+        embeddings = np.load(args.embeddings)
+    elif args.video is not None:
+        from object_tracking import Yolo_implmentation
+        embeddings = collect_embeddings(Yolo_implmentation(encoder_path=args.model), args.video, args.max_frames)
+    else:
+        parser.error("give --embeddings or --video")
+
+    head = fit_pca_head(embeddings, args.dim)
+    explained = np.var((embeddings - embeddings.mean(axis=0)) @ head.weight.detach().numpy().T, axis=0).sum() / np.var(embeddings, axis=0).sum()
+    save_projected_encoder(model.net, head, args.output)
+    check_round_trip(ProjectedEncoder(model.net, head).eval(), args.output)
+    print(f"fitted a {embeddings.shape[1]} -> {args.dim} head on {len(embeddings)} embeddings "
+          f"({explained * 100:.1f}% of the variance), saved to {args.output} (loads back through the model registry)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from time import perf_counter
+
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from cost_matrix import box_iou_matrix
+from stage_timing import StageTimings, stage_timings
+from track_store import Obstacle
+
+# time-sharded tracking of one long video.
+# the video is cut into K segments that overlap by `overlap` frames, every segment is tracked by
+# a worker process with a tracker of its own (headless, the models are loaded once per worker),
+# and the track ids are stitched across the segment boundaries afterwards: both neighbouring
+# segments track the overlap window, a track of the earlier segment and one of the later segment
+# are the same object when their boxes overlap over that window (mean IoU) and their appearance
+# embeddings agree, pairs are picked with the Hungarian algorithm. the later segment uses the
+# window only to warm its tracks up, the result of every frame comes from the segment owning it.
+# tracking time scales with the number of workers; the annotated video is drawn afterwards from
+# the stitched table in one decode / draw / encode pass (see render_tracks). the stage timings of
+# the segments are added to the stage_timings of the calling process.
+#
+#   frames, report = track_sharded("long.mp4", shards=8, overlap=30)
+#   render_tracks("long.mp4", "long_processed.mp4", frames)
+#
+# or from the command line:
+#   python sharded_tracking.py long.mp4 --shards 8 --output long_processed.mp4
+
+
+def plan_shards(total_frames, shards, overlap):
+    """
+    (first, start, end) frame ranges of the segments: a segment owns the frames start..end-1 and
+    reads from first = start - overlap to warm its tracks up. The last end is None (up to the end
+    of the video, the frame count of a container is not always exact).
+    """
+    shards = max(1, min(shards, total_frames))
+    bounds = np.linspace(0, total_frames, shards + 1).round().astype(int).tolist()
+    plan = [(max(0, start - overlap), start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+    plan[-1] = (plan[-1][0], plan[-1][1], None)
+    return plan
+
+
+def init_worker(threads):
+    # split the cores between the workers instead of every worker using all of them
+    import torch
+    torch.set_num_threads(threads)
+
+
+def shard_batches(cap, batch_size, count, first_frames=()):
+    # the first `count` frames of the capture (all of them when count is None), in batches
+    from object_tracking import iter_frame_batches
+    for batch in iter_frame_batches(cap, batch_size, first_frames):
+        if count is not None:
+            batch = batch[:count]
+            count -= len(batch)
+        yield batch
+        if count is not None and count <= 0:
+            return
+
+
+def track_shard(video_path, first, start, end, overlap, settings):
+    """
+    Tracks frames first..end-1 of the video in this process. Returns the tracks of every frame
+    as (id, box, class, age, unmatched_age) tuples, and the appearance embedding of the tracks
+    seen in the warm up window (lead) and in the last `overlap` frames (tail), for the stitching,
+    and the stage timings of the segment.
+    """
+    from object_tracking import Yolo_implmentation, resolve_batch_size
+    from video_pipeline import VideoPipeline
+
+    tracker = Yolo_implmentation(encoder_path=settings.get("encoder_path", "models/model640.pt"),
+                                 crop_size=settings.get("crop_size", (128, 128)))
+    tracker.HEADLESS = True
+    # timings of this segment only, the worker may have tracked others before
+    tracker.timings = StageTimings()
+    tracker.LAZY_EMBEDDING = settings.get("lazy_embedding", False)
+    tracker.set_keyframe_mode(settings.get("detect_every", 1), settings.get("adaptive_keyframes", False),
+                              settings.get("propagation", "flow"))
+    tracker.reset()
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file '{video_path}'")
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    tail_start = end - overlap if end is not None else None
+    frames = []
+    lead_embeddings = {}
+    tail_embeddings = {}
+
+    def on_result(processed_frame, obstacles):
+        frame = first + len(frames)
+        frames.append([(obs.idx, obs.box, obs.category, obs.age, obs.unmatched_age) for obs in obstacles])
+        # latest appearance of the tracks in the overlap windows (the gallery EMA, unit length)
+        window = lead_embeddings if frame < start else tail_embeddings if tail_start is not None and frame >= tail_start else None
+        if window is not None:
+            slots = tracker.tracks.order
+            slots = slots[tracker.gallery.counts[slots] > 0]
+            window.update(zip(tracker.tracks.ids[slots].tolist(), tracker.gallery.embeddings(slots)))
+
+    begin = perf_counter()
+    batch_size, sample_frames = resolve_batch_size(tracker, cap, settings.get("batch_size", 1))
+    pipeline = VideoPipeline(shard_batches(cap, batch_size, None if end is None else end - first, sample_frames),
+                             tracker.process_batch, on_result=on_result, timings=tracker.timings)
+    pipeline.run()
+    cap.release()
+    seconds = perf_counter() - begin
+    return {"first": first, "start": start, "frames": frames, "lead_embeddings": lead_embeddings,
+            "tail_embeddings": tail_embeddings, "seconds": seconds, "fps": len(frames) / seconds if seconds else 0.0,
+            "timings": tracker.timings.snapshot()}
+
+
+def match_window(previous, current, min_iou=0.3, min_similarity=0.5, appearance_weight=0.5):
+    """
+    Pairs (previous id, current id) of the same objects in the frames both shards tracked.
+    A pair scores the sum of its IoU over the window divided by the frames either track was seen
+    in, plus appearance_weight times the cosine similarity of the embeddings when both have one;
+    pairs under min_iou or min_similarity are never matched. Also returns the age difference of
+    every pair on the last frame both were seen, to carry the ages on.
+    """
+    first, last = current["first"], current["start"]
+    iou_sum, together, seen = {}, {}, {}
+    last_ages = {}
+    for frame in range(first, last):
+        index = frame - previous["first"]
+        if index >= len(previous["frames"]) or frame - first >= len(current["frames"]):
+            break
+        # only the frames where a track was really observed, not the ones it was coasting
+        old = [t for t in previous["frames"][index] if t[4] == 0]
+        new = [t for t in current["frames"][frame - first] if t[4] == 0]
+        for t in old:
+            seen[0, t[0]] = seen.get((0, t[0]), 0) + 1
+        for t in new:
+            seen[1, t[0]] = seen.get((1, t[0]), 0) + 1
+        if not old or not new:
+            continue
+        iou = box_iou_matrix(np.array([t[1] for t in old], dtype=np.float64), np.array([t[1] for t in new], dtype=np.float64))
+        for i, j in zip(*np.nonzero(iou > 0)):
+            key = old[i][0], new[j][0]
+            iou_sum[key] = iou_sum.get(key, 0.0) + iou[i, j]
+            together[key] = together.get(key, 0) + 1
+            last_ages[key] = old[i][3] - new[j][3]
+    if not iou_sum:
+        return [], {}
+
+    old_ids = sorted({a for a, _ in iou_sum})
+    new_ids = sorted({b for _, b in iou_sum})
+    score = np.zeros((len(old_ids), len(new_ids)))
+    for (a, b), total in iou_sum.items():
+        mean_iou = total / (seen[0, a] + seen[1, b] - together[a, b])
+        if mean_iou < min_iou:
+            continue
+        old_embedding = previous["tail_embeddings"].get(a)
+        new_embedding = current["lead_embeddings"].get(b)
+        similarity = None if old_embedding is None or new_embedding is None else float(old_embedding @ new_embedding)
+        if similarity is not None and similarity < min_similarity:
+            continue
+        score[old_ids.index(a), new_ids.index(b)] = mean_iou + appearance_weight * (similarity or 0.0)
+    rows, cols = linear_sum_assignment(-score)
+    pairs = [(old_ids[r], new_ids[c]) for r, c in zip(rows, cols) if score[r, c] > 0]
+    return pairs, {pair: last_ages[pair] for pair in pairs}
+
+
+def stitch(shards, **match_kwargs):
+    """
+    Per frame lists of Obstacles with ids that are consistent over the whole video, from the
+    track_shard results in video order. Returns the frames and the number of stitched tracks.
+    """
+    frames = []
+    next_id = 0
+    previous = previous_ids = None
+    stitched = 0
+    for shard in shards:
+        # local id -> (global id, age offset)
+        ids = {}
+        if previous is not None:
+            pairs, age_offsets = match_window(previous, shard, **match_kwargs)
+            for a, b in pairs:
+                if a in previous_ids:
+                    global_id, offset = previous_ids[a]
+                    ids[b] = (global_id, offset + age_offsets[a, b])
+            stitched += len(ids)
+        for tracks in shard["frames"][shard["start"] - shard["first"]:]:
+            obstacles = []
+            for idx, box, category, age, unmatched_age in tracks:
+                if idx not in ids:
+                    ids[idx] = (next_id, 0)
+                    next_id += 1
+                global_id, offset = ids[idx]
+                obstacles.append(Obstacle(global_id, box, age=age + offset, unmatched_age=unmatched_age, category=category))
+            frames.append(obstacles)
+        previous, previous_ids = shard, ids
+    return frames, stitched
+
+
+def track_sharded(video_path, shards=None, overlap=30, workers=None, settings=None, on_shard=None, **match_kwargs):
+    """
+    Tracks the video in `shards` overlapping segments on `workers` processes (both default to the
+    number of cores) and stitches the ids. settings: tracker settings of the workers (encoder_path,
+    crop_size, detect_every, adaptive_keyframes, propagation, lazy_embedding, batch_size).
+    on_shard is called with (shard index, frames owned) as the segments finish.
+    Returns the Obstacles of every frame and a report of the run.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file '{video_path}'. The file might be corrupted.")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    cores = os.cpu_count() or 1
+    workers = workers or cores
+    plan = plan_shards(total_frames, shards or workers, overlap)
+    workers = min(workers, len(plan))
+
+    begin = perf_counter()
+    results = [None] * len(plan)
+    # spawn, not fork: the parent may be a server with threads (and torch) running
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                             initializer=init_worker, initargs=(max(1, cores // workers),)) as pool:
+        futures = {pool.submit(track_shard, video_path, first, start, end, overlap, settings or {}): index
+                   for index, (first, start, end) in enumerate(plan)}
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            stage_timings.merge(results[index]["timings"])
+            if on_shard is not None:
+                first, start, _ = plan[index]
+                on_shard(index, len(results[index]["frames"]) - (start - first))
+    frames, stitched = stitch(results, **match_kwargs)
+    wall_time = perf_counter() - begin
+
+    report = {
+        "shards": len(plan),
+        "workers": workers,
+        "overlap": overlap,
+        "frames": len(frames),
+        "stitched_tracks": stitched,
+        "wall_s": round(wall_time, 3),
+        "fps": round(len(frames) / wall_time, 2) if wall_time else 0.0,
+        "shard_fps": [round(result["fps"], 2) for result in results],
+    }
+    return frames, report
+
+
+def render_tracks(video_path, output_path, frames, min_hit_streak=1, batch_size=8):
+    """Writes the video with the tracks of `frames` (e.g. from track_sharded) drawn on it."""
+    from object_tracking import iter_frame_batches, draw_track
+    from video_pipeline import VideoPipeline, FramePool
+
+    cap = cv2.VideoCapture(video_path)
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    drawn = iter(frames)
+
+    def draw_batch(batch):
+        for frame in batch:
+            obstacles = next(drawn, [])
+            for obstacle in obstacles:
+                if obstacle.age >= min_hit_streak:
+                    draw_track(frame, obstacle.idx, obstacle.box)
+            yield frame, obstacles
+
+    pool = FramePool()
+    report = VideoPipeline(iter_frame_batches(cap, batch_size, pool=pool), draw_batch, writer=out, pool=pool).run()
+    cap.release()
+    out.release()
+    return report
+
+
+def format_shard_report(report):
+    lines = [f"{report['frames']} frames in {report['shards']} shards on {report['workers']} workers: "
+             f"{report['fps']} FPS over {report['wall_s']} s, {report['stitched_tracks']} tracks stitched"]
+    lines.append("  shard FPS: " + ", ".join(f"{fps:.1f}" for fps in report["shard_fps"]))
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+    import json
+    from object_tracking import parse_batch_size, track_record
+
+    parser = argparse.ArgumentParser(description='Track one long video in parallel time segments and stitch the ids')
+    parser.add_argument('video_path', type=str)
+    parser.add_argument('--shards', type=int, default=None, help='Segments to cut the video into (default: --workers)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: number of cores)')
+    parser.add_argument('--overlap', type=int, default=30, help='Frames tracked by both neighbouring segments (default: 30)')
+    parser.add_argument('--batch-size', type=parse_batch_size, default=1)
+    parser.add_argument('--detect-every', type=int, default=1)
+    parser.add_argument('--lazy-embedding', action='store_true')
+    parser.add_argument('--tracks-output', type=str, default='output_tracks.jsonl')
+    parser.add_argument('--output', type=str, default=None, help='Also write the annotated video here')
+    args = parser.parse_args()
+
+    settings = {"batch_size": args.batch_size, "detect_every": args.detect_every, "lazy_embedding": args.lazy_embedding}
+    frames, report = track_sharded(args.video_path, args.shards, args.overlap, args.workers, settings,
+                                   on_shard=lambda index, count: print(f"shard {index} done: {count} frames"))
+    print(format_shard_report(report))
+    with open(args.tracks_output, 'w') as f:
+        f.writelines(json.dumps(track_record(index, obstacles)) + "\n" for index, obstacles in enumerate(frames))
+    if args.output is not None:
+        render_tracks(args.video_path, args.output, frames)
+        print(f"Output saved as: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
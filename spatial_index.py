@@ -0,0 +1,224 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from cost_matrix import as_box_array, as_feature_array, normalize_features, total_cost_pairs, box_iou_pairs, sanchez_matilla_pairs, yu_pairs, gate_costs
+
+# spatial gating for the association step.
+# instead of scoring every stored obstacle against every new detection, the old boxes are put
+# in a uniform grid and only (old, new) pairs whose boxes overlap (or are within a motion radius)
+# become candidates. the candidate graph is split into connected components and the Hungarian
+# algorithm runs on each component independently (components with a single pair are matched
+# directly), so the work grows with the number of neighbours instead of with N x M.
+
+
+class SpatialGrid:
+    def __init__(self, boxes, cell_size=None, radius=0):
+        """
+        Build a uniform grid over boxes (N,4) [x1, y1, x2, y2].
+        Each box is grown by radius pixels on every side before it is inserted,
+        so a query also returns boxes that are close but not touching.
+        cell_size defaults to the median box side, which keeps a box in a handful of cells.
+        """
+        self.boxes = as_box_array(boxes)
+        self.radius = radius
+        self.expanded = self.boxes + np.array([-radius, -radius, radius, radius], dtype=np.float64)
+
+        if cell_size is None:
+            if len(self.boxes) > 0:
+                sides = np.concatenate([self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1]])
+                cell_size = float(np.median(sides)) + 2 * radius
+            else:
+                cell_size = 64
+        self.cell_size = max(cell_size, 1.0)
+
+        # (cell id, box index) entries sorted by cell id: the boxes of a cell are one contiguous run
+        # of self.entries, found with searchsorted. the grid covers the cells of the indexed boxes only.
+        ranges = self.cell_range(self.expanded)
+        if len(ranges) > 0:
+            self.origin = ranges[:, :2].min(axis=0)
+            self.shape = ranges[:, 2:].max(axis=0) - self.origin + 1
+        else:
+            self.origin = np.zeros(2, dtype=np.int64)
+            self.shape = np.zeros(2, dtype=np.int64)
+        # cell range of every box relative to the origin, to report each pair from one cell only
+        self.ranges = ranges - np.tile(self.origin, 2)
+        owners, keys = self.cell_keys(ranges)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.entries = owners[order]
+
+    def cell_range(self, boxes):
+        # integer cell coordinates covered by each box
+        return np.floor(boxes / self.cell_size).astype(np.int64)
+
+    def cell_keys(self, ranges):
+        """
+        (box index, cell id) of every grid cell covered by every range (N,4) [cx1, cy1, cx2, cy2],
+        clipped to the grid. Cell ids are cx * height + cy, relative to the grid origin.
+        """
+        x1, y1 = np.maximum(ranges[:, 0] - self.origin[0], 0), np.maximum(ranges[:, 1] - self.origin[1], 0)
+        x2, y2 = np.minimum(ranges[:, 2] - self.origin[0], self.shape[0] - 1), np.minimum(ranges[:, 3] - self.origin[1], self.shape[1] - 1)
+        nx, ny = np.maximum(x2 - x1 + 1, 0), np.maximum(y2 - y1 + 1, 0)
+        counts = nx * ny
+        owners = np.repeat(np.arange(len(ranges), dtype=np.int64), counts)
+        # position of every cell within its box's block of cells
+        offsets = np.arange(len(owners), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = x1[owners] + offsets // ny[owners]
+        cy = y1[owners] + offsets % ny[owners]
+        return owners, cx * self.shape[1] + cy
+
+    def query(self, boxes):
+        """
+        Return (rows, cols) index arrays of every (indexed box, query box) pair that overlap.
+        rows index the boxes the grid was built on, cols index the query boxes.
+        """
+        boxes = as_box_array(boxes)
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if len(self.keys) == 0 or len(boxes) == 0:
+            return empty
+
+        # the run of entries of every (query box, cell) pair, expanded to (indexed box, query box) pairs
+        ranges = self.cell_range(boxes) - np.tile(self.origin, 2)
+        queries, keys = self.cell_keys(self.cell_range(boxes))
+        left = np.searchsorted(self.keys, keys, side='left')
+        counts = np.searchsorted(self.keys, keys, side='right') - left
+        cols = np.repeat(queries, counts)
+        offsets = np.arange(len(cols), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self.entries[np.repeat(left, counts) + offsets]
+        keys = np.repeat(keys, counts)
+        # a pair sharing several cells is kept only in the first cell of their common range
+        first = (keys // self.shape[1] == np.maximum(self.ranges[rows, 0], ranges[cols, 0])) & \
+                (keys % self.shape[1] == np.maximum(self.ranges[rows, 1], ranges[cols, 1]))
+        rows, cols = rows[first], cols[first]
+
+        # cells only give a coarse answer, keep the pairs whose (expanded) boxes really overlap.
+        # the +1 matches the pixel convention used by box_iou.
+        old = self.expanded[rows]
+        new = boxes[cols]
+        overlap = (np.minimum(old[:, 2], new[:, 2]) - np.maximum(old[:, 0], new[:, 0]) + 1 > 0) & \
+                  (np.minimum(old[:, 3], new[:, 3]) - np.maximum(old[:, 1], new[:, 1]) + 1 > 0)
+        return rows[overlap], cols[overlap]
+
+
+def candidate_components(num_old, num_new, rows, cols):
+    """
+    Group candidate pairs into connected components of the bipartite (old, new) graph.
+    Returns the component label of every pair and the number of components.
+    """
+    # old boxes are nodes 0..num_old-1 and new boxes are nodes num_old..num_old+num_new-1
+    n = num_old + num_new
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols + num_old)), shape=(n, n))
+    num_components, labels = connected_components(graph, directed=False)
+    return labels[rows], num_components
+
+
+def component_index(labels, nodes, num_nodes):
+    """
+    For pairs sorted by component label: {label: sorted node indices of the component} and the
+    position of every pair's node in its component's list.
+    """
+    keys, inverse = np.unique(labels * num_nodes + nodes, return_inverse=True)
+    key_labels = keys // num_nodes
+    first = np.searchsorted(key_labels, key_labels, side='left')
+    bounds = np.r_[0, np.flatnonzero(np.diff(key_labels)) + 1, len(keys)] if len(keys) else np.zeros(1, dtype=np.int64)
+    members = {int(key_labels[a]): keys[a:b] % num_nodes for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist())}
+    return members, (np.arange(len(keys)) - first)[inverse]
+
+
+def gated_assignment(old_boxes, new_boxes, old_features, new_features, radius=0, cell_size=None, features_are_normalized=False, w=1920, h=1080, **cost_kwargs):
+    """
+    Hungarian assignment restricted to spatially close pairs.
+    Returns (rows, cols, costs) for every assigned pair with a non-zero cost.
+    Pairs that are never candidates (or fail the total_cost thresholds) have cost 0 in the
+    dense matrix, so solving each connected component of the remaining pairs on its own
+    keeps the same matches above the IoU gate as linear_sum_assignment on the full matrix.
+    w, h: frame size of the Sanchez-Matilla cost, as in total_cost_matrix.
+    """
+    old_boxes = as_box_array(old_boxes)
+    new_boxes = as_box_array(new_boxes)
+    old_features = as_feature_array(old_features)
+    new_features = as_feature_array(new_features, old_features.shape[1])
+    empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    grid = SpatialGrid(old_boxes, cell_size=cell_size, radius=radius)
+    rows, cols = grid.query(new_boxes)
+    if len(rows) == 0:
+        return empty
+
+    # the box thresholds first, they are cheap: only the pairs passing them get a feature similarity
+    old, new = old_boxes[rows], new_boxes[cols]
+    box_gate = gate_costs(box_iou_pairs(old, new), sanchez_matilla_pairs(old, new, w=w, h=h), yu_pairs(old, new), 1.0, **cost_kwargs) > 0
+    rows, cols = rows[box_gate], cols[box_gate]
+    if len(rows) == 0:
+        return empty
+
+    # score only the candidate pairs, then drop the ones that failed a threshold
+    if not features_are_normalized:
+        old_features = normalize_features(old_features)
+        new_features = normalize_features(new_features)
+    costs = total_cost_pairs(old_boxes[rows], new_boxes[cols], old_features[rows], new_features[cols], w=w, h=h, features_are_normalized=True, **cost_kwargs)
+    keep = costs > 0
+    rows, cols, costs = rows[keep], cols[keep], costs[keep]
+    if len(rows) == 0:
+        return empty
+
+    pair_labels, num_components = candidate_components(len(old_boxes), len(new_boxes), rows, cols)
+    pairs_per_component = np.bincount(pair_labels, minlength=num_components)
+
+    # a component with a single pair is matched directly, no Hungarian solve needed
+    single = pairs_per_component[pair_labels] == 1
+    assigned_rows, assigned_cols, assigned_costs = [rows[single]], [cols[single]], [costs[single]]
+
+    # the remaining (conflicting) components get a small dense solve each
+    shared = np.flatnonzero(~single)
+    order = shared[np.argsort(pair_labels[shared], kind='stable')]
+    labels = pair_labels[order]
+    boundaries = np.flatnonzero(np.diff(labels)) + 1
+    # component-local row / column of every pair, for all components at once
+    comp_rows, local_rows = component_index(labels, rows[order], len(old_boxes))
+    comp_cols, local_cols = component_index(labels, cols[order], len(new_boxes))
+    starts = np.r_[0, boundaries]
+    ends = np.r_[boundaries, len(order)]
+    for start, end in zip(starts.tolist(), ends.tolist()) if len(order) else []:
+        comp_old, comp_new = comp_rows[labels[start]], comp_cols[labels[start]]
+        cost = np.zeros((len(comp_old), len(comp_new)), dtype=np.float32)
+        cost[local_rows[start:end], local_cols[start:end]] = costs[order[start:end]]
+        r, c = linear_sum_assignment(-cost)
+        assigned = cost[r, c] > 0
+        assigned_rows.append(comp_old[r[assigned]])
+        assigned_cols.append(comp_new[c[assigned]])
+        assigned_costs.append(cost[r, c][assigned])
+
+    return np.concatenate(assigned_rows), np.concatenate(assigned_cols), np.concatenate(assigned_costs)
+
+
+def unambiguous_pairs(old_boxes, new_boxes, clear_iou=0.5, radius=0, old_groups=None, new_groups=None, w=1920, h=1080, **thresholds):
+    """
+    Geometry-only first stage of a lazy association: (rows, cols) of the pairs that need no
+    appearance check. A pair is unambiguous when it passes the box thresholds of total_cost,
+    has an IoU of at least clear_iou, and neither box has any other candidate passing them.
+    With old_groups / new_groups (class group of every box) only boxes of the same group are candidates.
+    """
+    old_boxes = as_box_array(old_boxes)
+    new_boxes = as_box_array(new_boxes)
+    empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if len(old_boxes) == 0 or len(new_boxes) == 0:
+        return empty
+
+    rows, cols = SpatialGrid(old_boxes, radius=radius).query(new_boxes)
+    if old_groups is not None and new_groups is not None:
+        same = np.asarray(old_groups)[rows] == np.asarray(new_groups)[cols]
+        rows, cols = rows[same], cols[same]
+    old, new = old_boxes[rows], new_boxes[cols]
+    iou = box_iou_pairs(old, new)
+    # the feature gate is left out (always passes), it is what this stage avoids computing
+    costs = gate_costs(iou, sanchez_matilla_pairs(old, new, w=w, h=h), yu_pairs(old, new), 1.0, **thresholds)
+    keep = costs > 0
+    rows, cols, iou = rows[keep], cols[keep], iou[keep]
+
+    # exactly one candidate on both sides, and a clear overlap
+    single = (np.bincount(rows, minlength=len(old_boxes))[rows] == 1) & (np.bincount(cols, minlength=len(new_boxes))[cols] == 1)
+    clear = single & (iou >= clear_iou)
+    return rows[clear], cols[clear]
@@ -0,0 +1,166 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+# per-stage timing of the tracker and the video jobs.
+# every stage (decode, detect, crop, embed, associate, update, draw, encode, s3_upload, ...) records
+# how long each run of it took. a stage keeps a Prometheus-style histogram (fixed buckets, count
+# and sum, for /metrics) and the most recent samples (for exact p50 / p95 / p99 in the reports).
+# recording is one perf_counter pair and a lock, cheap next to any stage it measures.
+# the histograms of other processes (job workers, shard workers) are added with snapshot() / merge().
+#
+#   with stage_timings.stage("detect"):
+#       ...
+#   print(format_stage_report(stage_timings.report()))
+
+# histogram buckets in seconds, from 0.5 ms to 10 s
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageHistogram:
+    def __init__(self, window=4096):
+        # counts[i] is the number of samples <= BUCKETS[i] (and > BUCKETS[i - 1]), the last one is +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def percentiles(self, qs=(50, 95, 99)):
+        if not self.recent:
+            return [None] * len(qs)
+        return [float(v) for v in np.percentile(np.fromiter(self.recent, dtype=np.float64), qs)]
+
+
+class StageTimings:
+    def __init__(self, window=4096):
+        """Histograms of stage durations by stage name. window: recent samples kept per stage for the percentiles."""
+        self.window = window
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.enabled = True
+
+    def observe(self, name, seconds, count=1):
+        """Records one run of the stage, or `count` runs that took `seconds` in total (e.g. a batch)."""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = StageHistogram(self.window)
+            for _ in range(count):
+                histogram.observe(seconds / count)
+
+    @contextmanager
+    def stage(self, name, count=1):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, count)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def snapshot(self):
+        """The histograms (bucket counts, count and sum per stage) as a JSON-friendly dict, for merge()."""
+        with self.lock:
+            return {name: {"counts": list(histogram.counts), "count": histogram.count, "sum": histogram.sum}
+                    for name, histogram in self.stages.items()}
+
+    def merge(self, snapshot):
+        """Adds the histograms of a snapshot() (e.g. from another process); the percentiles only see local samples."""
+        with self.lock:
+            for name, other in snapshot.items():
+                histogram = self.stages.get(name)
+                if histogram is None:
+                    histogram = self.stages[name] = StageHistogram(self.window)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, other["counts"])]
+                histogram.count += other["count"]
+                histogram.sum += other["sum"]
+
+    def report(self):
+        """count, total seconds, mean, p50, p95 and p99 in ms per stage."""
+        with self.lock:
+            report = {}
+            for name, histogram in self.stages.items():
+                p50, p95, p99 = (round(v * 1000, 3) if v is not None else None for v in histogram.percentiles())
+                report[name] = {"count": histogram.count, "total_s": round(histogram.sum, 3),
+                                "mean_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else None,
+                                "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+            return report
+
+    def prometheus(self, metric="mot_stage_duration_seconds"):
+        """The histograms in the Prometheus text exposition format."""
+        lines = [f"# HELP {metric} Duration of the tracking pipeline stages.", f"# TYPE {metric} histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+# timings of this process, shared by every tracker, the CLI and the API
+stage_timings = StageTimings()
+
+
+def format_stage_report(report):
+    lines = [f"{'stage':>12} {'count':>7} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for name, r in sorted(report.items(), key=lambda item: item[1]["total_s"], reverse=True):
+        # merged stages have no local samples, so no percentiles
+        ms = " ".join(f"{r[key]:>9.3f}" if r[key] is not None else f"{'-':>9}" for key in ("mean_ms", "p50_ms", "p95_ms", "p99_ms"))
+        lines.append(f"{name:>12} {r['count']:>7} {r['total_s']:>9.3f} {ms}")
+    return "\n".join(lines)
+
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+@contextmanager
+def profile_job(kind, output_path):
+    """
+    Profiles the code run inside the block in the current thread and saves the profile to
+    output_path: cProfile stats (load with pstats or snakeviz) or a pyinstrument HTML page.
+    kind None profiles nothing.
+    """
+    if kind is None:
+        yield
+        return
+    if kind == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output_path)
+    elif kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise RuntimeError("pyinstrument is not installed (pip install pyinstrument)")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(output_path, 'w') as f:
+                f.write(profiler.output_html())
+    else:
+        raise ValueError(f"Unknown profiler '{kind}', use one of: {', '.join(PROFILERS)}")
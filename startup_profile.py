@@ -0,0 +1,74 @@
+import subprocess
+import sys
+from collections import defaultdict
+
+# import-time breakdown of a module, to keep the cold start of autoscaled workers under a budget.
+# the module is imported in a fresh interpreter with -X importtime, the time of every imported
+# module is summed per top-level package and the slowest packages are reported.
+#
+#   python startup_profile.py object_tracking object_tracking_api --budget 3.0
+#   python object_tracking.py --profile-startup
+#
+# exits with status 1 when a module takes longer than the budget to import.
+
+
+def import_times(module):
+    """
+    (self seconds per imported module, total seconds) of `import module` in a new interpreter.
+    Raises RuntimeError when the import fails.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us) / 1e6
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    return times, sum(times.values())
+
+
+def package_breakdown(times):
+    # seconds per top-level package, slowest first
+    packages = defaultdict(float)
+    for name, seconds in times.items():
+        packages[name.split('.')[0]] += seconds
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def startup_report(module, top=10):
+    times, total = import_times(module)
+    return {"module": module, "total_s": round(total, 3), "modules": len(times),
+            "packages": [(name, round(seconds, 3)) for name, seconds in package_breakdown(times)[:top]]}
+
+
+def format_startup_report(report, budget=None):
+    lines = [f"import {report['module']}: {report['total_s']:.2f} s, {report['modules']} modules"
+             + (f" (budget {budget:.2f} s{', OVER' if report['total_s'] > budget else ''})" if budget is not None else "")]
+    for name, seconds in report["packages"]:
+        share = seconds / report["total_s"] * 100 if report["total_s"] else 0.0
+        lines.append(f"  {name:<24} {seconds:>7.3f} s {share:>5.1f}%")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import-time breakdown of modules')
+    parser.add_argument('modules', type=str, nargs='*', default=['object_tracking'])
+    parser.add_argument('--top', type=int, default=10, help='Packages to list per module')
+    parser.add_argument('--budget', type=float, default=None, help='Fail when a module takes longer (seconds) to import')
+    args = parser.parse_args(argv)
+
+    over = False
+    for module in args.modules:
+        report = startup_report(module, args.top)
+        print(format_startup_report(report, args.budget))
+        over = over or (args.budget is not None and report["total_s"] > args.budget)
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
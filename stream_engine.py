@@ -0,0 +1,268 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+from time import perf_counter
+
+import numpy as np
+import torch
+
+# multi-stream tracking engine.
+# one Yolo_implmentation holds the detector and the ReID encoder, and every stream (video) gets a
+# lightweight tracker of its own from new_stream(): its own tracks, ids, gallery and motion model,
+# no copy of the models. frames submitted to the streams are processed by one engine thread in
+# rounds: the detector runs once on the frames of all streams in the round, and the crops of
+# every stream go through the encoder as one batch (start_frame / finish_frame of the tracker).
+# the scheduler is round-robin: frames are dealt one per stream in turn, starting one stream
+# further every round, so a busy stream cannot starve the others. every stream reports the
+# latency of its frames, from submit to result.
+#
+#   engine = StreamEngine(Yolo_implmentation()).start()
+#   stream = engine.open_stream("cam1")
+#   for processed_frame, obstacles in stream.process_batch(frames): ...
+#   engine.close_stream(stream)
+#
+# or from the command line, all videos at once through one engine:
+#   python stream_engine.py cam1.mp4 cam2.mp4 --output-dir tracks/
+
+
+class TrackingStream:
+    def __init__(self, engine, name, tracker, latency_window=1000):
+        """
+        One video processed by a StreamEngine. tracker is its own Yolo_implmentation (from
+        new_stream), settings like HEADLESS or set_keyframe_mode are changed on it directly.
+        """
+        self.engine = engine
+        self.name = name
+        self.tracker = tracker
+        # (frame, future, submit time) waiting for the engine
+        self.pending = deque()
+        self.latencies = deque(maxlen=latency_window)
+        self.frames = 0
+        self.opened = perf_counter()
+        self.closed = None
+
+    def submit(self, frame):
+        """Queue an RGB frame, returns a Future of (processed_frame, obstacles)."""
+        return self.engine.submit(self, frame)
+
+    def process_batch(self, input_images):
+        # same contract as Yolo_implmentation.process_batch, so it plugs into VideoPipeline
+        futures = [self.submit(img) for img in input_images]
+        for future in futures:
+            yield future.result()
+
+    def report(self):
+        """Frames processed, frames per second since the stream was opened and latency percentiles in ms."""
+        elapsed = (self.closed or perf_counter()) - self.opened
+        latencies = np.array(self.latencies) * 1000
+        report = {"frames": self.frames, "fps": round(self.frames / elapsed, 2) if elapsed > 0 else 0.0}
+        for name, q in (("p50_ms", 50), ("p95_ms", 95), ("max_ms", 100)):
+            report[name] = round(float(np.percentile(latencies, q)), 2) if len(latencies) else None
+        return report
+
+
+class StreamEngine:
+    def __init__(self, tracker, max_batch=8, max_pending=8):
+        """
+        tracker: Yolo_implmentation whose detector and encoder all streams share
+        max_batch: most frames (over all streams) in one round
+        max_pending: most frames a stream can have waiting, submit blocks above it
+        """
+        self.tracker = tracker
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.streams = []
+        # first stream served in the next round
+        self.next_stream = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.rounds = 0
+
+    def open_stream(self, name=None, idx=0):
+        with self.condition:
+            stream = TrackingStream(self, name if name is not None else f"stream{len(self.streams)}", self.tracker.new_stream(idx))
+            self.streams.append(stream)
+        return stream
+
+    def close_stream(self, stream):
+        """Stops serving the stream once its pending frames are done. Returns its report."""
+        with self.condition:
+            while stream.pending and self.running:
+                self.condition.wait()
+            if stream in self.streams:
+                self.streams.remove(stream)
+            stream.closed = perf_counter()
+        return stream.report()
+
+    def submit(self, stream, frame):
+        future = Future()
+        with self.condition:
+            while len(stream.pending) >= self.max_pending and self.running:
+                self.condition.wait()
+            stream.pending.append((frame, future, perf_counter()))
+            self.condition.notify_all()
+        if self.thread is None:
+            # no engine thread: process right away in the caller
+            self.step()
+        return future
+
+    def schedule(self):
+        """
+        Frames of the next round: dealt one per stream in round-robin order, up to max_batch.
+        Returns a list of (stream, [(frame, future, submit time), ...]) with frames in stream order.
+        """
+        with self.condition:
+            streams = [s for s in self.streams if s.pending]
+            if not streams:
+                return []
+            start = self.next_stream % len(streams)
+            streams = streams[start:] + streams[:start]
+            self.next_stream += 1
+
+            taken = {id(s): [] for s in streams}
+            budget = self.max_batch
+            while budget > 0 and any(s.pending for s in streams):
+                for s in streams:
+                    if budget > 0 and s.pending:
+                        taken[id(s)].append(s.pending.popleft())
+                        budget -= 1
+            self.condition.notify_all()
+        return [(s, taken[id(s)]) for s in streams if taken[id(s)]]
+
+    def step(self):
+        """Processes one round. Returns the number of frames processed."""
+        work = self.schedule()
+        if not work:
+            return 0
+        try:
+            self.process_round(work)
+        except Exception as e:
+            for _, items in work:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+        self.rounds += 1
+        with self.condition:
+            self.condition.notify_all()
+        return sum(len(items) for _, items in work)
+
+    def process_round(self, work):
+        # keyframe-mode streams decide per frame whether to detect, they run their frames on their own
+        batched = []
+        for stream, items in work:
+            if stream.tracker.keyframes.stride == 1 and not stream.tracker.keyframes.adaptive:
+                batched.append((stream, items))
+                continue
+            for frame, future, submitted in items:
+                self.resolve(stream, future, submitted, stream.tracker.process_frame(frame))
+
+        # one detector call for the frames of all streams
+        frames = [frame for _, items in batched for frame, _, _ in items]
+        detections = iter(self.tracker.get_yolo_model_results_batch(frames)) if frames else iter(())
+        batched = [(s, [(item, next(detections)) for item in items]) for s, items in batched]
+
+        # wave k holds the k-th frame of every stream: frames of one stream depend on each other,
+        # frames of different streams do not, so their crops share one encoder batch
+        waves = max((len(items) for _, items in batched), default=0)
+        for k in range(waves):
+            wave = [(s, items[k]) for s, items in batched if k < len(items)]
+            started = [s.tracker.start_frame(frame, det) + (s, future, submitted) for s, ((frame, future, submitted), det) in wave]
+            crops = [crops_pytorch for _, crops_pytorch, _, _, _ in started]
+            features = self.tracker.get_features(torch.cat(crops)) if sum(len(c) for c in crops) else []
+            offset = 0
+            for frame_state, crops_pytorch, stream, future, submitted in started:
+                stream_features = features[offset:offset + len(crops_pytorch)]
+                offset += len(crops_pytorch)
+                self.resolve(stream, future, submitted, stream.tracker.finish_frame(frame_state, stream_features))
+
+    def resolve(self, stream, future, submitted, result):
+        stream.latencies.append(perf_counter() - submitted)
+        stream.frames += 1
+        future.set_result(result)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not any(s.pending for s in self.streams):
+                    self.condition.wait()
+                if not self.running:
+                    return
+            self.step()
+
+    def start(self):
+        """Runs the rounds in a background thread. Returns the engine."""
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="stream-engine", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def report(self):
+        """Per-stream reports of the open streams, by name."""
+        with self.condition:
+            return {stream.name: stream.report() for stream in self.streams}
+
+
+def format_stream_report(reports):
+    lines = [f"{'stream':>12} {'frames':>7} {'FPS':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}"]
+    for name, r in reports.items():
+        lines.append(f"{name:>12} {r['frames']:>7} {r['fps']:>7.1f} {r['p50_ms'] or 0:>8.1f} {r['p95_ms'] or 0:>8.1f} {r['max_ms'] or 0:>8.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+    import json
+    import os
+    import cv2
+    from object_tracking import Yolo_implmentation, iter_frame_batches, track_record
+    from video_pipeline import VideoPipeline
+
+    parser = argparse.ArgumentParser(description='Track several videos at once with one shared detector and encoder')
+    parser.add_argument('videos', type=str, nargs='+')
+    parser.add_argument('--batch-size', type=int, default=1, help='Frames each stream submits at once')
+    parser.add_argument('--max-batch', type=int, default=8, help='Most frames over all streams in one round')
+    parser.add_argument('--output-dir', type=str, default=None, help='Write the tracks of every video to <video>_tracks.jsonl there')
+    args = parser.parse_args()
+
+    tracker = Yolo_implmentation()
+    engine = StreamEngine(tracker, max_batch=args.max_batch).start()
+    reports = {}
+
+    def run_video(path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        stream = engine.open_stream(name)
+        stream.tracker.HEADLESS = True
+        records = []
+        cap = cv2.VideoCapture(path)
+        pipeline = VideoPipeline(iter_frame_batches(cap, args.batch_size), stream.process_batch,
+                                 on_result=lambda frame, obstacles: records.append(track_record(len(records), obstacles)))
+        pipeline.run()
+        cap.release()
+        reports[name] = engine.close_stream(stream)
+        if args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+            with open(os.path.join(args.output_dir, f"{name}_tracks.jsonl"), "w") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+
+    threads = [threading.Thread(target=run_video, args=(path,)) for path in args.videos]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.stop()
+    print(format_stream_report(reports))
+    print(f"{engine.rounds} rounds")
+
+
+if __name__ == "__main__":
+    main()
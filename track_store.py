@@ -0,0 +1,108 @@
+import numpy as np
+
+# columnar track storage.
+# instead of a python list of Obstacle objects, every track lives in one slot of preallocated
+# numpy arrays (id, box, age, unmatched age). slots of removed tracks go back to a free list and
+# are reused, so matching, aging and pruning are masked array operations and the per-track cost
+# of an update is O(1). the slot number is also the row of the track in the appearance gallery
+# and in the Kalman filter.
+
+
+class Obstacle():
+    __slots__ = ('idx', 'box', 'features', 'age', 'unmatched_age', 'category')
+
+    def __init__(self, idx, box, features=None,  age=1, unmatched_age=0, category=-1):
+        """
+        Init function. The obstacle must have an id and a box.
+        Snapshot of one track handed to API consumers; the tracker itself works on TrackStore.
+        """
+        self.idx = idx
+        self.box = box
+        self.features = features
+        self.age = age
+        self.unmatched_age = unmatched_age
+        # detector class id (coco.names), -1 when unknown
+        self.category = category
+
+
+class TrackStore:
+    def __init__(self, capacity=1024):
+        """
+        capacity: maximum number of live tracks. when it is reached the stalest track is evicted.
+        """
+        self.capacity = capacity
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        # boxes stay float like the detections, they become ints only when drawn or exported
+        self.boxes = np.zeros((capacity, 4), dtype=np.float32)
+        self.ages = np.zeros(capacity, dtype=np.int64)
+        self.unmatched_ages = np.zeros(capacity, dtype=np.int64)
+        # detector class of the track (its last matched detection)
+        self.classes = np.full(capacity, -1, dtype=np.int64)
+        # frames since the appearance gallery last got a feature of the track
+        self.feature_ages = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        # live slots in track order (matched, then new, then unmatched, as the tracker builds it)
+        self.order = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.order)
+
+    def evict(self, n, protected):
+        """
+        Free n slots by removing the live tracks unmatched for longest (then the youngest),
+        never touching the protected slots. Returns the evicted slots.
+        """
+        candidates = np.flatnonzero(self.alive)
+        candidates = candidates[~np.isin(candidates, protected)]
+        # sort by unmatched age (descending), then age (ascending)
+        ranking = np.lexsort((self.ages[candidates], -self.unmatched_ages[candidates]))
+        evicted = candidates[ranking[:n]]
+        self.remove(evicted)
+        return evicted
+
+    def add(self, ids, boxes, classes=None, protected=()):
+        """
+        Store new tracks with age 1. Returns their slots and the slots evicted to make room.
+        The new slots are not appended to order, the caller decides where they go.
+        """
+        n = len(ids)
+        evicted = np.empty(0, dtype=np.int64)
+        if n > len(self.free_slots):
+            evicted = self.evict(n - len(self.free_slots), protected)
+        slots = np.array([self.free_slots.pop() for _ in range(n)], dtype=np.int64)
+
+        self.ids[slots] = ids
+        self.boxes[slots] = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.classes[slots] = -1 if classes is None else classes
+        self.ages[slots] = 1
+        self.unmatched_ages[slots] = 0
+        self.feature_ages[slots] = 0
+        self.alive[slots] = True
+        return slots, evicted
+
+    def remove(self, slots):
+        """
+        Free the slots of removed tracks.
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        self.alive[slots] = False
+        self.ids[slots] = -1
+        self.classes[slots] = -1
+        self.free_slots.extend(slots.tolist())
+        self.order = self.order[~np.isin(self.order, slots)]
+
+    def obstacles(self, slots=None):
+        """
+        Obstacle views of the given slots (all live tracks by default), in track order.
+        Boxes are exported as integer pixel coordinates.
+        """
+        slots = self.order if slots is None else slots
+        ids = self.ids[slots].tolist()
+        boxes = self.boxes[slots].astype(np.int64).tolist()
+        ages = self.ages[slots].tolist()
+        unmatched_ages = self.unmatched_ages[slots].tolist()
+        classes = self.classes[slots].tolist()
+        return [Obstacle(idx, box, age=age, unmatched_age=unmatched_age, category=category)
+                for idx, box, age, unmatched_age, category in zip(ids, boxes, ages, unmatched_ages, classes)]
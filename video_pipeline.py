@@ -0,0 +1,223 @@
+import threading
+from collections import deque
+from queue import Queue, Empty, Full
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+# staged video pipeline.
+# decode (cap.read + BGR->RGB) runs in its own thread, inference/tracking runs in the calling
+# thread and encode (RGB->BGR + out.write) runs in a writer thread. the stages talk through
+# bounded queues, so a slow stage makes the others wait instead of piling frames up in memory,
+# and end-to-end throughput gets close to the slowest stage instead of the sum of all stages.
+# OpenCV releases the GIL while decoding, converting and encoding, so the threads really overlap.
+# with a FramePool the decoded frames are recycled once they are written, so in steady state no
+# frame-sized buffer is allocated at all (the tracker draws on the decoded frame in place).
+
+# marks the end of the stream in a queue
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.items = 0
+
+    def report(self, wall_time):
+        return {
+            "busy_s": round(self.busy, 3),
+            "items": self.items,
+            "utilization": round(self.busy / wall_time, 3) if wall_time > 0 else 0.0,
+        }
+
+
+class FramePool:
+    def __init__(self):
+        """
+        Reusable frame buffers. acquire() hands out a released buffer of the right shape when
+        there is one and allocates a new one otherwise, so the pool grows to the number of
+        frames in flight and then stops allocating. Safe to share between the pipeline threads.
+        """
+        self.free = deque()
+        self.allocated = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        while True:
+            try:
+                frame = self.free.pop()
+            except IndexError:
+                break
+            if frame.shape == shape and frame.dtype == dtype:
+                return frame
+        self.allocated += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, frame):
+        self.free.append(frame)
+
+
+class VideoPipeline:
+    def __init__(self, batches, process_batch, writer=None, on_result=None, queue_size=4, pool=None, timings=None):
+        """
+        batches: iterable of lists of RGB frames, consumed in the decoder thread (e.g. iter_frame_batches)
+        process_batch: function taking a list of frames and yielding (processed_frame, obstacles) per frame
+        writer: cv2.VideoWriter for the processed frames, or None to skip encoding
+        on_result: called with (processed_frame, obstacles) in the inference thread, before the next frame
+        queue_size: maximum number of batches (decode side) or frames (encode side) waiting in each queue
+        pool: FramePool the decoded frames come from; they are given back to it once processed and written
+        timings: StageTimings (see stage_timing.py) that also gets the decode and encode time of every frame
+        """
+        self.batches = batches
+        self.process_batch = process_batch
+        self.writer = writer
+        self.on_result = on_result
+        self.pool = pool
+        self.timings = timings
+        # BGR frame handed to the writer, reused for every frame
+        self.encode_buffer = None
+
+        self.decoded = Queue(maxsize=queue_size)
+        self.processed = Queue(maxsize=queue_size)
+        self.stats = {name: StageStats(name) for name in ("decode", "infer", "encode")}
+        self.wall_time = 0.0
+        self.error = None
+        self.stopped = threading.Event()
+
+    def put(self, queue, item):
+        # blocking put that gives up when another stage failed, so no thread hangs on a full queue
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue):
+        # blocking get that returns _DONE when another stage failed
+        while not self.stopped.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                continue
+        return _DONE
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def decode_stage(self):
+        stats = self.stats["decode"]
+        try:
+            iterator = iter(self.batches)
+            while not self.stopped.is_set():
+                start = perf_counter()
+                batch = next(iterator, None)
+                elapsed = perf_counter() - start
+                stats.busy += elapsed
+                if batch is None:
+                    break
+                if self.timings is not None:
+                    self.timings.observe("decode", elapsed, count=len(batch))
+                stats.items += len(batch)
+                if not self.put(self.decoded, batch):
+                    return
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.put(self.decoded, _DONE)
+
+    def encode_stage(self):
+        stats = self.stats["encode"]
+        try:
+            while True:
+                item = self.get(self.processed)
+                if item is _DONE:
+                    return
+                frame, recycle = item
+                start = perf_counter()
+                if self.encode_buffer is None or self.encode_buffer.shape != frame.shape:
+                    self.encode_buffer = np.empty_like(frame)
+                self.writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=self.encode_buffer))
+                if recycle:
+                    self.pool.release(frame)
+                elapsed = perf_counter() - start
+                stats.busy += elapsed
+                if self.timings is not None:
+                    self.timings.observe("encode", elapsed)
+                stats.items += 1
+        except Exception as e:
+            self.fail(e)
+
+    def run(self):
+        """
+        Runs the whole video through the pipeline. Re-raises the first error of any stage.
+        """
+        start_time = perf_counter()
+        decoder = threading.Thread(target=self.decode_stage, name="decode", daemon=True)
+        encoder = threading.Thread(target=self.encode_stage, name="encode", daemon=True) if self.writer is not None else None
+        decoder.start()
+        if encoder is not None:
+            encoder.start()
+
+        stats = self.stats["infer"]
+        try:
+            while True:
+                batch = self.get(self.decoded)
+                if batch is _DONE:
+                    break
+                start = perf_counter()
+                results = self.process_batch(batch)
+                for frame in batch:
+                    # time only the work of this stage, not the waits on the writer queue
+                    result = next(results, None)
+                    if result is None:
+                        break
+                    processed_frame, obstacles = result
+                    if self.on_result is not None:
+                        self.on_result(processed_frame, obstacles)
+                    stats.busy += perf_counter() - start
+                    stats.items += 1
+                    # a frame drawn in place goes back to the pool after the writer is done with it,
+                    # any other decoded frame can be reused right away
+                    in_place = processed_frame is frame
+                    if self.pool is not None and not (encoder is not None and in_place):
+                        self.pool.release(frame)
+                    if encoder is not None and not self.put(self.processed, (processed_frame, self.pool is not None and in_place)):
+                        break
+                    start = perf_counter()
+        except Exception as e:
+            self.fail(e)
+        finally:
+            # let the writer drain what is left, then stop the decoder (which may wait on a full queue)
+            if encoder is not None:
+                self.put(self.processed, _DONE)
+                encoder.join()
+            self.stopped.set()
+            decoder.join()
+            self.wall_time = perf_counter() - start_time
+
+        if self.error is not None:
+            raise self.error
+        return self.report()
+
+    def report(self):
+        """
+        Busy time, number of frames and utilization (busy time / wall time) of every stage.
+        """
+        report = {name: stats.report(self.wall_time) for name, stats in self.stats.items()}
+        report["wall_s"] = round(self.wall_time, 3)
+        report["fps"] = round(self.stats["infer"].items / self.wall_time, 2) if self.wall_time > 0 else 0.0
+        return report
+
+
+def format_pipeline_report(report):
+    """Human readable version of VideoPipeline.report()."""
+    lines = [f"Pipeline: {report['fps']} FPS over {report['wall_s']} s"]
+    for name in ("decode", "infer", "encode"):
+        stage = report[name]
+        lines.append(f"  {name:<7} busy {stage['busy_s']:>8.2f} s  utilization {stage['utilization'] * 100:>5.1f}%  frames {stage['items']}")
+    return "\n".join(lines)